@@ -1,3 +1,5 @@
+from typing import Dict, List, Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -11,6 +13,62 @@ class Settings(BaseSettings):
     web_server_url: str
     webhook_path: str
 
+    # Окно (в секундах), за которое повторы одной и той же ошибки собираются в одну сводку
+    error_digest_window_seconds: int = 300
+
+    # Сводка уведомлений о новых записях: раз в N секунд или по M записей
+    booking_digest_enabled: bool = False
+    booking_digest_seconds: int = 120
+    booking_digest_max_events: int = 10
+
+    # Трассировка: трейсы дольше trace_slow_ms сохраняются всегда, остальные — с вероятностью trace_sample_rate
+    trace_slow_ms: int = 1000
+    trace_sample_rate: float = 0.0
+    trace_file: Optional[str] = None  # JSONL-файл; без него трейсы хранятся только в памяти
+
+    # Напоминания: за сколько часов до визита (в .env как JSON, например [24, 2]) и где хранить задачи
+    reminder_offsets_hours: List[int] = [24, 2]
+    scheduler_db_path: str = "scheduler.sqlite"
+    # URL общего хранилища задач (SQLAlchemy), если копий бота несколько; иначе используется scheduler_db_path
+    scheduler_jobstore_url: Optional[str] = None
+
+    # Выбор лидера: только лидер выполняет задачи планировщика (нужна таблица из database/sql/leases.sql).
+    # Требует общий scheduler_jobstore_url, иначе бот не запустится
+    leader_election_enabled: bool = False
+    leader_lease_ttl_seconds: int = 30
+
+    # Рабочее время по дням недели (mon..sun), в .env как JSON: {"mon": "09:00-18:00", ...}.
+    # Дня нет в словаре — выходной. Перерывы: {"mon": ["13:00-14:00"]}
+    working_hours: Dict[str, str] = {day: "09:00-18:00" for day in ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')}
+    working_breaks: Dict[str, List[str]] = {}
+    # Шаг сетки начала приема и длительность услуг, у которых она не указана (минуты)
+    slot_step_minutes: int = 60
+    default_service_duration_minutes: int = 60
+    # Ресурсы (кресла, мастера), по которым распределяются записи, в .env как JSON: ["Кресло 1", "Кресло 2"].
+    # Число ресурсов — вместимость слота. Пусто — один ресурс, как раньше (нужен database/sql/resources.sql)
+    booking_resources: List[str] = []
+    # Лист ожидания: сколько минут освободившееся время держится за клиентом, которому его предложили
+    waitlist_claim_minutes: int = 15
+
+    # Локальная копия (SQLite) справочников и ближайших записей для быстрых чтений (database/mirror.py).
+    # Нужен database/sql/mirror_sync.sql
+    read_mirror_enabled: bool = False
+    read_mirror_path: str = "mirror.sqlite"
+    read_mirror_sync_seconds: int = 5
+
+    # Вызовы Supabase (database/resilience.py): таймаут попытки, повторы чтений и предохранитель.
+    # Политики отдельных методов в .env как JSON, например:
+    # {"fetch_page": {"timeout": 3, "retries": 3, "hedge_after": 0.8}, "book_appointment": {"timeout": 10}}
+    db_call_timeout_seconds: float = 5.0
+    db_read_retries: int = 2
+    db_call_policies: Dict[str, Dict[str, float]] = {}
+    db_breaker_failure_threshold: int = 5
+    db_breaker_reset_seconds: float = 30.0
+
+    # Мультиарендность: JSON-файл с дополнительными ботами (см. utils/tenants.py).
+    # Основной бот всегда берется из BOT_TOKEN/ADMIN_ID/SUPABASE_* выше
+    tenants_file: Optional[str] = None
+
     model_config = SettingsConfigDict(env_file=".env")
 
 
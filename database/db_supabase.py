@@ -1,9 +1,10 @@
 # database/db_supabase.py
 
 import logging
-from typing import List, Optional
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
 from dataclasses import asdict, field
-from datetime import datetime, time, timedelta, date
+from datetime import datetime, time, date
+from zoneinfo import ZoneInfo
 
 # Импортируем asyncio для to_thread
 import asyncio
@@ -11,11 +12,32 @@ import asyncio
 # Используем только официальную библиотеку supabase
 # Убедитесь, что create_client возвращает правильный клиент (асинхронный)
 from supabase import create_client, Client as SupabaseConnection
-from .models import Appointment, Service, ServiceCategory
+from config_reader import config
+from .models import Appointment, BookingResult, Service, ServiceCategory, WaitlistEntry
+from .resilience import DatabaseUnavailable, Resilience, breaker_for
+from .single_flight import SingleFlight
+from utils.tracing import traced
 import utils.google_calendar  # Импортируем для использования функций Google Calendar
 
 logger = logging.getLogger(__name__)
 
+# Размер страницы для постраничного (keyset) чтения.
+# PostgREST по умолчанию обрезает ответ по max-rows (обычно 1000), поэтому берем меньше.
+PAGE_SIZE = 500
+
+# Колонки услуги (вместе с длительностью, database/sql/service_durations.sql)
+SERVICE_COLUMNS = 'id, title, description, price, icon, category_id, duration_minutes'
+
+# Колонки, которые выбираем для записей (вместе с названием, стоимостью и длительностью услуги)
+APPOINTMENT_COLUMNS = '*, services(title, price, duration_minutes), google_event_id'
+
+TIMEZONE = "Europe/Moscow"
+
+
+def local_now() -> datetime:
+    # Время записей и листа ожидания хранится без таймзоны, по Москве
+    return datetime.now(ZoneInfo(TIMEZONE)).replace(tzinfo=None)
+
 
 def parse_datetime(iso_string: Optional[str]) -> Optional[datetime]:
     """Вспомогательная функция для парсинга дат из Supabase."""
@@ -35,15 +57,182 @@ def parse_datetime(iso_string: Optional[str]) -> Optional[datetime]:
 
 
 class Database:
-    def __init__(self, url: str, key: str):
+    def __init__(self, url: str, key: str, calendar_id: Optional[str] = None):
         # --- Важно: Убедитесь, что create_client настроен для асинхронной работы ---
         # Хотя .execute() может вести себя синхронно, клиент должен быть асинхронным.
         self.client = create_client(url, key)  # Явно указываем async_client=True
+        # Одновременные одинаковые чтения идут в Supabase одним запросом
+        self.single_flight = SingleFlight()
+        # Календарь Google арендатора; None — календарь из GOOGLE_CALENDAR_ID
+        self.calendar_id = calendar_id
+        # Таймауты и повторы — свои у клиента, предохранитель — общий для проекта Supabase
+        self.resilience = Resilience.from_settings(breaker=breaker_for(url))
+        # Подписчики на освобождение времени: отмена или удаление активной записи (utils/waitlist.py)
+        self.slot_freed_listeners: List[Callable[[Appointment], Awaitable[None]]] = []
+        self._listener_tasks: set = set()
+
+    def _notify_slot_freed(self, appointment: Appointment):
+        """
+        Сообщает подписчикам, что активная запись освободила время. Подписчики работают в фоне:
+        отмена не ждет, пока лист ожидания разошлет предложения.
+        """
+        for listener in self.slot_freed_listeners:
+            task = asyncio.create_task(listener(appointment))
+            # Держим ссылку, иначе незавершенную задачу может собрать сборщик мусора
+            self._listener_tasks.add(task)
+            task.add_done_callback(self._listener_tasks.discard)
+
+    async def _execute(self, method: str, query_builder):
+        """Выполняет запрос PostgREST в потоке по политике метода (database/resilience.py)."""
+        return await self.resilience.call(method, lambda: asyncio.to_thread(query_builder.execute))
+
+    # --- Постраничное чтение по ключу (keyset pagination) ---
+    @traced("db.fetch_page")
+    async def _fetch_page(self, table: str, columns: str, sort_column: str,
+                          apply_filters: Optional[Callable], cursor: Optional[Tuple[str, str]],
+                          page_size: int) -> List[dict]:
+        """Загружает одну страницу, начиная строго после курсора (sort_value, id)."""
+        query_builder = self.client.table(table).select(columns)
+        if apply_filters:
+            query_builder = apply_filters(query_builder)
+        if cursor:
+            last_value, last_id = cursor
+            query_builder = query_builder.or_(
+                f'{sort_column}.gt."{last_value}",'
+                f'and({sort_column}.eq."{last_value}",id.gt."{last_id}")'
+            )
+        query_builder = query_builder.order(sort_column).order('id').limit(page_size)
+        response = await self._execute('fetch_page', query_builder)
+        return response.data or []
+
+    async def _iter_pages(self, table: str, columns: str, sort_column: str,
+                          apply_filters: Optional[Callable] = None,
+                          page_size: int = PAGE_SIZE) -> AsyncIterator[List[dict]]:
+        """
+        Отдает результат запроса страницами, сортируя по (sort_column, id).
+        Следующая страница запрашивается заранее, пока вызывающий код обрабатывает текущую,
+        поэтому в памяти одновременно не больше двух страниц.
+        """
+        page = await self._fetch_page(table, columns, sort_column, apply_filters, None, page_size)
+        while page:
+            next_page_task = None
+            if len(page) == page_size:
+                # Курсор берем до обработки строк: _process_appointment_rows меняет их на месте
+                cursor = (page[-1][sort_column], page[-1]['id'])
+                next_page_task = asyncio.create_task(
+                    self._fetch_page(table, columns, sort_column, apply_filters, cursor, page_size))
+            try:
+                yield page
+            except BaseException:
+                if next_page_task:
+                    next_page_task.cancel()
+                raise
+            page = await next_page_task if next_page_task else []
+
+    @staticmethod
+    def _appointment_filters(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                             status: Optional[str] = None, reminded: Optional[bool] = None,
+                             client_telegram_id: Optional[int] = None) -> Callable:
+        """Собирает функцию, накладывающую фильтры по записям на query builder."""
+        def apply_filters(query_builder):
+            if start:
+                query_builder = query_builder.gte('appointment_time', start.isoformat())
+            if end:
+                query_builder = query_builder.lte('appointment_time', end.isoformat())
+            if status:
+                query_builder = query_builder.eq('status', status)
+            if reminded is not None:
+                query_builder = query_builder.eq('reminded', reminded)
+            if client_telegram_id is not None:
+                query_builder = query_builder.eq('client_telegram_id', client_telegram_id)
+            return query_builder
+        return apply_filters
+
+    async def iter_appointments(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                                status: Optional[str] = None, reminded: Optional[bool] = None,
+                                client_telegram_id: Optional[int] = None,
+                                page_size: int = PAGE_SIZE) -> AsyncIterator[Appointment]:
+        """
+        Асинхронно перебирает записи по фильтру, постранично по (appointment_time, id).
+        Ошибки запроса пробрасываются вызывающему коду.
+        """
+        apply_filters = self._appointment_filters(start, end, status, reminded, client_telegram_id)
+        async for page in self._iter_pages('appointments', APPOINTMENT_COLUMNS, 'appointment_time',
+                                           apply_filters, page_size):
+            for app in await self._process_appointment_rows(page):
+                yield app
+
+    @traced("db.get_appointments_page")
+    async def get_appointments_page(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                                    status: Optional[str] = 'active', cursor: Optional[Tuple[str, str]] = None,
+                                    page_size: int = PAGE_SIZE,
+                                    client_telegram_id: Optional[int] = None
+                                    ) -> Tuple[List[Appointment], Optional[Tuple[str, str]]]:
+        """
+        Одна страница записей после курсора (appointment_time, id) — один ограниченный запрос.
+        Возвращает записи и курсор следующей страницы (None, если дальше ничего нет).
+        """
+        apply_filters = self._appointment_filters(start, end, status, client_telegram_id=client_telegram_id)
+        try:
+            # Берем на одну строку больше, чтобы понять, есть ли следующая страница
+            rows = await self._fetch_page('appointments', APPOINTMENT_COLUMNS, 'appointment_time',
+                                          apply_filters, cursor, page_size + 1)
+        except DatabaseUnavailable:
+            # Пустая страница выглядела бы как «записей нет»
+            raise
+        except Exception as e:
+            logger.error(f"Error getting appointments page: {e}", exc_info=True)
+            return [], None
+
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        next_cursor = (rows[-1]['appointment_time'], rows[-1]['id']) if has_more else None
+        return await self._process_appointment_rows(rows), next_cursor
+
+    @traced("db.search_appointments")
+    async def search_appointments(self, query: str, cursor: Optional[Tuple[str, str]] = None,
+                                  page_size: int = 10) -> Tuple[List[Appointment], Optional[Tuple[str, str]]]:
+        """
+        Поиск записей по имени клиента (с опечатками) или телефону через RPC по триграммным индексам
+        (database/sql/search.sql). Записи идут от новых к старым; страница — после курсора (appointment_time, id).
+        """
+        params = {'p_query': query, 'p_limit': page_size + 1}
+        if cursor:
+            params['p_before_time'], params['p_before_id'] = cursor
+        try:
+            response = await self._execute('search_appointments', self.client.rpc('search_appointments', params))
+        except DatabaseUnavailable:
+            raise
+        except Exception as e:
+            logger.error(f"Error searching appointments for '{query}': {e}", exc_info=True)
+            return [], None
+
+        rows = response.data or []
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        next_cursor = (rows[-1]['appointment_time'], rows[-1]['id']) if has_more else None
+        return await self._process_appointment_rows(rows), next_cursor
+
+    @staticmethod
+    async def _collect(iterator: AsyncIterator) -> list:
+        return [item async for item in iterator]
+
+    async def iter_vacation_periods(self, page_size: int = PAGE_SIZE) -> AsyncIterator[dict]:
+        """Асинхронно перебирает периоды отпуска, постранично по (start_date, id)."""
+        async for page in self._iter_pages('vacation_periods', 'id, start_date, end_date', 'start_date',
+                                           page_size=page_size):
+            for period in page:
+                start_date = self.parse_date(period.get('start_date'))
+                end_date = self.parse_date(period.get('end_date'))
+                if start_date and end_date:
+                    yield {'start_date': start_date, 'end_date': end_date}
 
     async def _process_appointment_rows(self, rows: List[dict]) -> List[Appointment]:
         """Вспомогательный метод для обработки списка записей."""
         appointments = []
         for row in rows:
+            # Ответы на update/delete приходят без вложенной услуги — название тогда не подставляем
+            has_service = 'services' in row
             service_data = row.pop('services', None)
 
             row['appointment_time'] = parse_datetime(row.get('appointment_time'))
@@ -52,11 +241,16 @@ class Database:
                 continue
 
             row['created_at'] = parse_datetime(row.get('created_at'))
+            if 'updated_at' in row:
+                row['updated_at'] = parse_datetime(row['updated_at'])
 
             # Убеждаемся, что google_event_id извлекается из row, если он там есть
             app = Appointment(**row)
-            app.service_title = service_data[
-                'title'] if service_data and 'title' in service_data else "Удаленная услуга"
+            if has_service:
+                app.service_title = service_data[
+                    'title'] if service_data and 'title' in service_data else "Удаленная услуга"
+                app.service_price = service_data.get('price') if service_data else None
+                app.service_duration_minutes = service_data.get('duration_minutes') if service_data else None
             appointments.append(app)
         return appointments
 
@@ -73,12 +267,14 @@ class Database:
             logger.error(f"Error getting service categories: {e}")
             return []
 
+    @traced("db.get_service_categories")
     async def get_service_categories(self) -> List[ServiceCategory]:
         try:
             # --- ВАЖНО: Убедитесь, что execute() вызывается корректно ---
             # Используйте asyncio.to_thread, если execute() синхронный
-            response = await asyncio.to_thread(
-                self.client.table('service_categories').select('*').order('title').execute)
+            query_builder = self.client.table('service_categories').select('*').order('title')
+            response = await self.single_flight.do(
+                ('service_categories',), lambda: self._execute('get_service_categories', query_builder))
             if not response.data: return []
             return [ServiceCategory(**row) for row in response.data]
         except Exception as e:
@@ -86,39 +282,46 @@ class Database:
             return []
 
     # --- ВОЗВРАЩАЕМ МЕТОД get_services_by_category ---
+    @traced("db.get_services_by_category")
     async def get_services_by_category(self, category_id: str) -> List[Service]:
         """Получает список услуг по ID категории."""
         try:
             # --- ВАЖНО: Убедитесь, что execute() вызывается корректно ---
             # Используйте asyncio.to_thread, если execute() синхронный
-            response = await asyncio.to_thread(
-                self.client.table('services').select('id, title, description, price, icon, category_id').eq(
-                    'category_id', category_id).order('title').execute)
+            query_builder = self.client.table('services').select(SERVICE_COLUMNS).eq(
+                'category_id', category_id).order('title')
+            response = await self.single_flight.do(
+                ('services_by_category', category_id), lambda: self._execute('get_services_by_category', query_builder))
             if not response.data: return []
             return [Service(**row) for row in response.data]
         except Exception as e:
             logger.error(f"Error getting services by category: {e}")
             return []
 
+    @traced("db.get_service_by_id")
     async def get_service_by_id(self, service_id: str) -> Optional[Service]:
         try:
             # --- ВАЖНО: Убедитесь, что execute() вызывается корректно ---
-            response = await asyncio.to_thread(
-                self.client.table('services').select('id, title, description, price, icon, category_id').eq('id',
-                                                                                                            service_id).limit(
-                    1).execute)
+            query_builder = self.client.table('services').select(SERVICE_COLUMNS).eq(
+                'id', service_id).limit(1)
+            response = await self.single_flight.do(
+                ('service_by_id', service_id), lambda: self._execute('get_service_by_id', query_builder))
             if not response.data: return None
             return Service(**response.data[0])
         except Exception as e:
             logger.error(f"Error getting service by id: {e}")
             return None
 
+    @traced("db.add_appointment")
     async def add_appointment(self, appointment: Appointment) -> Optional[str]:
         """Добавляет новую запись в базу данных, включая google_event_id."""
         appointment_dict = asdict(appointment)
         appointment_dict.pop('id', None)
         appointment_dict.pop('created_at', None)
         appointment_dict.pop('service_title', None)
+        appointment_dict.pop('service_price', None)
+        appointment_dict.pop('service_duration_minutes', None)
+        appointment_dict.pop('updated_at', None)
 
         appointment_dict['appointment_time'] = appointment.appointment_time.isoformat()
 
@@ -128,12 +331,26 @@ class Database:
         try:
             # --- ИСПРАВЛЕНИЕ: Вызов синхронного execute через asyncio.to_thread ---
             # Используем asyncio.to_thread, так как execute() для insert, скорее всего, синхронный
-            query_builder = self.client.table('appointments').insert(appointment_dict)
-            response = await asyncio.to_thread(query_builder.execute)
+            if appointment.idempotency_key:
+                # Повтор с тем же ключом ничего не вставляет (ON CONFLICT DO NOTHING) и возвращает исходную запись
+                query_builder = self.client.table('appointments').upsert(
+                    appointment_dict, on_conflict='idempotency_key', ignore_duplicates=True)
+            else:
+                query_builder = self.client.table('appointments').insert(appointment_dict)
+            response = await self._execute('add_appointment', query_builder)
             # ---
 
             if response and response.data and len(response.data) > 0:
                 return response.data[0].get('id')
+            elif appointment.idempotency_key:
+                existing = self.client.table('appointments').select('id') \
+                    .eq('idempotency_key', appointment.idempotency_key).limit(1)
+                response = await self._execute('get_appointment_by_idempotency_key', existing)
+                if response.data:
+                    logger.info("Appointment with idempotency key %s already exists.", appointment.idempotency_key)
+                    return response.data[0].get('id')
+                logger.error(f"Error adding appointment: Empty response from Supabase.")
+                return None
             else:
                 logger.error(f"Error adding appointment: Empty response from Supabase.")
                 return None
@@ -141,38 +358,140 @@ class Database:
             logger.error(f"Error adding appointment: {e}")
             return None
 
+    @traced("db.book_appointment")
+    async def book_appointment(self, appointment: Appointment,
+                               waitlist_entry_id: Optional[str] = None) -> BookingResult:
+        """
+        Бронирует время одним запросом через RPC book_appointment (database/sql/book_appointment.sql):
+        проверяет, что интервал записи (с учетом длительности услуг) не пересекается с другими
+        и с временем, предложенным из листа ожидания, вставляет запись и возвращает название
+        и стоимость услуги. waitlist_entry_id — заявка, по предложению которой бронируется время.
+        """
+        params = {
+            'p_client_name': appointment.client_name,
+            'p_service_id': appointment.service_id,
+            'p_appointment_time': appointment.appointment_time.isoformat(),
+            'p_client_telegram_id': appointment.client_telegram_id,
+            'p_client_phone': appointment.client_phone,
+            'p_google_event_id': appointment.google_event_id,
+            'p_default_duration_minutes': config.default_service_duration_minutes,
+            # Вместимость слота — число ресурсов; свободный ресурс выбирается в той же транзакции
+            'p_resources': config.booking_resources or None,
+            'p_resource': appointment.resource,
+            # Повтор с тем же ключом вернет уже созданную запись
+            'p_idempotency_key': appointment.idempotency_key,
+            'p_waitlist_entry_id': waitlist_entry_id,
+            'p_now': local_now().isoformat(),
+        }
+        try:
+            response = await self._execute('book_appointment', self.client.rpc('book_appointment', params))
+            data = response.data or {}
+            if isinstance(data, list):
+                data = data[0] if data else {}
+            result = BookingResult(
+                status=data.get('status', 'error'),
+                appointment_id=data.get('appointment_id'),
+                service_title=data.get('service_title'),
+                service_price=data.get('service_price'),
+                resource=data.get('resource'),
+                replayed=bool(data.get('replayed')),
+            )
+            if result.replayed:
+                logger.info("Бронирование с ключом %s уже выполнено: запись %s",
+                            appointment.idempotency_key, result.appointment_id)
+            if not result.ok:
+                logger.warning(f"Бронирование на {params['p_appointment_time']} отклонено: {result.status}")
+            return result
+        except Exception as e:
+            logger.error(f"Error booking appointment: {e}", exc_info=True)
+            return BookingResult(status='error')
+
+    # --- Аренда для выбора лидера (database/sql/leases.sql) ---
+    # Ошибки не глушатся: LeaderElector должен отличать "аренду держит другой" от сбоя сети.
+    @traced("db.acquire_lease")
+    async def acquire_lease(self, name: str, holder: str, ttl_seconds: int) -> Optional[int]:
+        """Берет или продлевает аренду. Возвращает fencing token или None, если аренду держит другой."""
+        params = {'p_name': name, 'p_holder': holder, 'p_ttl_seconds': ttl_seconds}
+        response = await self._execute('acquire_lease', self.client.rpc('acquire_lease', params))
+        return response.data
+
+    async def release_lease(self, name: str, holder: str):
+        params = {'p_name': name, 'p_holder': holder}
+        await self._execute('release_lease', self.client.rpc('release_lease', params))
+
+    @traced("db.check_lease")
+    async def check_lease(self, name: str, fencing_token: int) -> bool:
+        """Проверяет, что аренда с этим токеном все еще действует."""
+        params = {'p_name': name, 'p_fencing_token': fencing_token}
+        response = await self._execute('check_lease', self.client.rpc('check_lease', params))
+        return bool(response.data)
+
+    # --- Массовая вставка (для импорта) ---
+    @traced("db.bulk_insert")
+    async def bulk_insert(self, table: str, rows: List[dict], on_conflict: Optional[str] = None) -> List[dict]:
+        """
+        Вставляет несколько строк одним запросом и возвращает вставленные строки.
+        С on_conflict строки, уже существующие по этому ключу, пропускаются (ON CONFLICT DO NOTHING)
+        и в результат не попадают — так повтор пачки не создает дублей.
+        В отличие от add_appointment ошибки не глушатся: импорт сам решает, что с ними делать.
+        """
+        if not rows:
+            return []
+        if on_conflict:
+            query_builder = self.client.table(table).upsert(rows, on_conflict=on_conflict, ignore_duplicates=True)
+        else:
+            query_builder = self.client.table(table).insert(rows)
+        response = await self._execute('bulk_insert', query_builder)
+        return response.data or []
+
+    @traced("db.get_appointments_by_idempotency_keys")
+    async def get_appointments_by_idempotency_keys(self, keys: List[str]) -> List[dict]:
+        """Возвращает id, idempotency_key и google_event_id записей с переданными ключами (для импорта)."""
+        if not keys:
+            return []
+        query_builder = self.client.table('appointments').select('id, idempotency_key, google_event_id') \
+            .in_('idempotency_key', list(keys))
+        response = await self._execute('get_appointments_by_idempotency_keys', query_builder)
+        return response.data or []
+
+    @traced("db.get_existing_service_ids")
+    async def get_existing_service_ids(self, service_ids: List[str]) -> set:
+        """Возвращает подмножество переданных ID услуг, которые есть в базе."""
+        if not service_ids:
+            return set()
+        query_builder = self.client.table('services').select('id').in_('id', list(service_ids))
+        response = await self._execute('get_existing_service_ids', query_builder)
+        return {row['id'] for row in response.data or []}
+
+    @traced("db.get_appointments_for_day")
     async def get_appointments_for_day(self, target_date: datetime, status: str = 'active') -> List[Appointment]:
         """Получает все записи на указанный день."""
-        start_of_day = datetime.combine(target_date.date(), time.min).isoformat()
-        end_of_day = datetime.combine(target_date.date(), time.max).isoformat()
+        start_of_day = datetime.combine(target_date.date(), time.min)
+        end_of_day = datetime.combine(target_date.date(), time.max)
 
         try:
-            query_builder = self.client.table('appointments').select('*, services(title), google_event_id'). \
-                gte('appointment_time', start_of_day). \
-                lte('appointment_time', end_of_day). \
-                order('appointment_time')
-            if status:
-                query_builder = query_builder.eq('status', status)
-
-            # --- ИСПРАВЛЕНИЕ: Вызов синхронного execute через asyncio.to_thread ---
-            response = await asyncio.to_thread(query_builder.execute)
-            # ---
-
-            if not response.data: return []
-            return await self._process_appointment_rows(response.data)
+            appointments = await self.single_flight.do(
+                ('appointments_for_day', start_of_day.date(), status),
+                lambda: self._collect(self.iter_appointments(start=start_of_day, end=end_of_day, status=status)))
+            # Список у каждого вызывающего свой; сами объекты общие и не должны изменяться
+            return list(appointments)
+        except DatabaseUnavailable:
+            # Пустой список здесь означал бы «весь день свободен» — пусть вызывающий покажет, что БД недоступна
+            raise
         except Exception as e:
             logger.error(f"Error getting appointments for day: {e}", exc_info=True)
             return []
 
+    @traced("db.get_appointment_by_id")
     async def get_appointment_by_id(self, appointment_id: str) -> Optional[Appointment]:
         """Получает запись по её ID."""
         try:
-            query_builder = self.client.table('appointments').select('*, services(title), google_event_id').eq('id',
+            query_builder = self.client.table('appointments').select(APPOINTMENT_COLUMNS).eq('id',
                                                                                                                appointment_id).limit(
                 1)
 
             # --- ИСПРАВЛЕНИЕ: Вызов синхронного execute через asyncio.to_thread ---
-            response = await asyncio.to_thread(query_builder.execute)
+            response = await self._execute('get_appointment_by_id', query_builder)
             # ---
 
             if not response.data: return None
@@ -183,109 +502,96 @@ class Database:
             logger.error(f"Error getting appointment by id: {e}", exc_info=True)
             return None
 
-    async def get_upcoming_appointments_to_remind(self) -> List[Appointment]:
-        tomorrow = datetime.now() + timedelta(days=1)
-        tomorrow_start = tomorrow.replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
-        tomorrow_end = tomorrow.replace(hour=23, minute=59, second=59, microsecond=999999).isoformat()
-
-        try:
-            query_builder = self.client.table('appointments').select('*, services(title), google_event_id'). \
-                gte('appointment_time', tomorrow_start). \
-                lte('appointment_time', tomorrow_end). \
-                eq('status', 'active'). \
-                eq('reminded', False)
-
-            # --- ИСПРАВЛЕНИЕ: Вызов синхронного execute через asyncio.to_thread ---
-            response = query_builder.execute()  # <-- Без await, но обернем в to_thread
-            response = await asyncio.to_thread(response)  # <-- await-им сам результат execute, если он не корутина
-            # ---
-
-            if not response.data: return []
-            return await self._process_appointment_rows(response.data)
-        except Exception as e:
-            logger.error(f"Error getting upcoming appointments: {e}")
-            return []
-
+    @traced("db.mark_as_reminded")
     async def mark_as_reminded(self, appointment_id: str):
         try:
             # --- ИСПРАВЛЕНИЕ: Вызов синхронного execute через asyncio.to_thread ---
             query_builder = self.client.table('appointments').update({'reminded': True}).eq('id', appointment_id)
-            await asyncio.to_thread(query_builder.execute)  # <-- Без await на execute, но await на to_thread
+            await self._execute('mark_as_reminded', query_builder)
             # ---
         except Exception as e:
             logger.error(f"Error marking appointment as reminded: {e}")
 
-    async def update_appointment_status(self, appointment_id: str, status: str):
-        appointment = await self.get_appointment_by_id(appointment_id)
-
-        if not appointment:
-            logger.warning(f"Не удалось найти запись с ID {appointment_id} для обновления статуса.")
+    async def _delete_calendar_event_for(self, appointment: Appointment):
+        """Удаляет событие Google Calendar, привязанное к записи, если оно есть."""
+        if not appointment.google_event_id:
+            logger.info(
+                f"Запись '{appointment.id}' не имеет Google Event ID, поэтому удаление из Google Calendar пропускается.")
             return
+        # Клиент Google Calendar синхронный — вызываем его в пуле потоков, чтобы не блокировать event loop
+        deleted = await asyncio.to_thread(utils.google_calendar.delete_google_calendar_event,
+                                          appointment.google_event_id, self.calendar_id)
+        if not deleted:
+            logger.warning(
+                f"Не удалось удалить событие Google Calendar '{appointment.google_event_id}' для записи '{appointment.id}'.")
+        else:
+            logger.info(
+                f"Событие Google Calendar '{appointment.google_event_id}' для записи '{appointment.id}' успешно удалено.")
 
-        # --- СИНХРОНИЗАЦИЯ С GOOGLE CALENDAR ---
-        if appointment.google_event_id:
-            if status == 'completed':
-                logger.info(
-                    f"Запись '{appointment_id}' завершена. Google event '{appointment.google_event_id}' не обновляется.")
-            elif status == 'cancelled':
-                if not utils.google_calendar.delete_google_calendar_event(appointment.google_event_id):
-                    logger.warning(
-                        f"Не удалось удалить событие Google Calendar '{appointment.google_event_id}' для записи '{appointment_id}'.")
-
-        # --- ОБНОВЛЕНИЕ СТАТУСА В БД ---
+    @traced("db.update_appointment_status")
+    async def update_appointment_status(self, appointment_id: str, status: str,
+                                        expected_status: Optional[str] = 'active',
+                                        client_telegram_id: Optional[int] = None) -> Optional[Appointment]:
+        """
+        Меняет статус записи одним запросом и возвращает измененную запись.
+        Если указан expected_status, статус меняется только из него (условное обновление);
+        если указан client_telegram_id — только у записи этого клиента (отмена самим клиентом).
+        Когда запись не найдена или не подходит под условия, возвращается None.
+        """
         try:
-            # --- ИСПРАВЛЕНИЕ: Вызов синхронного execute через asyncio.to_thread ---
             query_builder = self.client.table('appointments').update({'status': status}).eq('id', appointment_id)
-            await asyncio.to_thread(query_builder.execute)  # <-- Без await на execute, но await на to_thread
-            # ---
-            logger.info(f"Статус записи '{appointment_id}' обновлен на '{status}'.")
+            if expected_status:
+                query_builder = query_builder.eq('status', expected_status)
+            if client_telegram_id is not None:
+                query_builder = query_builder.eq('client_telegram_id', client_telegram_id)
+            # PostgREST возвращает измененные строки в том же ответе (return=representation)
+            response = await self._execute('update_appointment_status', query_builder)
         except Exception as e:
             logger.error(f"Error updating status for appointment id {appointment_id}: {e}")
+            return None
 
-    async def delete_appointment(self, appointment_id: str) -> bool:
-        """Удаляет запись из БД и из Google Calendar."""
+        updated = await self._process_appointment_rows(response.data or [])
+        if not updated:
+            logger.warning(f"Статус записи '{appointment_id}' не изменен: "
+                           f"запись не найдена или ее статус уже не '{expected_status}'.")
+            return None
 
-        # --- Сначала получаем запись, чтобы получить google_event_id ---
-        appointment = await self.get_appointment_by_id(appointment_id)
-
-        if not appointment:
-            logger.warning(f"Не удалось найти запись с ID {appointment_id} для удаления.")
-            return False
+        appointment = updated[0]
+        logger.info("Статус записи '%s' обновлен на '%s'.", appointment_id, status)
 
         # --- СИНХРОНИЗАЦИЯ С GOOGLE CALENDAR ---
-        # Если у записи есть google_event_id, пытаемся удалить соответствующее событие
-        if appointment.google_event_id:
-            # --- ВЫЗОВ ФУНКЦИИ УДАЛЕНИЯ ---
-            if not utils.google_calendar.delete_google_calendar_event(appointment.google_event_id):
-                logger.warning(
-                    f"Не удалось удалить событие Google Calendar '{appointment.google_event_id}' для записи '{appointment_id}'.")
-            else:
-                logger.info(
-                    f"Событие Google Calendar '{appointment.google_event_id}' для записи '{appointment_id}' успешно удалено.")
-        else:
-            logger.info(
-                f"Запись '{appointment_id}' не имеет Google Event ID, поэтому удаление из Google Calendar пропускается.")
-
-        # --- УДАЛЕНИЕ ИЗ БД ---
+        if status == 'cancelled':
+            await self._delete_calendar_event_for(appointment)
+            if expected_status == 'active':
+                self._notify_slot_freed(appointment)
+        return appointment
+
+    @traced("db.delete_appointment")
+    async def delete_appointment(self, appointment_id: str) -> Optional[Appointment]:
+        """
+        Удаляет запись из БД и из Google Calendar.
+        Удаленная строка возвращается в ответе на delete, поэтому отдельный запрос за google_event_id не нужен.
+        """
         try:
-            # Формируем запрос на удаление.
             query_builder = self.client.table('appointments').delete().eq('id', appointment_id)
-
-            # --- ИСПРАВЛЕНИЕ: Вызов синхронного execute через asyncio.to_thread ---
-            # Предполагаем, что execute() синхронный, а вызывается в async методе.
-            response = await asyncio.to_thread(query_builder.execute)
-            # ---
-
-            if response and response.data and len(response.data) > 0:
-                logger.info(f"Запись '{appointment_id}' успешно удалена.")
-                return True
-            else:
-                logger.warning(f"Удаление записи '{appointment_id}' не дало результата (запись не найдена?).")
-                return False
+            response = await self._execute('delete_appointment', query_builder)
         except Exception as e:
             logger.error(f"Error deleting appointment id {appointment_id}: {e}", exc_info=True)
-            return False
+            return None
+
+        deleted = await self._process_appointment_rows(response.data or [])
+        if not deleted:
+            logger.warning(f"Удаление записи '{appointment_id}' не дало результата (запись не найдена?).")
+            return None
+
+        logger.info("Запись '%s' успешно удалена.", appointment_id)
+        # --- СИНХРОНИЗАЦИЯ С GOOGLE CALENDAR ---
+        await self._delete_calendar_event_for(deleted[0])
+        if deleted[0].status == 'active':
+            self._notify_slot_freed(deleted[0])
+        return deleted[0]
 
+    @traced("db.update_appointment_google_id")
     async def update_appointment_google_id(self, appointment_id: str, google_event_id: str) -> bool:
         """
         Обновляет запись в базе данных, добавляя google_event_id.
@@ -300,11 +606,11 @@ class Database:
             query_builder = self.client.table('appointments').update(
                 {'google_event_id': google_event_id}
             ).eq('id', appointment_id)
-            response = await asyncio.to_thread(query_builder.execute)  # <-- Без await на execute, но await на to_thread
+            response = await self._execute('update_appointment_google_id', query_builder)
             # ---
 
             if response and response.data and len(response.data) > 0:
-                logger.info(f"Google Event ID '{google_event_id}' успешно обновлен для записи '{appointment_id}'.")
+                logger.info("Google Event ID '%s' успешно обновлен для записи '%s'.", google_event_id, appointment_id)
                 return True
             else:
                 logger.warning(
@@ -314,34 +620,137 @@ class Database:
             logger.error(f"Ошибка при обновлении Google Event ID для записи '{appointment_id}': {e}", exc_info=True)
             return False
 
+    @traced("db.get_vacation_periods")
     async def get_vacation_periods(self) -> List[dict]:
         """
         Получает список всех периодов отпуска из таблицы vacation_periods.
         Возвращает список словарей, где каждый словарь содержит 'start_date' и 'end_date'.
         """
         try:
-            # Получаем только нужные поля и сортируем по дате начала
-            query_builder = self.client.table('vacation_periods').select('start_date, end_date').order('start_date')
-            response = await asyncio.to_thread(query_builder.execute) # Используем to_thread для синхронного execute
-            
-            if not response.data:
-                return []
-            
-            # Парсим даты, чтобы они были в формате datetime.date
-            vacation_periods = []
-            for period in response.data:
-                start_date = self.parse_date(period.get('start_date')) # Используем parse_date, а не parse_datetime
-                end_date = self.parse_date(period.get('end_date'))
-                
-                if start_date and end_date:
-                    vacation_periods.append({'start_date': start_date, 'end_date': end_date})
-            
-            return vacation_periods
-            
+            # Читаем постранично, чтобы не упираться в лимит строк PostgREST
+            periods = await self.single_flight.do(
+                ('vacation_periods',), lambda: self._collect(self.iter_vacation_periods()))
+            return list(periods)
         except Exception as e:
             logger.error(f"Error fetching vacation periods: {e}")
             return []
 
+    # --- Лист ожидания (database/sql/waitlist.sql) ---
+    @staticmethod
+    def _waitlist_entry_from_row(row: dict) -> WaitlistEntry:
+        return WaitlistEntry(
+            id=row['id'],
+            client_telegram_id=row['client_telegram_id'],
+            client_name=row['client_name'],
+            client_phone=row.get('client_phone'),
+            service_id=row['service_id'],
+            day=date.fromisoformat(row['day']),
+            window_start=time.fromisoformat(row['window_start']),
+            window_end=time.fromisoformat(row['window_end']),
+            status=row.get('status', 'waiting'),
+            offered_slot=parse_datetime(row.get('offered_slot')),
+            offered_until=parse_datetime(row.get('offered_until')),
+            created_at=parse_datetime(row.get('created_at')),
+        )
+
+    @traced("db.add_waitlist_entry")
+    async def add_waitlist_entry(self, entry: WaitlistEntry) -> Optional[WaitlistEntry]:
+        """
+        Ставит клиента в лист ожидания и возвращает созданную заявку.
+        Если такая же заявка уже ждет (уникальный индекс waitlist_client_window_idx), возвращает ее.
+        """
+        row = {
+            'client_telegram_id': entry.client_telegram_id,
+            'client_name': entry.client_name,
+            'client_phone': entry.client_phone,
+            'service_id': entry.service_id,
+            'day': entry.day.isoformat(),
+            'window_start': entry.window_start.isoformat(),
+            'window_end': entry.window_end.isoformat(),
+        }
+        try:
+            response = await self._execute('add_waitlist_entry', self.client.table('waitlist').insert(row))
+            return self._waitlist_entry_from_row(response.data[0]) if response.data else None
+        except DatabaseUnavailable:
+            raise
+        except Exception as e:
+            if getattr(e, 'code', None) != '23505':
+                logger.error(f"Error adding waitlist entry: {e}", exc_info=True)
+                return None
+
+        # unique_violation: заявка уже есть — отдаем существующую
+        try:
+            query_builder = self.client.table('waitlist').select('*') \
+                .eq('client_telegram_id', entry.client_telegram_id).eq('service_id', entry.service_id) \
+                .eq('day', row['day']).eq('window_start', row['window_start']).eq('window_end', row['window_end']) \
+                .in_('status', ['waiting', 'offered']).limit(1)
+            response = await self._execute('get_waitlist_entry', query_builder)
+            return self._waitlist_entry_from_row(response.data[0]) if response.data else None
+        except Exception as e:
+            logger.error(f"Error getting existing waitlist entry: {e}", exc_info=True)
+            return None
+
+    @traced("db.get_waitlist_entry")
+    async def get_waitlist_entry(self, entry_id: str) -> Optional[WaitlistEntry]:
+        try:
+            query_builder = self.client.table('waitlist').select('*').eq('id', entry_id).limit(1)
+            response = await self._execute('get_waitlist_entry', query_builder)
+            return self._waitlist_entry_from_row(response.data[0]) if response.data else None
+        except Exception as e:
+            logger.error(f"Error getting waitlist entry {entry_id}: {e}", exc_info=True)
+            return None
+
+    async def iter_waitlist_entries(self, from_day: date,
+                                    page_size: int = PAGE_SIZE) -> AsyncIterator[WaitlistEntry]:
+        """Ожидающие и предложенные заявки на from_day и позже, в порядке очереди (created_at, id)."""
+        def apply_filters(query_builder):
+            return query_builder.gte('day', from_day.isoformat()).in_('status', ['waiting', 'offered'])
+
+        async for page in self._iter_pages('waitlist', '*', 'created_at', apply_filters, page_size):
+            for row in page:
+                yield self._waitlist_entry_from_row(row)
+
+    @traced("db.get_waitlist_holds")
+    async def get_waitlist_holds(self, target_date: date) -> List[Appointment]:
+        """
+        Время дня, предложенное из листа ожидания и еще не истекшее, в виде записей без ресурса:
+        до конца срока предложения оно занято (так же считает RPC book_appointment).
+        """
+        try:
+            query_builder = self.client.table('waitlist').select('*, services(duration_minutes)') \
+                .eq('day', target_date.isoformat()).eq('status', 'offered') \
+                .gt('offered_until', local_now().isoformat())
+            response = await self._execute('get_waitlist_holds', query_builder)
+        except Exception as e:
+            logger.error(f"Error getting waitlist holds for {target_date}: {e}")
+            return []
+        return [Appointment(client_name=row['client_name'], appointment_time=parse_datetime(row['offered_slot']),
+                            service_id=row['service_id'], status='offered',
+                            service_duration_minutes=(row.get('services') or {}).get('duration_minutes'))
+                for row in response.data or [] if row.get('offered_slot')]
+
+    @traced("db.update_waitlist_status")
+    async def update_waitlist_status(self, entry_id: str, status: str, expected_status: Optional[str] = None,
+                                     offered_slot: Optional[datetime] = None,
+                                     offered_until: Optional[datetime] = None) -> Optional[WaitlistEntry]:
+        """
+        Меняет статус заявки (условно — только из expected_status) и возвращает измененную заявку или None.
+        Для 'offered' вместе со статусом сохраняются предложенное время и срок предложения.
+        """
+        values = {'status': status}
+        if status == 'offered':
+            values['offered_slot'] = offered_slot.isoformat() if offered_slot else None
+            values['offered_until'] = offered_until.isoformat() if offered_until else None
+        try:
+            query_builder = self.client.table('waitlist').update(values).eq('id', entry_id)
+            if expected_status:
+                query_builder = query_builder.eq('status', expected_status)
+            response = await self._execute('update_waitlist_status', query_builder)
+            return self._waitlist_entry_from_row(response.data[0]) if response.data else None
+        except Exception as e:
+            logger.error(f"Error updating waitlist entry {entry_id} to '{status}': {e}")
+            return None
+
     # --- Вспомогательный метод для парсинга только даты (date, а не datetime) ---
     def parse_date(self, iso_string: Optional[str]) -> Optional[date]:
         """Вспомогательная функция для парсинга дат из Supabase."""
@@ -0,0 +1,269 @@
+# database/memory_db.py
+
+import asyncio
+import logging
+import re
+import time as time_module
+import uuid
+from dataclasses import replace
+from difflib import SequenceMatcher
+from datetime import date, datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from .db_supabase import Database, local_now
+from .models import Appointment, BookingResult, Service, WaitlistEntry
+from .resilience import Resilience
+from .single_flight import SingleFlight
+from config_reader import config
+from utils.working_hours import overlaps
+
+logger = logging.getLogger(__name__)
+
+
+class InMemoryDatabase(Database):
+    """
+    Локальная замена Database для тестов и локального запуска без Supabase.
+    Хранит услуги и записи в словарях и повторяет семантику серверных RPC
+    (например, book_appointment) под asyncio.Lock вместо транзакции.
+    """
+
+    def __init__(self, services: Optional[List[Service]] = None):
+        # Не вызываем Database.__init__: клиент Supabase здесь не нужен
+        self.client = None
+        self.services: Dict[str, Service] = {service.id: service for service in services or []}
+        self.appointments: Dict[str, Appointment] = {}
+        self._lock = asyncio.Lock()
+        self.single_flight = SingleFlight()
+        self.calendar_id = None
+        self.resilience = Resilience.from_settings()
+        # name -> (holder, fencing_token, expires_at по time.monotonic)
+        self.leases: Dict[str, Tuple[str, int, float]] = {}
+        self.waitlist: Dict[str, WaitlistEntry] = {}
+        self.slot_freed_listeners = []
+        self._listener_tasks = set()
+
+    def _with_service(self, app: Appointment) -> Appointment:
+        service = self.services.get(app.service_id)
+        return replace(app,
+                       service_title=service.title if service else "Удаленная услуга",
+                       service_price=service.price if service else None,
+                       service_duration_minutes=service.duration_minutes if service else None)
+
+    async def get_service_by_id(self, service_id: str) -> Optional[Service]:
+        return self.services.get(service_id)
+
+    async def add_appointment(self, appointment: Appointment) -> Optional[str]:
+        existing = self._find_by_idempotency_key(appointment.idempotency_key)
+        if existing:
+            return existing.id
+        appointment_id = str(uuid.uuid4())
+        self.appointments[appointment_id] = replace(appointment, id=appointment_id, created_at=datetime.now())
+        return appointment_id
+
+    def _find_by_idempotency_key(self, key: Optional[str]) -> Optional[Appointment]:
+        if not key:
+            return None
+        return next((app for app in self.appointments.values() if app.idempotency_key == key), None)
+
+    async def book_appointment(self, appointment: Appointment,
+                               waitlist_entry_id: Optional[str] = None) -> BookingResult:
+        service = self.services.get(appointment.service_id)
+        if not service:
+            return BookingResult(status='service_not_found')
+
+        default_duration = config.default_service_duration_minutes
+
+        def interval(app: Appointment, duration: Optional[int]):
+            return app.appointment_time, app.appointment_time + timedelta(minutes=duration or default_duration)
+
+        resources = config.booking_resources
+        if not resources:
+            candidates = [None]
+        elif appointment.resource is not None:
+            candidates = [appointment.resource]
+        else:
+            candidates = resources
+
+        async with self._lock:
+            existing = self._find_by_idempotency_key(appointment.idempotency_key)
+            if existing:
+                return BookingResult(status='ok', appointment_id=existing.id, service_title=service.title,
+                                     service_price=service.price, resource=existing.resource, replayed=True)
+            new_interval = interval(appointment, service.duration_minutes)
+            busy = [(app.resource or (resources[0] if resources else None),
+                     interval(app, getattr(self.services.get(app.service_id), 'duration_minutes', None)))
+                    for app in self.appointments.values() if app.status == 'active']
+            # Непросроченные предложения из листа ожидания заняты, кроме бронирования по самой заявке
+            busy.extend((resources[0] if resources else None, interval(hold, hold.service_duration_minutes))
+                        for hold in self._waitlist_holds(appointment.appointment_time.date(), waitlist_entry_id))
+            # Как в RPC: первый ресурс, у которого нет пересекающейся записи
+            for resource in candidates:
+                if not any((resource is None or owner == resource) and overlaps(new_interval, other)
+                           for owner, other in busy):
+                    break
+            else:
+                return BookingResult(status='slot_taken')
+            appointment = replace(appointment, resource=resource)
+            appointment_id = await self.add_appointment(appointment)
+
+        return BookingResult(status='ok', appointment_id=appointment_id,
+                             service_title=service.title, service_price=service.price, resource=resource)
+
+    async def iter_appointments(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                                status: Optional[str] = None, reminded: Optional[bool] = None,
+                                client_telegram_id: Optional[int] = None,
+                                page_size: int = 0) -> AsyncIterator[Appointment]:
+        for app in sorted(self.appointments.values(), key=lambda a: (a.appointment_time, a.id)):
+            if start and app.appointment_time < start:
+                continue
+            if end and app.appointment_time > end:
+                continue
+            if status and app.status != status:
+                continue
+            if reminded is not None and app.reminded != reminded:
+                continue
+            if client_telegram_id is not None and app.client_telegram_id != client_telegram_id:
+                continue
+            yield self._with_service(app)
+
+    async def get_appointments_page(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                                    status: Optional[str] = 'active', cursor: Optional[Tuple[str, str]] = None,
+                                    page_size: int = 10,
+                                    client_telegram_id: Optional[int] = None
+                                    ) -> Tuple[List[Appointment], Optional[Tuple[str, str]]]:
+        page = []
+        async for app in self.iter_appointments(start=start, end=end, status=status,
+                                                client_telegram_id=client_telegram_id):
+            if cursor and (app.appointment_time.isoformat(), app.id) <= cursor:
+                continue
+            page.append(app)
+            if len(page) > page_size:
+                break
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        next_cursor = (page[-1].appointment_time.isoformat(), page[-1].id) if has_more else None
+        return page, next_cursor
+
+    async def search_appointments(self, query: str, cursor: Optional[Tuple[str, str]] = None,
+                                  page_size: int = 10) -> Tuple[List[Appointment], Optional[Tuple[str, str]]]:
+        # Как search_appointments в SQL: телефон по цифрам, имя — подстрока или похожее слово
+        digits = re.sub(r'\D', '', query)
+        if len(digits) == 11 and digits[0] in '78':
+            digits = digits[1:]
+        needle = query.strip().lower()
+
+        def matches(app: Appointment) -> bool:
+            if len(re.sub(r'\D', '', query)) >= 3:
+                return digits in re.sub(r'\D', '', app.client_phone or '')
+            if len(needle) < 3:
+                return False
+            name = (app.client_name or '').lower()
+            return needle in name or any(SequenceMatcher(None, needle, word).ratio() >= 0.6 for word in name.split())
+
+        found = sorted((app for app in self.appointments.values() if matches(app)),
+                       key=lambda a: (a.appointment_time, a.id), reverse=True)
+        if cursor:
+            found = [app for app in found if (app.appointment_time.isoformat(), app.id) < cursor]
+        page = [self._with_service(app) for app in found[:page_size]]
+        next_cursor = (page[-1].appointment_time.isoformat(), page[-1].id) if len(found) > page_size else None
+        return page, next_cursor
+
+    async def get_appointment_by_id(self, appointment_id: str) -> Optional[Appointment]:
+        app = self.appointments.get(appointment_id)
+        return self._with_service(app) if app else None
+
+    async def update_appointment_google_id(self, appointment_id: str, google_event_id: str) -> bool:
+        app = self.appointments.get(appointment_id)
+        if not app or not google_event_id:
+            return False
+        app.google_event_id = google_event_id
+        return True
+
+    async def update_appointment_status(self, appointment_id: str, status: str,
+                                        expected_status: Optional[str] = 'active',
+                                        client_telegram_id: Optional[int] = None) -> Optional[Appointment]:
+        app = self.appointments.get(appointment_id)
+        if not app or (expected_status and app.status != expected_status):
+            return None
+        if client_telegram_id is not None and app.client_telegram_id != client_telegram_id:
+            return None
+        app.status = status
+        if status == 'cancelled' and expected_status == 'active':
+            self._notify_slot_freed(self._with_service(app))
+        return replace(app)
+
+    async def delete_appointment(self, appointment_id: str) -> Optional[Appointment]:
+        app = self.appointments.pop(appointment_id, None)
+        if app and app.status == 'active':
+            self._notify_slot_freed(self._with_service(app))
+        return app
+
+    async def add_waitlist_entry(self, entry: WaitlistEntry) -> Optional[WaitlistEntry]:
+        for existing in self.waitlist.values():
+            if existing.status in ('waiting', 'offered') and \
+                    (existing.client_telegram_id, existing.service_id, existing.day,
+                     existing.window_start, existing.window_end) == \
+                    (entry.client_telegram_id, entry.service_id, entry.day, entry.window_start, entry.window_end):
+                return replace(existing)
+        entry = replace(entry, id=str(uuid.uuid4()), status='waiting', created_at=datetime.now())
+        self.waitlist[entry.id] = entry
+        return replace(entry)
+
+    def _waitlist_holds(self, target_date: date, except_entry_id: Optional[str] = None) -> List[Appointment]:
+        now = local_now()
+        return [Appointment(client_name=entry.client_name, appointment_time=entry.offered_slot,
+                            service_id=entry.service_id, status='offered',
+                            service_duration_minutes=getattr(self.services.get(entry.service_id),
+                                                             'duration_minutes', None))
+                for entry in self.waitlist.values()
+                if entry.status == 'offered' and entry.day == target_date and entry.offered_slot
+                and entry.offered_until and entry.offered_until > now and entry.id != except_entry_id]
+
+    async def get_waitlist_holds(self, target_date: date) -> List[Appointment]:
+        return self._waitlist_holds(target_date)
+
+    async def get_waitlist_entry(self, entry_id: str) -> Optional[WaitlistEntry]:
+        entry = self.waitlist.get(entry_id)
+        return replace(entry) if entry else None
+
+    async def iter_waitlist_entries(self, from_day: date, page_size: int = 0) -> AsyncIterator[WaitlistEntry]:
+        for entry in sorted(self.waitlist.values(), key=lambda e: (e.created_at, e.id)):
+            if entry.day >= from_day and entry.status in ('waiting', 'offered'):
+                yield replace(entry)
+
+    async def update_waitlist_status(self, entry_id: str, status: str, expected_status: Optional[str] = None,
+                                     offered_slot: Optional[datetime] = None,
+                                     offered_until: Optional[datetime] = None) -> Optional[WaitlistEntry]:
+        entry = self.waitlist.get(entry_id)
+        if not entry or (expected_status and entry.status != expected_status):
+            return None
+        entry.status = status
+        if status == 'offered':
+            entry.offered_slot, entry.offered_until = offered_slot, offered_until
+        return replace(entry)
+
+    async def acquire_lease(self, name: str, holder: str, ttl_seconds: int) -> Optional[int]:
+        now = time_module.monotonic()
+        current = self.leases.get(name)
+        if current is None:
+            token = 1
+        elif current[0] == holder:
+            token = current[1]
+        elif current[2] < now:
+            token = current[1] + 1
+        else:
+            return None
+        self.leases[name] = (holder, token, now + ttl_seconds)
+        return token
+
+    async def release_lease(self, name: str, holder: str):
+        current = self.leases.get(name)
+        if current and current[0] == holder:
+            self.leases[name] = (holder, current[1], time_module.monotonic())
+
+    async def check_lease(self, name: str, fencing_token: int) -> bool:
+        current = self.leases.get(name)
+        return bool(current) and current[1] == fencing_token and current[2] > time_module.monotonic()
+
+    async def get_vacation_periods(self) -> List[dict]:
+        return []
@@ -0,0 +1,385 @@
+# database/mirror.py
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time as time_module
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from .db_supabase import Database, PAGE_SIZE, SERVICE_COLUMNS, parse_datetime
+from .models import Appointment, BookingResult, Service, ServiceCategory
+from utils.tracing import traced
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SYNC_SECONDS = 5
+# Строки перечитываются с запасом: транзакции фиксируются не в порядке updated_at,
+# и строка с чуть более ранним updated_at может стать видна уже после того, как курсор ее прошел
+SYNC_OVERLAP_SECONDS = 30
+# Записи копируются начиная со вчерашнего дня; более старые читаются из Supabase
+HISTORY_DAYS = 1
+
+# Таблица -> (колонки для выборки, колонка курсора)
+SYNCED_TABLES: Dict[str, Tuple[str, str]] = {
+    'service_categories': ('id, title, created_at, updated_at', 'updated_at'),
+    'services': (SERVICE_COLUMNS + ', updated_at', 'updated_at'),
+    'vacation_periods': ('id, start_date, end_date, updated_at', 'updated_at'),
+    'appointments': ('*', 'updated_at'),
+}
+TOMBSTONES = ('deleted_rows', 'id, table_name, row_id, deleted_at', 'deleted_at')
+
+SCHEMA = """
+create table if not exists service_categories (id text primary key, title text, data text not null);
+create table if not exists services (id text primary key, category_id text, title text, data text not null);
+create index if not exists services_category_idx on services (category_id, title);
+create table if not exists vacation_periods (id text primary key, start_date text, end_date text,
+                                             data text not null);
+create table if not exists appointments (id text primary key, appointment_time text not null, status text,
+                                         reminded integer, client_telegram_id integer, service_id text,
+                                         data text not null);
+create index if not exists appointments_time_idx on appointments (appointment_time, id);
+create index if not exists appointments_client_idx on appointments (client_telegram_id, appointment_time);
+create table if not exists sync_cursors (table_name text primary key, cursor_value text not null);
+"""
+
+
+def _normalize_time(value: Optional[str]) -> Optional[str]:
+    parsed = parse_datetime(value)
+    return parsed.isoformat() if parsed else None
+
+
+class MirroredDatabase(Database):
+    """
+    Database с локальной копией в SQLite для чтения: категории, услуги, отпуска и записи
+    начиная со вчерашнего дня. Копия догоняет Supabase дельта-синхронизацией по updated_at
+    (удаления приходят из deleted_rows), чтения идут из локальных индексов, а записи —
+    в Supabase, после чего измененная строка сразу перечитывается в копию (write-through).
+    Если Supabase недоступна, чтения продолжают обслуживаться из последней синхронизированной копии.
+    Проверка занятости при бронировании по-прежнему выполняется в RPC, так что устаревшая копия
+    может показать лишний слот, но не приведет к двойной записи.
+    """
+
+    def __init__(self, url: str, key: str, calendar_id: Optional[str] = None,
+                 path: str = 'mirror.sqlite', sync_seconds: int = DEFAULT_SYNC_SECONDS):
+        super().__init__(url, key, calendar_id)
+        self.path = path
+        self.sync_seconds = sync_seconds
+        self.horizon = datetime.combine(date.today() - timedelta(days=HISTORY_DAYS), time.min)
+        # Все обращения к SQLite идут из event loop: запросы по индексам занимают доли миллисекунды
+        self.mirror = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.mirror.execute('pragma journal_mode=wal')
+        self.mirror.executescript(SCHEMA)
+        # Копия с прошлого запуска уже пригодна для чтения, даже если Supabase сейчас недоступна
+        self.ready = self._synced_tables() >= set(SYNCED_TABLES)
+        self.last_sync_at: Optional[float] = None
+        self.stats = Counter()
+        self._task: Optional[asyncio.Task] = None
+
+    @contextmanager
+    def _transaction(self):
+        # В режиме autocommit транзакцию открываем явно; commit/rollback делает контекст соединения
+        with self.mirror:
+            self.mirror.execute('begin')
+            yield
+
+    # --- Синхронизация ---
+    def _synced_tables(self) -> set:
+        return {row[0] for row in self.mirror.execute('select table_name from sync_cursors')}
+
+    def _load_cursor(self, table: str) -> Optional[str]:
+        row = self.mirror.execute('select cursor_value from sync_cursors where table_name = ?', (table,)).fetchone()
+        return row[0] if row else None
+
+    def _upsert_rows(self, table: str, rows: List[dict]):
+        if table == 'service_categories':
+            self.mirror.executemany(
+                'insert or replace into service_categories (id, title, data) values (?, ?, ?)',
+                [(row['id'], row.get('title'), json.dumps(row)) for row in rows])
+        elif table == 'services':
+            self.mirror.executemany(
+                'insert or replace into services (id, category_id, title, data) values (?, ?, ?, ?)',
+                [(row['id'], row.get('category_id'), row.get('title'), json.dumps(row)) for row in rows])
+        elif table == 'vacation_periods':
+            self.mirror.executemany(
+                'insert or replace into vacation_periods (id, start_date, end_date, data) values (?, ?, ?, ?)',
+                [(str(row['id']), row.get('start_date'), row.get('end_date'), json.dumps(row)) for row in rows])
+        elif table == 'appointments':
+            self.mirror.executemany(
+                'insert or replace into appointments (id, appointment_time, status, reminded, client_telegram_id, '
+                'service_id, data) values (?, ?, ?, ?, ?, ?, ?)',
+                [(row['id'], _normalize_time(row.get('appointment_time')), row.get('status'),
+                  int(bool(row.get('reminded'))), row.get('client_telegram_id'), row.get('service_id'),
+                  json.dumps(row)) for row in rows if row.get('appointment_time')])
+
+    def _apply_tombstones(self, rows: List[dict]):
+        for row in rows:
+            if row['table_name'] in SYNCED_TABLES:
+                self.mirror.execute(f"delete from {row['table_name']} where id = ?", (row['row_id'],))
+
+    def _apply_page(self, table: str, rows: List[dict], sort_column: str):
+        """Применяет страницу и сдвигает курсор одной транзакцией."""
+        with self._transaction():
+            if table == TOMBSTONES[0]:
+                self._apply_tombstones(rows)
+            else:
+                self._upsert_rows(table, rows)
+            self.mirror.execute('insert or replace into sync_cursors (table_name, cursor_value) values (?, ?)',
+                                (table, rows[-1][sort_column]))
+
+    async def sync_table(self, table: str, columns: str, sort_column: str) -> int:
+        """Догружает строки, измененные после курсора (с запасом SYNC_OVERLAP_SECONDS)."""
+        cursor = self._load_cursor(table)
+        since = None
+        if cursor:
+            since = datetime.fromisoformat(cursor.replace('Z', '+00:00')) - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+
+        def apply_filters(query_builder):
+            if since:
+                query_builder = query_builder.gte(sort_column, since.isoformat())
+            if table == 'appointments':
+                query_builder = query_builder.gte('appointment_time', self.horizon.isoformat())
+            return query_builder
+
+        applied = 0
+        async for page in self._iter_pages(table, columns, sort_column, apply_filters, PAGE_SIZE):
+            self._apply_page(table, page, sort_column)
+            applied += len(page)
+        if cursor is None and not applied:
+            # Пустая таблица тоже синхронизирована; пустой курсор — читать ее с начала
+            with self._transaction():
+                self.mirror.execute('insert or replace into sync_cursors (table_name, cursor_value) values (?, ?)',
+                                    (table, ''))
+        return applied
+
+    async def sync_once(self):
+        started = time_module.perf_counter()
+        applied = 0
+        for table, (columns, sort_column) in SYNCED_TABLES.items():
+            applied += await self.sync_table(table, columns, sort_column)
+        # Удаления — после вставок, чтобы удаленная строка не вернулась из той же порции
+        applied += await self.sync_table(*TOMBSTONES)
+        self.ready = True
+        self.last_sync_at = time_module.monotonic()
+        self.stats['syncs'] += 1
+        self.stats['rows_applied'] += applied
+        logger.debug("Mirror %s synced: %s rows in %.0f ms.", self.path, applied,
+                     (time_module.perf_counter() - started) * 1000)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sync_seconds)
+            try:
+                await self.sync_once()
+            except Exception as e:
+                self.stats['sync_errors'] += 1
+                logger.warning(f"Mirror sync failed, serving reads from the local copy: {e}")
+
+    async def start_sync(self):
+        """Первая синхронизация (ошибка не мешает старту, если есть копия с прошлого запуска) и фоновый цикл."""
+        try:
+            await self.sync_once()
+        except Exception as e:
+            self.stats['sync_errors'] += 1
+            logger.error(f"Initial mirror sync failed (local copy ready: {self.ready}): {e}")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop_sync(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        logger.info(f"Mirror {self.path} stats: {dict(self.stats)}")
+        self.mirror.close()
+
+    # --- Чтение из копии ---
+    def _local(self, name: str) -> bool:
+        if self.ready:
+            self.stats[f'local_{name}'] += 1
+        return self.ready
+
+    @traced("mirror.get_service_categories")
+    async def get_service_categories(self) -> List[ServiceCategory]:
+        if not self._local('categories'):
+            return await super().get_service_categories()
+        rows = self.mirror.execute('select data from service_categories order by title').fetchall()
+        return [ServiceCategory(**json.loads(row[0])) for row in rows]
+
+    @traced("mirror.get_services_by_category")
+    async def get_services_by_category(self, category_id: str) -> List[Service]:
+        if not self._local('services'):
+            return await super().get_services_by_category(category_id)
+        rows = self.mirror.execute('select data from services where category_id = ? order by title',
+                                   (category_id,)).fetchall()
+        return [self._service_from_data(row[0]) for row in rows]
+
+    @traced("mirror.get_service_by_id")
+    async def get_service_by_id(self, service_id: str) -> Optional[Service]:
+        if not self._local('services'):
+            return await super().get_service_by_id(service_id)
+        row = self.mirror.execute('select data from services where id = ?', (service_id,)).fetchone()
+        return self._service_from_data(row[0]) if row else None
+
+    @staticmethod
+    def _service_from_data(data: str) -> Service:
+        row = json.loads(data)
+        row.pop('updated_at', None)
+        return Service(**row)
+
+    @traced("mirror.get_vacation_periods")
+    async def get_vacation_periods(self) -> List[dict]:
+        if not self._local('vacation_periods'):
+            return await super().get_vacation_periods()
+        periods = []
+        for start_value, end_value in self.mirror.execute(
+                'select start_date, end_date from vacation_periods order by start_date, id'):
+            start_date, end_date = self.parse_date(start_value), self.parse_date(end_value)
+            if start_date and end_date:
+                periods.append({'start_date': start_date, 'end_date': end_date})
+        return periods
+
+    def _covers(self, start: Optional[datetime]) -> bool:
+        """Записи из этого диапазона есть в копии."""
+        return start is not None and start >= self.horizon and self._local('appointments')
+
+    def _select_appointments(self, where: List[str], params: list, limit: Optional[int] = None) -> List[dict]:
+        query = ('select a.data, s.data from appointments a left join services s on s.id = a.service_id'
+                 + (' where ' + ' and '.join(where) if where else '')
+                 + ' order by a.appointment_time, a.id' + (' limit ?' if limit else ''))
+        rows = []
+        for data, service_data in self.mirror.execute(query, params + ([limit] if limit else [])):
+            row = json.loads(data)
+            service = json.loads(service_data) if service_data else None
+            # Та же форма, что у вложенной услуги в APPOINTMENT_COLUMNS
+            row['services'] = {key: service.get(key) for key in ('title', 'price', 'duration_minutes')} \
+                if service else None
+            rows.append(row)
+        return rows
+
+    @staticmethod
+    def _appointment_where(start, end, status, reminded, client_telegram_id) -> Tuple[List[str], list]:
+        where, params = [], []
+        if start:
+            where.append('a.appointment_time >= ?')
+            params.append(start.isoformat())
+        if end:
+            where.append('a.appointment_time <= ?')
+            params.append(end.isoformat())
+        if status:
+            where.append('a.status = ?')
+            params.append(status)
+        if reminded is not None:
+            where.append('a.reminded = ?')
+            params.append(int(reminded))
+        if client_telegram_id is not None:
+            where.append('a.client_telegram_id = ?')
+            params.append(client_telegram_id)
+        return where, params
+
+    async def iter_appointments(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                                status: Optional[str] = None, reminded: Optional[bool] = None,
+                                client_telegram_id: Optional[int] = None,
+                                page_size: int = PAGE_SIZE) -> AsyncIterator[Appointment]:
+        if not self._covers(start):
+            async for app in super().iter_appointments(start, end, status, reminded, client_telegram_id, page_size):
+                yield app
+            return
+        where, params = self._appointment_where(start, end, status, reminded, client_telegram_id)
+        for app in await self._process_appointment_rows(self._select_appointments(where, params)):
+            yield app
+
+    @traced("mirror.get_appointments_page")
+    async def get_appointments_page(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                                    status: Optional[str] = 'active', cursor: Optional[Tuple[str, str]] = None,
+                                    page_size: int = PAGE_SIZE,
+                                    client_telegram_id: Optional[int] = None
+                                    ) -> Tuple[List[Appointment], Optional[Tuple[str, str]]]:
+        if not self._covers(start):
+            return await super().get_appointments_page(start, end, status, cursor, page_size, client_telegram_id)
+        where, params = self._appointment_where(start, end, status, None, client_telegram_id)
+        if cursor:
+            where.append('(a.appointment_time > ? or (a.appointment_time = ? and a.id > ?))')
+            last_time = _normalize_time(cursor[0])
+            params.extend([last_time, last_time, cursor[1]])
+        rows = self._select_appointments(where, params, limit=page_size + 1)
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        next_cursor = (_normalize_time(rows[-1]['appointment_time']), rows[-1]['id']) if has_more else None
+        return await self._process_appointment_rows(rows), next_cursor
+
+    @traced("mirror.get_appointment_by_id")
+    async def get_appointment_by_id(self, appointment_id: str) -> Optional[Appointment]:
+        if self._local('appointments'):
+            rows = self._select_appointments(['a.id = ?'], [appointment_id])
+            if rows:
+                processed = await self._process_appointment_rows(rows)
+                return processed[0] if processed else None
+        # Записи старше горизонта копии (или копия еще не готова)
+        return await super().get_appointment_by_id(appointment_id)
+
+    # --- Запись: в Supabase, затем сразу в копию ---
+    async def _refresh_appointment(self, appointment_id: Optional[str]):
+        """Перечитывает одну запись из Supabase в копию. При ошибке ее догонит дельта-синхронизация."""
+        if not appointment_id:
+            return
+        try:
+            query_builder = self.client.table('appointments').select('*').eq('id', appointment_id).limit(1)
+            response = await self._execute('refresh_appointment', query_builder)
+            with self._transaction():
+                if response.data:
+                    self._upsert_rows('appointments', response.data)
+                else:
+                    self.mirror.execute('delete from appointments where id = ?', (appointment_id,))
+            self.stats['write_through'] += 1
+        except Exception as e:
+            logger.warning(f"Write-through refresh of appointment {appointment_id} failed: {e}")
+
+    async def add_appointment(self, appointment: Appointment) -> Optional[str]:
+        appointment_id = await super().add_appointment(appointment)
+        await self._refresh_appointment(appointment_id)
+        return appointment_id
+
+    async def book_appointment(self, appointment: Appointment,
+                               waitlist_entry_id: Optional[str] = None) -> BookingResult:
+        result = await super().book_appointment(appointment, waitlist_entry_id)
+        if result.ok:
+            await self._refresh_appointment(result.appointment_id)
+        return result
+
+    async def bulk_insert(self, table: str, rows: List[dict], on_conflict: Optional[str] = None) -> List[dict]:
+        inserted = await super().bulk_insert(table, rows, on_conflict)
+        if inserted and table in SYNCED_TABLES:
+            with self._transaction():
+                self._upsert_rows(table, inserted)
+        return inserted
+
+    async def mark_as_reminded(self, appointment_id: str):
+        await super().mark_as_reminded(appointment_id)
+        await self._refresh_appointment(appointment_id)
+
+    async def update_appointment_status(self, appointment_id: str, status: str,
+                                        expected_status: Optional[str] = 'active',
+                                        client_telegram_id: Optional[int] = None) -> Optional[Appointment]:
+        appointment = await super().update_appointment_status(appointment_id, status, expected_status,
+                                                              client_telegram_id)
+        if appointment:
+            await self._refresh_appointment(appointment_id)
+        return appointment
+
+    async def update_appointment_google_id(self, appointment_id: str, google_event_id: str) -> bool:
+        updated = await super().update_appointment_google_id(appointment_id, google_event_id)
+        if updated:
+            await self._refresh_appointment(appointment_id)
+        return updated
+
+    async def delete_appointment(self, appointment_id: str) -> Optional[Appointment]:
+        appointment = await super().delete_appointment(appointment_id)
+        if appointment:
+            with self._transaction():
+                self.mirror.execute('delete from appointments where id = ?', (appointment_id,))
+        return appointment
@@ -1,12 +1,13 @@
 from dataclasses import dataclass
 from typing import Optional, List
-from datetime import datetime
+from datetime import date, datetime, time
 
 @dataclass
 class ServiceCategory:
     id: str
     title: str
     created_at: datetime
+    updated_at: Optional[datetime] = None
 
 @dataclass
 class Service:
@@ -18,6 +19,7 @@ class Service:
     category_id: str
     images: Optional[List[str]] = None
     created_at: Optional[datetime] = None
+    duration_minutes: Optional[int] = None  # None — длительность по умолчанию из настроек
 
 @dataclass
 class Appointment:
@@ -31,4 +33,37 @@ class Appointment:
     reminded: bool = False
     created_at: Optional[datetime] = None
     service_title: Optional[str] = None
-    google_event_id: Optional[str] = None # <-- ДОБАВИЛИ ЭТО ПОЛЕ!
\ No newline at end of file
+    service_price: Optional[str] = None
+    service_duration_minutes: Optional[int] = None
+    resource: Optional[str] = None  # Кресло/мастер; None — единственный ресурс
+    google_event_id: Optional[str] = None # <-- ДОБАВИЛИ ЭТО ПОЛЕ!
+    updated_at: Optional[datetime] = None  # Ставится триггером в БД (database/sql/mirror_sync.sql)
+    idempotency_key: Optional[str] = None  # Один ключ на подтверждение записи (database/sql/idempotency.sql)
+
+@dataclass
+class BookingResult:
+    status: str  # 'ok', 'slot_taken', 'service_not_found' или 'error' ('slot_taken' — нет свободного ресурса)
+    appointment_id: Optional[str] = None
+    service_title: Optional[str] = None
+    service_price: Optional[str] = None
+    resource: Optional[str] = None
+    replayed: bool = False  # Запись уже была создана раньше с тем же ключом идемпотентности
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 'ok'
+
+@dataclass
+class WaitlistEntry:
+    client_telegram_id: int
+    client_name: str
+    service_id: str
+    day: date
+    window_start: time
+    window_end: time
+    id: Optional[str] = None
+    client_phone: Optional[str] = None
+    status: str = 'waiting'  # 'waiting', 'offered', 'fulfilled' или 'cancelled' (database/sql/waitlist.sql)
+    offered_slot: Optional[datetime] = None  # Предложенное время
+    offered_until: Optional[datetime] = None  # До какого момента предложение можно принять
+    created_at: Optional[datetime] = None
\ No newline at end of file
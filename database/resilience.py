@@ -0,0 +1,248 @@
+# database/resilience.py
+
+import asyncio
+import logging
+import random
+import time
+from collections import Counter
+from dataclasses import dataclass, replace
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import httpx
+from postgrest.exceptions import APIError
+
+from config_reader import Settings, config
+
+logger = logging.getLogger(__name__)
+
+# Чтения и идемпотентные обновления можно безопасно повторять; остальные записи по умолчанию выполняются один раз
+RETRYABLE_METHODS = frozenset({
+    'fetch_page', 'get_service_categories', 'get_services_by_category', 'get_service_by_id',
+    'get_existing_service_ids', 'get_appointment_by_id', 'get_appointment_by_idempotency_key',
+    'get_appointments_by_idempotency_keys', 'get_waitlist_holds',
+    'check_lease', 'mark_as_reminded', 'update_appointment_google_id', 'refresh_appointment',
+    'get_waitlist_entry', 'search_appointments',
+})
+
+
+class DatabaseUnavailable(Exception):
+    """Supabase недоступна: цепь разомкнута или все попытки закончились сетевой ошибкой/таймаутом."""
+
+
+@dataclass(frozen=True)
+class CallPolicy:
+    timeout: float = 5.0  # Таймаут одной попытки, секунды
+    deadline: float = 15.0  # Общий бюджет вызова вместе с повторами и паузами
+    retries: int = 0  # Повторы после первой попытки (только для временных ошибок)
+    backoff_base: float = 0.2
+    backoff_max: float = 2.0
+    hedge_after: Optional[float] = None  # Через сколько секунд без ответа отправить второй, параллельный запрос
+
+
+def is_transient(error: BaseException) -> bool:
+    """
+    Ошибка, которую есть смысл повторить и которая говорит о недоступности Supabase:
+    таймаут, сетевой сбой, 5xx от шлюза, ошибки Postgres класса 5x (нехватка ресурсов,
+    statement timeout) и PGRST00x (PostgREST не может подключиться к БД).
+    Остальные ответы (нарушение ограничений, ошибка в запросе) означают, что сервер работает.
+    """
+    if isinstance(error, (asyncio.TimeoutError, httpx.TransportError, ConnectionError)):
+        return True
+    if isinstance(error, APIError):
+        code = str(error.code or '')
+        return code.startswith('5') or code.startswith('PGRST00')
+    return False
+
+
+class CircuitBreaker:
+    """
+    Размыкается после failure_threshold временных ошибок подряд: следующие reset_seconds вызовы
+    сразу получают DatabaseUnavailable, не дожидаясь таймаута. Затем пропускается один пробный
+    вызов (half-open): успех замыкает цепь, ошибка снова размыкает. Если пробный вызов отменен
+    и не дал ни успеха, ни ошибки, release_probe пропускает следующий.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe: Optional[object] = None  # Кто выполняет пробный вызов
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return 'half_open'
+        return 'open'
+
+    def allow(self, caller: object) -> bool:
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half_open' and self._probe is None:
+            self._probe = caller
+            return True
+        return False
+
+    def release_probe(self, caller: object):
+        """Пробный вызов caller завершился без исхода (например, отменен)."""
+        if self._probe is caller:
+            self._probe = None
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info("Supabase circuit closed: probe call succeeded.")
+        self.failures = 0
+        self.opened_at = None
+        self._probe = None
+
+    def record_failure(self) -> bool:
+        """Учитывает временную ошибку. Возвращает True, если цепь только что разомкнулась."""
+        self.failures += 1
+        was_open = self.opened_at is not None
+        if was_open or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._probe = None
+            if not was_open:
+                logger.error(f"Supabase circuit opened after {self.failures} consecutive failures; "
+                             f"failing fast for {self.reset_seconds:.0f} s.")
+            return not was_open
+        return False
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def breaker_for(url: str, settings: Settings = config) -> CircuitBreaker:
+    """Предохранитель проекта Supabase: один на URL для всех клиентов Database (арендаторы, локальные копии)."""
+    breaker = _breakers.get(url)
+    if breaker is None:
+        breaker = _breakers[url] = CircuitBreaker(failure_threshold=settings.db_breaker_failure_threshold,
+                                                  reset_seconds=settings.db_breaker_reset_seconds)
+    return breaker
+
+
+class Resilience:
+    """
+    Политика вызовов Supabase для одного клиента Database: таймаут на попытку и общий дедлайн,
+    повторы временных ошибок с экспоненциальной паузой и полным джиттером, общий предохранитель
+    (цепь на весь проект Supabase, см. breaker_for) и, по желанию, hedged-запрос для чтений с длинным хвостом задержек.
+    Политика задается по имени метода (см. DB_CALL_POLICIES в config_reader.py).
+    Исходы считаются в self.stats как '<метод>.<исход>'.
+
+    Таймаут освобождает обработчик, но не прерывает запрос, уже выполняющийся в потоке
+    asyncio.to_thread: он доработает в фоне, его результат будет отброшен.
+    """
+
+    def __init__(self, read_policy: CallPolicy, write_policy: CallPolicy,
+                 overrides: Optional[Dict[str, CallPolicy]] = None,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.read_policy = read_policy
+        self.write_policy = write_policy
+        self.overrides = overrides or {}
+        self.breaker = breaker or CircuitBreaker()
+        self.stats = Counter()
+
+    @classmethod
+    def from_settings(cls, settings: Settings = config, breaker: Optional[CircuitBreaker] = None) -> 'Resilience':
+        write_policy = CallPolicy(timeout=settings.db_call_timeout_seconds,
+                                  deadline=settings.db_call_timeout_seconds)
+        read_policy = replace(write_policy, retries=settings.db_read_retries,
+                              deadline=settings.db_call_timeout_seconds * (settings.db_read_retries + 1))
+        overrides = {}
+        for method, values in settings.db_call_policies.items():
+            base = read_policy if method in RETRYABLE_METHODS else write_policy
+            overrides[method] = replace(base, **values)
+        if breaker is None:
+            breaker = CircuitBreaker(failure_threshold=settings.db_breaker_failure_threshold,
+                                     reset_seconds=settings.db_breaker_reset_seconds)
+        return cls(read_policy, write_policy, overrides, breaker)
+
+    def policy_for(self, method: str) -> CallPolicy:
+        if method in self.overrides:
+            return self.overrides[method]
+        return self.read_policy if method in RETRYABLE_METHODS else self.write_policy
+
+    async def _attempt(self, method: str, fn: Callable[[], Awaitable[Any]], policy: CallPolicy,
+                       timeout: float) -> Any:
+        """Одна попытка; при hedge_after — с запасным запросом, если первый не ответил вовремя."""
+        if policy.hedge_after is None or policy.hedge_after >= timeout:
+            return await asyncio.wait_for(fn(), timeout)
+
+        primary = asyncio.ensure_future(fn())
+        tasks = {primary}
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=policy.hedge_after)
+            if not done:
+                self.stats[f'{method}.hedged'] += 1
+                tasks.add(asyncio.ensure_future(fn()))
+            # Берем первый успешный ответ; ошибка одного из запросов не отменяет второй
+            while tasks:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                done, tasks = await asyncio.wait(tasks, timeout=remaining,
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise asyncio.TimeoutError()
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.stats[f'{method}.hedge_won'] += 1
+                        return task.result()
+                if not tasks:
+                    raise done.pop().exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def call(self, method: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполняет fn() по политике метода. Временные ошибки после всех попыток
+        превращаются в DatabaseUnavailable; остальные исключения пробрасываются как есть.
+        """
+        policy = self.policy_for(method)
+        caller = object()
+        if not self.breaker.allow(caller):
+            self.stats[f'{method}.rejected'] += 1
+            raise DatabaseUnavailable(f"Supabase circuit is open ({method}).")
+        try:
+            return await self._call(method, fn, policy)
+        except BaseException:
+            # Отмена (CancelledError не Exception) не доходит до record_success/record_failure:
+            # без этого цепь навсегда осталась бы в half-open с «занятым» пробным вызовом
+            self.breaker.release_probe(caller)
+            raise
+
+    async def _call(self, method: str, fn: Callable[[], Awaitable[Any]], policy: CallPolicy) -> Any:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + policy.deadline
+        attempt = 0
+        while True:
+            timeout = min(policy.timeout, deadline - loop.time())
+            try:
+                result = await self._attempt(method, fn, policy, timeout)
+            except Exception as e:
+                if not is_transient(e):
+                    # Supabase ответила (пусть и ошибкой) — для предохранителя это признак доступности
+                    self.breaker.record_success()
+                    self.stats[f'{method}.error'] += 1
+                    raise
+                self.stats[f'{method}.timeout' if isinstance(e, asyncio.TimeoutError) else f'{method}.failed'] += 1
+                if self.breaker.record_failure():
+                    self.stats['breaker.opened'] += 1
+                pause = random.uniform(0, min(policy.backoff_max, policy.backoff_base * 2 ** attempt))
+                if attempt >= policy.retries or self.breaker.state != 'closed' \
+                        or loop.time() + pause >= deadline:
+                    raise DatabaseUnavailable(f"{method}: {type(e).__name__}: {e}") from e
+                attempt += 1
+                self.stats[f'{method}.retry'] += 1
+                await asyncio.sleep(pause)
+                continue
+            self.breaker.record_success()
+            self.stats[f'{method}.ok'] += 1
+            return result
@@ -0,0 +1,64 @@
+# database/single_flight.py
+
+import asyncio
+import logging
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Склеивает одновременные одинаковые запросы в один.
+    Пока запрос с ключом key выполняется, остальные вызовы с тем же ключом ждут его результата
+    (или получают то же исключение), а не идут в сеть сами. Это не кэш: как только запрос
+    завершился, следующий вызов снова выполнит его.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.stats = Counter()
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Помечаем исключение как полученное, даже если все ожидающие были отменены
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            self.stats['executed'] += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.stats['shared'] += 1
+        # shield: отмена одного из ожидающих не должна отменять запрос для остальных
+        return await asyncio.shield(task)
+
+
+async def _benchmark(burst: int = 100, latency: float = 0.05):
+    round_trips = 0
+
+    async def fake_request():
+        nonlocal round_trips
+        round_trips += 1
+        await asyncio.sleep(latency)
+        return ['09:00', '10:00']
+
+    single_flight = SingleFlight()
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await asyncio.gather(*(single_flight.do(('appointments_for_day', '2024-05-01'), fake_request)
+                           for _ in range(burst)))
+    elapsed = loop.time() - started
+    print(f"{burst} concurrent identical reads -> {round_trips} round-trip(s) "
+          f"({burst - round_trips} saved) in {elapsed * 1000:.1f} ms; stats: {dict(single_flight.stats)}")
+
+
+if __name__ == "__main__":
+    # Бенчмарк: python -m database.single_flight
+    asyncio.run(_benchmark())
@@ -0,0 +1,124 @@
+-- database/sql/book_appointment.sql
+-- Бронирование за один запрос: проверка услуги, проверка слота и вставка записи в одной транзакции.
+-- Применить один раз в SQL Editor Supabase (после service_durations.sql, resources.sql и idempotency.sql).
+-- Вызывается из Database.book_appointment.
+-- Ресурс (кресло, мастер) занят, если интервал новой записи пересекается с интервалом его активной записи
+-- (длительность берется из services.duration_minutes, по умолчанию p_default_duration_minutes).
+-- Без p_resources ресурс один, как раньше; записи без ресурса относятся к первому ресурсу.
+-- Повторный вызов с тем же p_idempotency_key возвращает уже созданную запись с 'replayed': true.
+-- Время, предложенное из листа ожидания (waitlist.sql) и еще не истекшее к p_now, занято так же,
+-- как запись без ресурса; свободно оно только для бронирования по самой заявке (p_waitlist_entry_id).
+
+-- Прежние версии без параметров длительности, ресурсов и ключа идемпотентности
+drop function if exists book_appointment(text, uuid, timestamp, bigint, text, text);
+drop function if exists book_appointment(text, uuid, timestamp, bigint, text, text, integer);
+drop function if exists book_appointment(text, uuid, timestamp, bigint, text, text, integer, text[], text);
+drop function if exists book_appointment(text, uuid, timestamp, bigint, text, text, integer, text[], text, text);
+
+create or replace function book_appointment(
+    p_client_name text,
+    p_service_id uuid,
+    p_appointment_time timestamp,
+    p_client_telegram_id bigint default null,
+    p_client_phone text default null,
+    p_google_event_id text default null,
+    p_default_duration_minutes integer default 60,
+    p_resources text[] default null,
+    p_resource text default null,
+    p_idempotency_key text default null,
+    p_waitlist_entry_id uuid default null,
+    p_now timestamp default null  -- Текущее время по часовому поясу записей (время хранится без таймзоны)
+) returns json
+language plpgsql
+as $$
+declare
+    v_service services%rowtype;
+    v_appointment_id uuid;
+    v_end timestamp;
+    v_candidates text[];
+    v_candidate text;
+    v_resource text;
+    v_existing appointments%rowtype;
+begin
+    select * into v_service from services where id = p_service_id;
+    if not found then
+        return json_build_object('status', 'service_not_found');
+    end if;
+
+    v_end := p_appointment_time + make_interval(mins => coalesce(v_service.duration_minutes, p_default_duration_minutes));
+
+    -- Записи разной длительности могут пересекаться, поэтому параллельные бронирования
+    -- одного дня выполняются по очереди
+    perform pg_advisory_xact_lock(hashtext('appointment_day:' || p_appointment_time::date::text));
+
+    -- Повтор того же подтверждения: отдаем исходный результат без новых записей.
+    -- Проверка идет под блокировкой дня, поэтому параллельный повтор дождется первого вызова
+    if p_idempotency_key is not null then
+        select * into v_existing from appointments where idempotency_key = p_idempotency_key;
+        if found then
+            return json_build_object(
+                'status', 'ok',
+                'appointment_id', v_existing.id,
+                'service_title', v_service.title,
+                'service_price', v_service.price,
+                'resource', v_existing.resource,
+                'replayed', true
+            );
+        end if;
+    end if;
+
+    -- Проверяем ресурсы по очереди (или только запрошенный) и берем первый свободный.
+    -- Проверка и вставка идут под одной блокировкой, поэтому вместимость не может быть превышена
+    if p_resources is null or cardinality(p_resources) = 0 then
+        v_candidates := array[null::text];
+    elsif p_resource is not null then
+        v_candidates := array[p_resource];
+    else
+        v_candidates := p_resources;
+    end if;
+
+    foreach v_candidate in array v_candidates loop
+        if not exists (
+            select 1 from appointments a
+            left join services s on s.id = a.service_id
+            where a.status = 'active'
+              and (v_candidate is null or coalesce(a.resource, p_resources[1]) = v_candidate)
+              and a.appointment_time < v_end
+              and a.appointment_time
+                  + make_interval(mins => coalesce(s.duration_minutes, p_default_duration_minutes)) > p_appointment_time
+        ) and not exists (
+            select 1 from waitlist w
+            left join services s on s.id = w.service_id
+            where w.day = p_appointment_time::date
+              and w.status = 'offered'
+              and w.offered_until > coalesce(p_now, localtimestamp)
+              and w.id is distinct from p_waitlist_entry_id
+              and (v_candidate is null or p_resources[1] = v_candidate)
+              and w.offered_slot < v_end
+              and w.offered_slot
+                  + make_interval(mins => coalesce(s.duration_minutes, p_default_duration_minutes)) > p_appointment_time
+        ) then
+            v_resource := coalesce(v_candidate, '');
+            exit;
+        end if;
+    end loop;
+
+    if v_resource is null then
+        return json_build_object('status', 'slot_taken');
+    end if;
+
+    insert into appointments (client_name, service_id, appointment_time, client_telegram_id,
+                              client_phone, google_event_id, resource, idempotency_key)
+    values (p_client_name, p_service_id, p_appointment_time, p_client_telegram_id,
+            p_client_phone, p_google_event_id, nullif(v_resource, ''), p_idempotency_key)
+    returning id into v_appointment_id;
+
+    return json_build_object(
+        'status', 'ok',
+        'appointment_id', v_appointment_id,
+        'service_title', v_service.title,
+        'service_price', v_service.price,
+        'resource', nullif(v_resource, '')
+    );
+end;
+$$;
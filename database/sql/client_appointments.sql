@@ -0,0 +1,9 @@
+-- database/sql/client_appointments.sql
+-- Индекс для экрана «Мои записи»: предстоящие активные записи клиента по времени.
+-- Применить один раз в SQL Editor Supabase.
+-- Запрос client_telegram_id = ? and status = 'active' and appointment_time >= now() order by appointment_time, id
+-- читает только записи этого клиента, уже в нужном порядке, без сортировки.
+
+create index if not exists appointments_client_upcoming_idx
+    on appointments (client_telegram_id, appointment_time, id)
+    where status = 'active';
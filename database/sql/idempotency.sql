@@ -0,0 +1,12 @@
+-- database/sql/idempotency.sql
+-- Ключ идемпотентности записи: повторное подтверждение (двойное нажатие, повторная доставка апдейта)
+-- с тем же ключом возвращает уже созданную запись вместо новой.
+-- Применить один раз в SQL Editor Supabase (до book_appointment.sql).
+
+alter table appointments add column if not exists idempotency_key text;
+
+-- Уникальность ключа — последняя защита от дублей. NULL в уникальном индексе не совпадают,
+-- поэтому записи без ключа (старые, импорт) не ограничиваются. Индекс полный, а не частичный:
+-- по нему работает upsert on_conflict=idempotency_key из Database.add_appointment
+create unique index if not exists appointments_idempotency_key_idx
+    on appointments (idempotency_key);
@@ -0,0 +1,52 @@
+-- database/sql/leases.sql
+-- Аренда (lease) для выбора лидера между несколькими копиями бота.
+-- Применить один раз в SQL Editor Supabase. Используется utils/leader.py через Database.acquire_lease.
+
+create table if not exists leases (
+    name text primary key,
+    holder text not null,
+    fencing_token bigint not null default 1,
+    expires_at timestamptz not null
+);
+
+-- Берет или продлевает аренду. Возвращает fencing token, если аренда у вызывающего, иначе null.
+-- Токен увеличивается каждый раз, когда аренда переходит к другому держателю.
+create or replace function acquire_lease(p_name text, p_holder text, p_ttl_seconds int)
+returns bigint
+language plpgsql
+as $$
+declare
+    v_token bigint;
+begin
+    insert into leases (name, holder, fencing_token, expires_at)
+    values (p_name, p_holder, 1, now() + make_interval(secs => p_ttl_seconds))
+    on conflict (name) do update
+        set holder = excluded.holder,
+            fencing_token = case when leases.holder = excluded.holder
+                                 then leases.fencing_token
+                                 else leases.fencing_token + 1 end,
+            expires_at = excluded.expires_at
+        where leases.holder = excluded.holder or leases.expires_at < now()
+    returning fencing_token into v_token;
+    return v_token;
+end;
+$$;
+
+-- Досрочно освобождает аренду (при штатной остановке), чтобы другая копия подхватила ее сразу.
+create or replace function release_lease(p_name text, p_holder text)
+returns void
+language sql
+as $$
+    update leases set expires_at = now() where name = p_name and holder = p_holder;
+$$;
+
+-- Проверка перед побочным эффектом: аренда все еще действует и токен не устарел.
+create or replace function check_lease(p_name text, p_fencing_token bigint)
+returns boolean
+language sql
+as $$
+    select exists (
+        select 1 from leases
+        where name = p_name and fencing_token = p_fencing_token and expires_at > now()
+    );
+$$;
@@ -0,0 +1,50 @@
+-- database/sql/mirror_sync.sql
+-- Поддержка локальной копии для чтения (database/mirror.py): колонка updated_at, которую ставит триггер,
+-- индекс для дельта-синхронизации и таблица deleted_rows, куда триггер записывает удаленные строки.
+-- Применить один раз в SQL Editor Supabase.
+
+create table if not exists deleted_rows (
+    id bigserial primary key,
+    table_name text not null,
+    row_id text not null,
+    deleted_at timestamptz not null default now()
+);
+create index if not exists deleted_rows_deleted_at_idx on deleted_rows (deleted_at, id);
+
+create or replace function set_updated_at() returns trigger
+language plpgsql
+as $$
+begin
+    new.updated_at := now();
+    return new;
+end;
+$$;
+
+create or replace function record_deletion() returns trigger
+language plpgsql
+as $$
+begin
+    insert into deleted_rows (table_name, row_id) values (tg_table_name, old.id::text);
+    return old;
+end;
+$$;
+
+do $$
+declare
+    t text;
+begin
+    foreach t in array array['service_categories', 'services', 'vacation_periods', 'appointments'] loop
+        execute format('alter table %I add column if not exists updated_at timestamptz not null default now()', t);
+        execute format('create index if not exists %I on %I (updated_at, id)', t || '_updated_at_idx', t);
+        execute format('drop trigger if exists set_updated_at on %I', t);
+        execute format('create trigger set_updated_at before insert or update on %I '
+                       'for each row execute function set_updated_at()', t);
+        execute format('drop trigger if exists record_deletion on %I', t);
+        execute format('create trigger record_deletion after delete on %I '
+                       'for each row execute function record_deletion()', t);
+    end loop;
+end;
+$$;
+
+-- Старые строки удаленных записей больше не нужны копиям, которые уже синхронизировались
+-- delete from deleted_rows where deleted_at < now() - interval '30 days';
@@ -0,0 +1,5 @@
+-- database/sql/resources.sql
+-- Ресурс (кресло, мастер), за которым закреплена запись. NULL — запись сделана до появления ресурсов
+-- и считается записью первого ресурса из BOOKING_RESOURCES. Применить один раз в SQL Editor Supabase.
+
+alter table appointments add column if not exists resource text;
@@ -0,0 +1,63 @@
+-- database/sql/search.sql
+-- Поиск записей по имени клиента (с опечатками) и номеру телефона для команды /find.
+-- Применить один раз в SQL Editor Supabase. Вызывается из Database.search_appointments.
+-- Имя ищется по триграммному индексу: подстрока (ilike) или похожее слово (word similarity, <%),
+-- телефон — по цифрам номера, без пробелов, скобок и дефисов. Оба условия читают индекс,
+-- поэтому поиск не зависит от того, сколько лет записей в таблице.
+-- Результаты — от новых к старым, страницами по курсору (appointment_time, id).
+
+create extension if not exists pg_trgm;
+
+create index if not exists appointments_client_name_trgm_idx
+    on appointments using gin (client_name gin_trgm_ops);
+
+create index if not exists appointments_client_phone_digits_trgm_idx
+    on appointments using gin ((regexp_replace(coalesce(client_phone, ''), '\D', '', 'g')) gin_trgm_ops);
+
+create or replace function search_appointments(
+    p_query text,
+    p_before_time timestamp default null,
+    p_before_id uuid default null,
+    p_limit integer default 10
+) returns setof jsonb
+language plpgsql
+stable
+as $$
+declare
+    v_query text := btrim(coalesce(p_query, ''));
+    v_digits text := regexp_replace(coalesce(p_query, ''), '\D', '', 'g');
+    v_pattern text;
+begin
+    if length(v_digits) >= 3 then
+        -- Номер ищем без кода страны: +7 999 ... и 8 999 ... совпадают
+        if length(v_digits) = 11 and left(v_digits, 1) in ('7', '8') then
+            v_digits := substr(v_digits, 2);
+        end if;
+        return query
+            select to_jsonb(a) || jsonb_build_object('services', case when s.id is null then null else jsonb_build_object(
+                       'title', s.title, 'price', s.price, 'duration_minutes', s.duration_minutes) end)
+            from appointments a
+            left join services s on s.id = a.service_id
+            where regexp_replace(coalesce(a.client_phone, ''), '\D', '', 'g') like '%' || v_digits || '%'
+              and (p_before_time is null or (a.appointment_time, a.id) < (p_before_time, p_before_id))
+            order by a.appointment_time desc, a.id desc
+            limit p_limit;
+        return;
+    end if;
+
+    if length(v_query) < 3 then
+        return;  -- Короче трех символов триграммы не работают — это был бы полный просмотр таблицы
+    end if;
+
+    v_pattern := '%' || replace(replace(replace(v_query, '\', '\\'), '%', '\%'), '_', '\_') || '%';
+    return query
+        select to_jsonb(a) || jsonb_build_object('services', case when s.id is null then null else jsonb_build_object(
+                   'title', s.title, 'price', s.price, 'duration_minutes', s.duration_minutes) end)
+        from appointments a
+        left join services s on s.id = a.service_id
+        where (a.client_name ilike v_pattern or v_query <% a.client_name)
+          and (p_before_time is null or (a.appointment_time, a.id) < (p_before_time, p_before_id))
+        order by a.appointment_time desc, a.id desc
+        limit p_limit;
+end;
+$$;
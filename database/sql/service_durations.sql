@@ -0,0 +1,8 @@
+-- database/sql/service_durations.sql
+-- Длительность услуги в минутах. NULL — длительность по умолчанию (DEFAULT_SERVICE_DURATION_MINUTES).
+-- Применить один раз в SQL Editor Supabase.
+
+alter table services add column if not exists duration_minutes integer check (duration_minutes > 0);
+
+-- Поиск пересечений при бронировании идет по времени активных записей
+create index if not exists appointments_active_time_idx on appointments (appointment_time) where status = 'active';
@@ -0,0 +1,31 @@
+-- database/sql/waitlist.sql
+-- Лист ожидания: клиент ждет освобождения времени в выбранный день и окно (utils/waitlist.py).
+-- Применить один раз в SQL Editor Supabase.
+-- Статусы: 'waiting' — ждет, 'offered' — освободившееся время предложено до offered_until,
+-- 'fulfilled' — клиент записался, 'cancelled' — заявка снята.
+
+create table if not exists waitlist (
+    id uuid primary key default gen_random_uuid(),
+    client_telegram_id bigint not null,
+    client_name text not null,
+    client_phone text,
+    service_id uuid not null references services (id) on delete cascade,
+    day date not null,
+    window_start time not null,
+    window_end time not null,
+    status text not null default 'waiting',
+    offered_slot timestamp,
+    offered_until timestamp,
+    created_at timestamptz not null default now(),
+    check (window_start < window_end)
+);
+
+-- При старте бот читает заявки на сегодня и позже в порядке очереди
+create index if not exists waitlist_pending_idx
+    on waitlist (day, created_at, id)
+    where status in ('waiting', 'offered');
+
+-- Одна заявка клиента на день и окно: повторное нажатие не ставит его в очередь дважды
+create unique index if not exists waitlist_client_window_idx
+    on waitlist (client_telegram_id, service_id, day, window_start, window_end)
+    where status in ('waiting', 'offered');
@@ -0,0 +1,15 @@
+# filters/admin.py
+
+from typing import Union
+
+from aiogram.filters import BaseFilter
+from aiogram.types import CallbackQuery, Message
+
+from utils.tenants import Tenant
+
+
+class IsTenantAdmin(BaseFilter):
+    """Пропускает только администратора того арендатора, чей бот получил апдейт."""
+
+    async def __call__(self, event: Union[Message, CallbackQuery], tenant: Tenant) -> bool:
+        return event.from_user is not None and event.from_user.id == tenant.admin_id
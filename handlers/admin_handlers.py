@@ -1,10 +1,16 @@
 # handlers/admin_handlers.py
 
+import asyncio
+import html
 import logging
+import uuid
+import os
 from aiogram import Router, types, F, Bot
-from config_reader import config
-from datetime import datetime
+from aiogram.filters import Command, CommandObject
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from datetime import datetime, date, timedelta
 from database.db_supabase import Database
+from filters.admin import IsTenantAdmin
 from keyboards.admin_keyboards import *
 from keyboards.client_keyboards import *
 from states.fsm_states import AdminStates
@@ -13,12 +19,19 @@ from database.models import Appointment
 from utils.notifications import notify_admin_on_new_booking
 import utils.google_calendar
 import utils.gemini_api
+import utils.export
+import utils.analytics
+from utils.working_hours import working_hours
+from utils.agenda import AGENDA_VIEWS, agenda_cache, client_appointments_cache, search_cache, shift_anchor, view_range
+from utils.tracing import tracer
+from utils.scheduler import cancel_appointment_reminders
+from utils.tenants import Tenant
 
 
 router = Router()
-# Фильтр, чтобы эти хэндлеры работали только для админа
-router.message.filter(F.from_user.id == config.admin_id)
-router.callback_query.filter(F.from_user.id == config.admin_id)
+# Фильтр, чтобы эти хэндлеры работали только для админа (своего у каждого арендатора)
+router.message.filter(IsTenantAdmin())
+router.callback_query.filter(IsTenantAdmin())
 
 logger = logging.getLogger(__name__)
 
@@ -26,7 +39,7 @@ logger = logging.getLogger(__name__)
 # --- Обработчик кнопки "Нейросеть" ---
 @router.callback_query(F.data == "admin_gemini_chat")
 async def admin_gemini_start_chat(callback: types.CallbackQuery, state: FSMContext):
-    logger.info(f"Admin {callback.from_user.id} wants to use Gemini AI.")
+    logger.info("Admin %s wants to use Gemini AI.", callback.from_user.id)
 
     await state.set_state(AdminStates.waiting_for_gemini_prompt)
     # --- ИСПРАВЛЕНИЕ: Используем parse_mode='HTML' ---
@@ -80,7 +93,7 @@ async def cancel_gemini_chat(message: types.Message, state: FSMContext):
 # --- Обработчик кнопки "Записать клиента" ---
 @router.callback_query(F.data == "admin_book_client")
 async def admin_start_booking_client(callback: types.CallbackQuery, state: FSMContext, db: Database):
-    logger.info(f"Admin {callback.from_user.id} wants to book a client.")
+    logger.info("Admin %s wants to book a client.", callback.from_user.id)
     await state.set_state(AdminStates.waiting_for_client_name)
     await callback.message.edit_text("Пожалуйста, введите имя клиента:")
 
@@ -126,7 +139,8 @@ async def admin_pick_service(callback: types.CallbackQuery, state: FSMContext, d
         await callback.answer("Услуга не найдена, попробуйте снова.", show_alert=True)
         return
 
-    await state.update_data(service_id=service_id, service_title=service.title, service_price=service.price)
+    await state.update_data(service_id=service_id, service_title=service.title, service_price=service.price,
+                            service_duration=working_hours.duration_for(service))
     keyboard = await get_date_keyboard(db)
     await callback.message.edit_text(f"Вы выбрали: {service.title}.\nТеперь выберите удобный день:",
                                      reply_markup=keyboard)
@@ -146,7 +160,7 @@ async def admin_back_to_date_choice(callback: types.CallbackQuery, state: FSMCon
         return
 
     target_date = datetime.strptime(date_str, '%Y-%m-%d')
-    keyboard = await get_time_slots_keyboard(target_date, db)
+    keyboard = await get_time_slots_keyboard(target_date, db, data.get('service_duration'))
     await callback.message.edit_text(f"Выбрана дата: {date_str}.\nТеперь выберите свободное время:",
                                      reply_markup=keyboard)
     await state.set_state(AdminStates.waiting_for_time)
@@ -157,8 +171,9 @@ async def admin_back_to_date_choice(callback: types.CallbackQuery, state: FSMCon
 async def admin_pick_date(callback: types.CallbackQuery, state: FSMContext, db: Database):
     date_str = callback.data.split("_")[1]
     await state.update_data(date=date_str)
+    data = await state.get_data()
     target_date = datetime.strptime(date_str, '%Y-%m-%d')
-    keyboard = await get_time_slots_keyboard(target_date, db)
+    keyboard = await get_time_slots_keyboard(target_date, db, data.get('service_duration'))
     await callback.message.edit_text(f"Выбрана дата: {date_str}.\nТеперь выберите свободное время:",
                                      reply_markup=keyboard)
     await state.set_state(AdminStates.waiting_for_time)
@@ -183,7 +198,9 @@ async def admin_pick_time(callback: types.CallbackQuery, state: FSMContext):
 @router.message(AdminStates.waiting_for_phone)
 async def admin_provide_phone_number(message: types.Message, state: FSMContext, db: Database, bot: Bot):
     phone_number = message.text
-    await state.update_data(phone_number=phone_number)  # Сохраняем номер телефона
+    # Ключ идемпотентности выдается один раз на экран подтверждения: повторное нажатие «Подтвердить»
+    # или повторная доставка апдейта вернут ту же запись. Hex UUID годится и как ID события Google Calendar
+    await state.update_data(phone_number=phone_number, idempotency_key=uuid.uuid4().hex)
 
     data = await state.get_data()
 
@@ -209,7 +226,6 @@ async def admin_confirm_booking(callback: types.CallbackQuery, state: FSMContext
     client_name = data.get('client_name')
     service_id = data.get('service_id')
     service_title = data.get('service_title')
-    service_price = data.get('service_price')
     date_str = data.get('date')
     time_str = data.get('time')
     phone_number = data.get('phone_number')
@@ -226,45 +242,65 @@ async def admin_confirm_booking(callback: types.CallbackQuery, state: FSMContext
         await state.clear()
         return
 
+    idempotency_key = data.get('idempotency_key')
+    if not idempotency_key:
+        idempotency_key = uuid.uuid4().hex
+        await state.update_data(idempotency_key=idempotency_key)
+
+    # --- ИНТЕГРАЦИЯ С GOOGLE CALENDAR ---
+    # Событие создаем до бронирования, чтобы его ID попал в БД тем же запросом.
+    # ID события — ключ идемпотентности, поэтому повтор не создаст второе событие
+    service_duration = data.get('service_duration') or working_hours.default_duration_minutes
+    google_event_id = await utils.google_calendar.create_google_calendar_event(
+        appointment_time_str=f"{date_str} {time_str}",
+        service_title=service_title,
+        client_name=client_name,
+        client_phone=phone_number,
+        service_duration_minutes=service_duration,
+        calendar_id=db.calendar_id,
+        event_id=idempotency_key
+    )
+    if not google_event_id:
+        logger.warning(f"Не удалось создать событие Google Calendar для клиента {client_name}.")
+    # ------------------------------------
+
     new_appointment = Appointment(
         client_name=client_name,
         service_id=service_id,
         appointment_time=appointment_dt,
         client_phone=phone_number,
-        google_event_id=None
+        google_event_id=google_event_id,
+        idempotency_key=idempotency_key
     )
 
-    appointment_id = await db.add_appointment(new_appointment)
+    # Проверка слота, вставка и данные услуги — одним запросом
+    booking = await db.book_appointment(new_appointment)
 
-    if appointment_id:
+    if booking.ok:
+        agenda_cache.invalidate(db)
         await callback.message.edit_text(f"✅ Запись для клиента <b>{client_name}</b> успешно создана!\n\n"
-                                         f"<b>Услуга:</b> {service_title}\n"
+                                         f"<b>Услуга:</b> {booking.service_title}\n"
                                          f"<b>Время:</b> {date_str} {time_str}\n"
-                                         f"<b>Телефон:</b> {phone_number}")
-
-        # --- ИНТЕГРАЦИЯ С GOOGLE CALENDAR ---
-        service_duration = 60
-        google_event_id = utils.google_calendar.create_google_calendar_event(
-            appointment_time_str=f"{date_str} {time_str}",
-            service_title=service_title,
-            client_name=client_name,
-            client_phone=phone_number,
-            service_duration_minutes=service_duration
-        )
-
+                                         f"<b>Телефон:</b> {phone_number}"
+                                         + (f"\n<b>Ресурс:</b> {booking.resource}" if booking.resource else ""))
+    elif booking.status == 'error':
+        # Запрос мог дойти до БД — событие и ключ сохраняем: повтор с тем же ключом не создаст дубль
+        await callback.message.edit_text("❌ Произошла ошибка при создании записи. Нажмите «Подтвердить» еще раз.",
+                                         reply_markup=get_confirmation_keyboard())
+        return
+    else:
+        # Запись не создана — событие в календаре больше не нужно
         if google_event_id:
-            logger.info(
-                f"Событие Google Calendar с ID '{google_event_id}' успешно создано для записи '{appointment_id}'.")
-            if await db.update_appointment_google_id(appointment_id, google_event_id):
-                logger.info(f"Google Event ID '{google_event_id}' успешно сохранен для записи '{appointment_id}'.")
-            else:
-                logger.warning(
-                    f"Не удалось сохранить Google Event ID '{google_event_id}' для записи '{appointment_id}'.")
-        else:
-            logger.warning(f"Не удалось создать событие Google Calendar для записи '{appointment_id}'.")
-        # ------------------------------------
+            await asyncio.to_thread(utils.google_calendar.delete_google_calendar_event, google_event_id, db.calendar_id)
+
+        if booking.status == 'slot_taken':
+            # Удаленное событие нельзя создать заново с тем же ID — новый ключ выдаст следующий экран подтверждения
+            await state.update_data(time=None, idempotency_key=None)
+            keyboard = await get_time_slots_keyboard(appointment_dt, db, service_duration)
+            await callback.message.edit_text("Это время уже занято. Выберите другое:", reply_markup=keyboard)
+            await state.set_state(AdminStates.waiting_for_time)
+            return
 
-    else:
         await callback.message.edit_text("❌ Произошла ошибка при создании записи. Попробуйте позже.")
 
     await state.clear()
@@ -291,51 +327,118 @@ def should_edit_message(current_text: str, new_text: str, current_markup, new_ma
     return False
 
 
-# --- Обработчик кнопки "Записи на сегодня" ---
-@router.callback_query(F.data == "admin_today")
-async def admin_today_appointments(callback: types.CallbackQuery, db: Database):
-    logger.info(f"Admin {callback.from_user.id} requested today's appointments.")
-    today = datetime.now()
-    appointments = await db.get_appointments_for_day(today)
-
-    if not appointments:
-        new_text = "📅 На сегодня активных записей нет."
-        new_markup = get_admin_main_keyboard()
-        # Проверяем, нужно ли редактировать
-        if should_edit_message(callback.message.text, new_text, callback.message.reply_markup, new_markup):
-            await callback.message.edit_text(new_text, reply_markup=new_markup)
-        else:
-            logger.info("Message for 'no appointments today' is already the same. Skipping edit.")
-        return
+# --- Расписание записей (день / неделя) с постраничным выводом ---
+async def show_agenda(callback: types.CallbackQuery, db: Database, view: str, anchor: date, page: int):
+    start, end = view_range(view, anchor)
+    agenda_page = await agenda_cache.get_page(db, view, anchor, page)
 
-    text_lines = [f"📅 <b>Записи на сегодня ({today.strftime('%d.%m.%Y')}):</b>\n\n"]
-    builder = InlineKeyboardBuilder()
-
-    for app in appointments:
+    if view == 'week':
+        header = f"📅 <b>Записи на неделю {start.strftime('%d.%m')} - {end.strftime('%d.%m.%Y')}</b>"
+    else:
+        header = f"📅 <b>Записи на {anchor.strftime('%d.%m.%Y')}</b>"
+    if page > 0 or agenda_page.has_next:
+        header += f" <i>(стр. {page + 1})</i>"
+
+    text_lines = [header + "\n\n"]
+    if not agenda_page.appointments:
+        text_lines.append("Активных записей нет.")
+    for app in agenda_page.appointments:
         client_name = app.client_name or "Имя не указано"
         service_title = app.service_title or "Услуга не указана"
-        app_time = app.appointment_time.strftime('%H:%M') if app.appointment_time else "Время не указано"
-
+        app_time = app.appointment_time.strftime('%d.%m %H:%M' if view == 'week' else '%H:%M')
         text_lines.append(f"▪️ {app_time} - {client_name} ({service_title})\n")
 
-        # Проверяем, что app.id существует
-        if app.id:
-            builder.add(types.InlineKeyboardButton(
-                text=f"{app_time} - {client_name}",
-                callback_data=f"admin_app_{app.id}"
-            ))
-        else:
-            logger.warning(f"Appointment object is missing 'id' for an item: {app}")
-
-    builder.adjust(1)
     new_text = "".join(text_lines)
-    new_markup = builder.as_markup()
+    new_markup = get_agenda_keyboard(agenda_page.appointments, view, anchor, page, agenda_page.has_next)
 
     # Проверяем, нужно ли редактировать
     if should_edit_message(callback.message.text, new_text, callback.message.reply_markup, new_markup):
         await callback.message.edit_text(new_text, reply_markup=new_markup)
     else:
-        logger.info("Message for 'today appointments' is already the same. Skipping edit.")
+        logger.info("Agenda message (%s, %s, page %s) is already the same. Skipping edit.", view, anchor, page)
+
+
+# --- Обработчик кнопки "Записи на сегодня" ---
+@router.callback_query(F.data == "admin_today")
+async def admin_today_appointments(callback: types.CallbackQuery, db: Database):
+    logger.info("Admin %s requested today's appointments.", callback.from_user.id)
+    await show_agenda(callback, db, 'day', date.today(), 0)
+
+
+# --- Навигация по расписанию: agenda_<view>_<YYYY-MM-DD>_<page|prev|next> ---
+@router.callback_query(F.data.startswith("agenda_"))
+async def admin_agenda_navigate(callback: types.CallbackQuery, db: Database):
+    try:
+        _, view, anchor_str, action = callback.data.split("_")
+        anchor = date.fromisoformat(anchor_str)
+        if view not in AGENDA_VIEWS:
+            raise ValueError
+    except ValueError:
+        logger.error(f"Could not parse agenda callback data: {callback.data}")
+        await callback.answer("Ошибка в формате данных.", show_alert=True)
+        return
+
+    if action in ('prev', 'next'):
+        anchor = shift_anchor(view, anchor, 1 if action == 'next' else -1)
+        page = 0
+    else:
+        page = int(action) if action.isdigit() else 0
+
+    await show_agenda(callback, db, view, anchor, page)
+
+
+# --- Поиск записей по имени клиента или телефону ---
+# /find Анна, /find 999 123 — по всей истории, от новых записей к старым (database/sql/search.sql)
+async def show_search_results(message: types.Message, db: Database, token: str, page: int, edit: bool):
+    search_page = await search_cache.get_page(db, token, page)
+    if search_page is None:
+        await message.answer("Результаты поиска устарели. Повторите команду /find.")
+        return
+
+    query = search_cache.query(token)
+    header = f"🔎 <b>Поиск: {html.escape(query)}</b>"
+    if page > 0 or search_page.has_next:
+        header += f" <i>(стр. {page + 1})</i>"
+    text_lines = [header + "\n\n"]
+    if not search_page.appointments:
+        text_lines.append("Ничего не найдено.")
+    for app in search_page.appointments:
+        text_lines.append(f"{STATUS_ICONS.get(app.status, '▪️')} {app.appointment_time.strftime('%d.%m.%Y %H:%M')} - "
+                          f"{html.escape(app.client_name or 'Имя не указано')} "
+                          f"({app.service_title or 'Услуга не указана'})\n")
+
+    new_text = "".join(text_lines)
+    new_markup = get_search_results_keyboard(search_page.appointments, token, page, search_page.has_next)
+    if not edit:
+        await message.answer(new_text, reply_markup=new_markup)
+    elif should_edit_message(message.text, new_text, message.reply_markup, new_markup):
+        await message.edit_text(new_text, reply_markup=new_markup)
+
+
+@router.message(Command("find"))
+async def admin_find_appointments(message: types.Message, command: CommandObject, db: Database):
+    query = (command.args or "").strip()
+    if len(query) < 3:
+        await message.answer("Формат: /find имя или телефон (не короче 3 символов)")
+        return
+
+    logger.info("Admin %s searched appointments.", message.from_user.id)
+    token = search_cache.start(db, query)
+    await show_search_results(message, db, token, 0, edit=False)
+
+
+# --- Листание результатов поиска: find_<token>_<page> ---
+@router.callback_query(F.data.startswith("find_"))
+async def admin_find_navigate(callback: types.CallbackQuery, db: Database):
+    _, token, page = callback.data.split("_")
+    await show_search_results(callback.message, db, token, int(page) if page.isdigit() else 0, edit=True)
+
+
+# --- Возврат в главное меню админа ---
+@router.callback_query(F.data == "admin_menu")
+async def admin_menu(callback: types.CallbackQuery, state: FSMContext):
+    await state.clear()
+    await callback.message.edit_text("Меню администратора:", reply_markup=get_admin_main_keyboard())
 
 
 # --- Обработчик для просмотра деталей конкретной записи ---
@@ -348,7 +451,7 @@ async def admin_appointment_details(callback: types.CallbackQuery, db: Database)
         await callback.answer("Ошибка в формате данных.", show_alert=True)
         return
 
-    logger.info(f"Admin requested details for appointment id: {app_id}")
+    logger.info("Admin requested details for appointment id: %s", app_id)
     app = await db.get_appointment_by_id(app_id)
 
     if not app:
@@ -374,6 +477,7 @@ async def admin_appointment_details(callback: types.CallbackQuery, db: Database)
         f"<b>Время:</b> {app.appointment_time.strftime('%d.%m.%Y %H:%M') if app.appointment_time else 'Не указано'}\n",
         f"<b>Номер телефона:</b> {app.client_phone or 'Не указан'}\n",
         f"<b>Статус:</b> {app.status}\n",
+        f"<b>Ресурс:</b> {app.resource}\n" if app.resource else "",
         f"<b>Google Event ID:</b> `{app.google_event_id or 'Не указан'}`"
     ]
     new_text = "".join(text_parts)
@@ -383,43 +487,160 @@ async def admin_appointment_details(callback: types.CallbackQuery, db: Database)
     if should_edit_message(callback.message.text, new_text, callback.message.reply_markup, new_markup):
         await callback.message.edit_text(new_text, reply_markup=new_markup)
     else:
-        logger.info(f"Message for appointment details {app.id} is already the same. Skipping edit.")
+        logger.info("Message for appointment details %s is already the same. Skipping edit.", app.id)
 
 
 # --- Обработчики действий с записью ---
+# Каждое действие — один запрос: мутация сразу возвращает измененную запись,
+# поэтому вместо перезагрузки списка показываем результат с кнопкой возврата.
 
 @router.callback_query(F.data.startswith("admin_complete_"))
-async def admin_complete(callback: types.CallbackQuery, db: Database):
+async def admin_complete(callback: types.CallbackQuery, db: Database, scheduler: AsyncIOScheduler,
+                         tenant: Tenant):
     app_id = callback.data.split("_")[2]
 
-    # Обновляем статус записи в БД
-    await db.update_appointment_status(app_id, 'completed')
-    await callback.answer("Статус изменен на 'Завершена'", show_alert=True)
+    # Завершить можно только активную запись
+    app = await db.update_appointment_status(app_id, 'completed', expected_status='active')
+    if not app:
+        await callback.answer("Запись не найдена или уже не активна.", show_alert=True)
+        return
 
-    # Возвращаемся к списку, но только если нужно его обновить
-    # Если список не изменился, edit_text будет проигнорирован
-    await admin_today_appointments(callback, db)  # <-- Здесь тоже может быть проблема, если список не изменился
+    agenda_cache.invalidate(db)
+    client_appointments_cache.invalidate(db, app.client_telegram_id)
+    cancel_appointment_reminders(scheduler, app_id, tenant.name)
+    await callback.answer("Статус изменен на 'Завершена'", show_alert=True)
+    await callback.message.edit_text(
+        f"✅ Запись <b>{app.client_name}</b> на {app.appointment_time.strftime('%d.%m.%Y %H:%M')} завершена.",
+        reply_markup=get_admin_back_to_list_keyboard())
 
 
 @router.callback_query(F.data.startswith("admin_cancel_"))
-async def admin_cancel(callback: types.CallbackQuery, db: Database):
+async def admin_cancel(callback: types.CallbackQuery, db: Database, scheduler: AsyncIOScheduler,
+                       tenant: Tenant):
     app_id = callback.data.split("_")[2]
 
-    # Обновляем статус записи в БД
-    await db.update_appointment_status(app_id, 'cancelled')
-    await callback.answer("Статус изменен на 'Отменена'", show_alert=True)
+    # Отменить можно только активную запись
+    app = await db.update_appointment_status(app_id, 'cancelled', expected_status='active')
+    if not app:
+        await callback.answer("Запись не найдена или уже не активна.", show_alert=True)
+        return
 
-    # Возвращаемся к списку
-    await admin_today_appointments(callback, db)  # <-- Здесь тоже может быть проблема
+    agenda_cache.invalidate(db)
+    client_appointments_cache.invalidate(db, app.client_telegram_id)
+    cancel_appointment_reminders(scheduler, app_id, tenant.name)
+    await callback.answer("Статус изменен на 'Отменена'", show_alert=True)
+    await callback.message.edit_text(
+        f"❌ Запись <b>{app.client_name}</b> на {app.appointment_time.strftime('%d.%m.%Y %H:%M')} отменена.",
+        reply_markup=get_admin_back_to_list_keyboard())
 
 
 @router.callback_query(F.data.startswith("admin_delete_"))
-async def admin_delete(callback: types.CallbackQuery, db: Database):
+async def admin_delete(callback: types.CallbackQuery, db: Database, scheduler: AsyncIOScheduler,
+                       tenant: Tenant):
     app_id = callback.data.split("_")[2]
 
-    # Удаляем запись из БД (и из Google Calendar, если это реализовано в delete_appointment)
-    await db.delete_appointment(app_id)
+    # Удаляем запись из БД (и из Google Calendar по google_event_id из ответа на delete)
+    app = await db.delete_appointment(app_id)
+    if not app:
+        await callback.answer("Запись не найдена! Возможно, она уже удалена.", show_alert=True)
+        return
+
+    agenda_cache.invalidate(db)
+    client_appointments_cache.invalidate(db, app.client_telegram_id)
+    cancel_appointment_reminders(scheduler, app_id, tenant.name)
     await callback.answer("Запись удалена!", show_alert=True)
+    await callback.message.edit_text(
+        f"🗑 Запись <b>{app.client_name}</b> на {app.appointment_time.strftime('%d.%m.%Y %H:%M')} удалена.",
+        reply_markup=get_admin_back_to_list_keyboard())
+
+
+# --- Выгрузка записей для бухгалтерии ---
+# /export — за прошлый месяц; /export 2024-05-01 2024-05-31 [csv|jsonl] — за период
+@router.message(Command("export"))
+async def admin_export_appointments(message: types.Message, command: CommandObject, db: Database):
+    args = (command.args or "").split()
+    fmt = 'csv'
+    if args and args[-1] in utils.export.EXPORT_FORMATS:
+        fmt = args.pop()
+
+    try:
+        if len(args) == 2:
+            start, end = date.fromisoformat(args[0]), date.fromisoformat(args[1])
+        elif not args:
+            end = date.today().replace(day=1) - timedelta(days=1)
+            start = end.replace(day=1)
+        else:
+            raise ValueError
+    except ValueError:
+        await message.answer("Формат: /export YYYY-MM-DD YYYY-MM-DD [csv|jsonl]")
+        return
+
+    logger.info("Admin %s requested export %s - %s (%s).", message.from_user.id, start, end, fmt)
+    processing_message = await message.answer("⏳ Готовлю выгрузку...")
+    path = await utils.export.export_to_tempfile(db, start, end, fmt)
+    if not path:
+        await processing_message.edit_text("❌ Не удалось сформировать выгрузку. Попробуйте позже.")
+        return
+
+    try:
+        await message.answer_document(
+            types.FSInputFile(path, filename=utils.export.export_filename(start, end, fmt)),
+            caption=f"📄 Записи с {start.strftime('%d.%m.%Y')} по {end.strftime('%d.%m.%Y')}"
+        )
+        await processing_message.delete()
+    finally:
+        os.remove(path)
+
+
+# --- Аналитика: загрузка по часам, выручка, доля отмен ---
+# /analytics — за последние 90 дней; /analytics 2024-01-01 2024-06-30 — за период
+@router.message(Command("analytics"))
+async def admin_analytics(message: types.Message, command: CommandObject, db: Database):
+    args = (command.args or "").split()
+    try:
+        if len(args) == 2:
+            start, end = date.fromisoformat(args[0]), date.fromisoformat(args[1])
+        elif not args:
+            start, end = utils.analytics.default_period()
+        else:
+            raise ValueError
+        if start > end:
+            raise ValueError
+    except ValueError:
+        await message.answer("Формат: /analytics YYYY-MM-DD YYYY-MM-DD")
+        return
+
+    logger.info("Admin %s requested analytics %s - %s.", message.from_user.id, start, end)
+    processing_message = await message.answer("⏳ Считаю аналитику...")
+    try:
+        report = await utils.analytics.build_report(db, start, end)
+        # Отрисовка графика занимает сотни миллисекунд — не в event loop
+        chart = await asyncio.to_thread(utils.analytics.render_chart, report) if report.total else None
+    except Exception as e:
+        logger.error("Ошибка при расчете аналитики за %s - %s: %s", start, end, e, exc_info=True)
+        await processing_message.edit_text("❌ Не удалось посчитать аналитику. Попробуйте позже.")
+        return
+
+    await processing_message.edit_text(utils.analytics.format_summary(report))
+    if chart:
+        await message.answer_photo(types.BufferedInputFile(chart, filename=f"analytics_{start}_{end}.png"))
+
+
+# --- Последние сохраненные трейсы (медленные и с ошибками) ---
+@router.message(Command("traces"))
+async def admin_recent_traces(message: types.Message):
+    traces = list(tracer.recent)[-5:]
+    if not traces:
+        await message.answer("Медленных трейсов пока нет.")
+        return
 
-    # Возвращаемся к списку
-    await admin_today_appointments(callback, db)  # <-- Здесь тоже может быть проблема
\ No newline at end of file
+    text_lines = ["<b>🐢 Последние трейсы:</b>\n"]
+    for trace in reversed(traces):
+        status = "❌" if trace['error'] else "✅"
+        text_lines.append(f"\n{status} <b>{trace['name']}</b> — {trace['duration_ms']:.0f} мс "
+                          f"(<code>{trace['trace_id'][:8]}</code>)")
+        # Показываем самые долгие вложенные операции
+        children = [span for span in trace['spans'] if span['parent_id']]
+        for span in sorted(children, key=lambda s: s['duration_ms'] or 0, reverse=True)[:4]:
+            text_lines.append(f"   ▪️ {span['name']}: {span['duration_ms'] or 0:.0f} мс")
+    await message.answer("\n".join(text_lines))
\ No newline at end of file
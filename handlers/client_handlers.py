@@ -1,15 +1,25 @@
 # handlers/client_handlers.py
 
+import asyncio
 import logging
+import uuid
+from typing import Optional
 from aiogram import Router, types, F, Bot
 from aiogram.fsm.context import FSMContext
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from datetime import datetime
+from config_reader import config
 from database.db_supabase import Database
-from database.models import Appointment
+from database.models import Appointment, WaitlistEntry
 from states.fsm_states import ClientStates
 from keyboards.client_keyboards import *
-from utils.notifications import notify_admin_on_new_booking
+from utils.notifications import notify_admin_on_client_cancellation, notify_admin_on_new_booking
 import utils.google_calendar
+from utils.working_hours import working_hours
+from utils.agenda import agenda_cache, client_appointments_cache
+from utils.scheduler import cancel_appointment_reminders, describe_reminders, schedule_appointment_reminders
+from utils.tenants import Tenant
+from utils.waitlist import WAITLIST_WINDOWS, Waitlist, entry_slot_starts
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -18,7 +28,7 @@ logger = logging.getLogger(__name__)
 # --- Старт флоу записи ---
 @router.callback_query(F.data == "client_book")
 async def client_start_booking(callback: types.CallbackQuery, state: FSMContext, db: Database):
-    logger.info(f"User {callback.from_user.id} started booking.")
+    logger.info("User %s started booking.", callback.from_user.id)
     keyboard = await get_service_categories_keyboard(db)
     await callback.message.edit_text("Выберите категорию услуг:", reply_markup=keyboard)
     await state.set_state(ClientStates.waiting_for_category)
@@ -54,7 +64,8 @@ async def client_pick_service(callback: types.CallbackQuery, state: FSMContext,
         await callback.answer("Услуга не найдена, попробуйте снова.", show_alert=True)
         return
 
-    await state.update_data(service_id=service_id, service_title=service.title, service_price=service.price)
+    await state.update_data(service_id=service_id, service_title=service.title, service_price=service.price,
+                            service_duration=working_hours.duration_for(service))
     keyboard = await get_date_keyboard(db)
     await callback.message.edit_text(f"Вы выбрали: {service.title}.\nТеперь выберите удобный день:",
                                      reply_markup=keyboard)
@@ -74,7 +85,7 @@ async def client_back_to_date_choice(callback: types.CallbackQuery, state: FSMCo
         return
 
     target_date = datetime.strptime(date_str, '%Y-%m-%d')
-    keyboard = await get_time_slots_keyboard(target_date, db)
+    keyboard = await get_time_slots_keyboard(target_date, db, data.get('service_duration'), waitlist=True)
     await callback.message.edit_text(f"Выбрана дата: {date_str}.\nТеперь выберите свободное время:",
                                      reply_markup=keyboard)
     await state.set_state(ClientStates.waiting_for_time)
@@ -85,8 +96,9 @@ async def client_back_to_date_choice(callback: types.CallbackQuery, state: FSMCo
 async def client_pick_date(callback: types.CallbackQuery, state: FSMContext, db: Database):
     date_str = callback.data.split("_")[1]
     await state.update_data(date=date_str)
+    data = await state.get_data()
     target_date = datetime.strptime(date_str, '%Y-%m-%d')
-    keyboard = await get_time_slots_keyboard(target_date, db)
+    keyboard = await get_time_slots_keyboard(target_date, db, data.get('service_duration'), waitlist=True)
     await callback.message.edit_text(f"Выбрана дата: {date_str}.\nТеперь выберите свободное время:",
                                      reply_markup=keyboard)
     await state.set_state(ClientStates.waiting_for_time)
@@ -116,7 +128,9 @@ async def client_pick_time(callback: types.CallbackQuery, state: FSMContext):
 @router.message(ClientStates.waiting_for_phone)
 async def client_provide_phone(message: types.Message, state: FSMContext, db: Database, bot: Bot):
     phone_number = message.text
-    await state.update_data(phone_number=phone_number)  # Сохраняем номер телефона
+    # Ключ идемпотентности выдается один раз на экран подтверждения: повторное нажатие «Подтвердить»
+    # или повторная доставка апдейта вернут ту же запись. Hex UUID годится и как ID события Google Calendar
+    await state.update_data(phone_number=phone_number, idempotency_key=uuid.uuid4().hex)
 
     data = await state.get_data()
 
@@ -135,14 +149,14 @@ async def client_provide_phone(message: types.Message, state: FSMContext, db: Da
 # --- Шаг 7: Финальное подтверждение записи ---
 # Этот обработчик срабатывает, когда клиент нажимает "Подтвердить" после ввода номера.
 @router.callback_query(ClientStates.waiting_for_confirmation, F.data == "confirm_booking")
-async def client_confirm_booking_final(callback: types.CallbackQuery, state: FSMContext, db: Database, bot: Bot):
+async def client_confirm_booking_final(callback: types.CallbackQuery, state: FSMContext, db: Database, bot: Bot,
+                                       scheduler: AsyncIOScheduler, tenant: Tenant):
     data = await state.get_data()
     user = callback.from_user  # Получаем пользователя, который нажал кнопку
 
     client_name = data.get('client_name')  # Имя берется из FSM
     service_id = data.get('service_id')
     service_title = data.get('service_title')
-    service_price = data.get('service_price')
     date_str = data.get('date')
     time_str = data.get('time')
     phone_number = data.get('phone_number')
@@ -159,55 +173,83 @@ async def client_confirm_booking_final(callback: types.CallbackQuery, state: FSM
         await state.clear()
         return
 
+    idempotency_key = data.get('idempotency_key')
+    if not idempotency_key:
+        idempotency_key = uuid.uuid4().hex
+        await state.update_data(idempotency_key=idempotency_key)
+
+    # --- ИНТЕГРАЦИЯ С GOOGLE CALENDAR ---
+    # Событие создаем до бронирования, чтобы его ID попал в БД тем же запросом.
+    # ID события — ключ идемпотентности, поэтому повтор не создаст второе событие
+    service_duration = data.get('service_duration') or working_hours.default_duration_minutes
+    google_event_id = await utils.google_calendar.create_google_calendar_event(
+        appointment_time_str=f"{date_str} {time_str}",
+        service_title=service_title,
+        client_name=client_name,
+        client_phone=phone_number,
+        service_duration_minutes=service_duration,
+        calendar_id=db.calendar_id,
+        event_id=idempotency_key
+    )
+    if not google_event_id:
+        logger.warning(f"Не удалось создать событие Google Calendar для клиента {user.id}.")
+    # ------------------------------------
+
     new_appointment = Appointment(
         client_name=client_name,  # Имя клиента
         client_telegram_id=user.id,  # ID клиента, который нажал кнопку
         service_id=service_id,
         appointment_time=appointment_dt,
         client_phone=phone_number,
-        google_event_id=None
+        google_event_id=google_event_id,
+        idempotency_key=idempotency_key
     )
 
-    appointment_id = await db.add_appointment(new_appointment)
+    # Проверка слота, вставка и данные услуги — одним запросом
+    booking = await db.book_appointment(new_appointment)
 
-    if appointment_id:
+    if booking.ok:
+        agenda_cache.invalidate(db)
+        client_appointments_cache.invalidate(db, user.id)
+        reminders = describe_reminders(appointment_dt)
         await callback.message.edit_text(
             "✅ Вы успешно записаны!\n\n"
-            "Вам придет напоминание за день до визита. Ждем вас!"
-        )
-
-        # --- Уведомление администратору ---
-        new_appointment.id = appointment_id
-        await notify_admin_on_new_booking(
-            bot=bot,
-            appointment=new_appointment,
-            service_title=service_title,
-            service_price=service_price
-        )
-        # ------------------------------------
-
-        # --- ИНТЕГРАЦИЯ С GOOGLE CALENDAR ---
-        service_duration = 60
-        google_event_id = utils.google_calendar.create_google_calendar_event(
-            appointment_time_str=f"{date_str} {time_str}",
-            service_title=service_title,
-            client_name=client_name,
-            client_phone=phone_number,
-            service_duration_minutes=service_duration
+            f"{reminders + ' ' if reminders else ''}Ждем вас!"
         )
 
+        # Повторное подтверждение: напоминания и уведомление уже отправлены первым
+        if not booking.replayed:
+            # --- Уведомление администратору ---
+            new_appointment.id = booking.appointment_id
+            schedule_appointment_reminders(scheduler, new_appointment, tenant.name)
+            await notify_admin_on_new_booking(
+                bot=bot,
+                appointment=new_appointment,
+                service_title=booking.service_title,
+                service_price=booking.service_price,
+                admin_id=tenant.admin_id
+            )
+            # ------------------------------------
+    elif booking.status == 'error':
+        # Запрос мог дойти до БД — событие и ключ сохраняем: повтор с тем же ключом не создаст дубль
+        await callback.message.edit_text("❌ Произошла ошибка при записи. Нажмите «Подтвердить» еще раз.",
+                                         reply_markup=get_confirmation_keyboard())
+        return
+    else:
+        # Запись не создана — событие в календаре больше не нужно
         if google_event_id:
-            logger.info(f"Событие Google Calendar с ID '{google_event_id}' успешно создано для клиента {user.id}.")
-            if await db.update_appointment_google_id(appointment_id, google_event_id):
-                logger.info(f"Google Event ID '{google_event_id}' успешно сохранен для записи '{appointment_id}'.")
-            else:
-                logger.warning(
-                    f"Не удалось сохранить Google Event ID '{google_event_id}' для записи '{appointment_id}'.")
-        else:
-            logger.warning(f"Не удалось создать событие Google Calendar для клиента {user.id}.")
-        # ------------------------------------
+            await asyncio.to_thread(utils.google_calendar.delete_google_calendar_event, google_event_id, db.calendar_id)
+
+        if booking.status == 'slot_taken':
+            # Время успели занять, пока клиент подтверждал — предлагаем выбрать другое.
+            # Удаленное событие нельзя создать заново с тем же ID — новый ключ выдаст следующий экран подтверждения
+            await state.update_data(time=None, idempotency_key=None)
+            keyboard = await get_time_slots_keyboard(appointment_dt, db, service_duration, waitlist=True)
+            await callback.message.edit_text("😔 Это время уже заняли. Пожалуйста, выберите другое:",
+                                             reply_markup=keyboard)
+            await state.set_state(ClientStates.waiting_for_time)
+            return
 
-    else:
         await callback.message.edit_text("❌ Произошла ошибка при записи. Попробуйте позже.")
 
     await state.clear()
@@ -217,4 +259,218 @@ async def client_confirm_booking_final(callback: types.CallbackQuery, state: FSM
 @router.callback_query(F.data == "cancel_booking")
 async def cancel_booking(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
-    await callback.message.edit_text("Запись отменена.", reply_markup=get_client_main_keyboard())
\ No newline at end of file
+    await callback.message.edit_text("Запись отменена.", reply_markup=get_client_main_keyboard())
+
+
+# --- Мои записи: список предстоящих записей клиента с отменой ---
+async def show_my_appointments(callback: types.CallbackQuery, db: Database, page: int):
+    my_page = await client_appointments_cache.get_page(db, callback.from_user.id, page)
+    if not my_page.appointments and page > 0:
+        # Записи со страницы успели отменить или они прошли — показываем первую
+        page = 0
+        my_page = await client_appointments_cache.get_page(db, callback.from_user.id, page)
+
+    if not my_page.appointments:
+        await callback.message.edit_text("У вас нет предстоящих записей.", reply_markup=get_client_main_keyboard())
+        return
+
+    header = "🗂 <b>Ваши записи</b>"
+    if page > 0 or my_page.has_next:
+        header += f" <i>(стр. {page + 1})</i>"
+    text_lines = [header + "\n\n"]
+    for app in my_page.appointments:
+        text_lines.append(f"▪️ {app.appointment_time.strftime('%d.%m.%Y в %H:%M')} — "
+                          f"{app.service_title or 'Услуга не указана'}\n")
+    text_lines.append("\nВыберите запись, чтобы посмотреть детали или отменить ее.")
+    await callback.message.edit_text("".join(text_lines),
+                                     reply_markup=get_my_appointments_keyboard(my_page.appointments, page,
+                                                                               my_page.has_next))
+
+
+@router.callback_query(F.data == "my_appointments")
+async def client_my_appointments(callback: types.CallbackQuery, state: FSMContext, db: Database):
+    await state.clear()
+    await show_my_appointments(callback, db, 0)
+
+
+@router.callback_query(F.data.startswith("my_page_"))
+async def client_my_appointments_page(callback: types.CallbackQuery, db: Database):
+    page = callback.data.split("_")[2]
+    await show_my_appointments(callback, db, int(page) if page.isdigit() else 0)
+
+
+async def _get_own_appointment(callback: types.CallbackQuery, db: Database, app_id: str) -> Optional[Appointment]:
+    """Запись клиента по ID; чужие и неактивные записи не показываются."""
+    app = await db.get_appointment_by_id(app_id)
+    if not app or app.client_telegram_id != callback.from_user.id or app.status != 'active':
+        await callback.answer("Запись не найдена или уже не активна.", show_alert=True)
+        return None
+    return app
+
+
+# my_app_<id>_<page>
+@router.callback_query(F.data.startswith("my_app_"))
+async def client_my_appointment_details(callback: types.CallbackQuery, db: Database):
+    app_id, page = callback.data[len("my_app_"):].rsplit("_", 1)
+    app = await _get_own_appointment(callback, db, app_id)
+    if not app:
+        return
+
+    text = (f"<b>Ваша запись</b>\n\n"
+            f"<b>Услуга:</b> {app.service_title or 'Не указана'}\n"
+            f"<b>Стоимость:</b> {app.service_price or 'Не указана'} ₽\n"
+            f"<b>Дата и время:</b> {app.appointment_time.strftime('%d.%m.%Y в %H:%M')}")
+    await callback.message.edit_text(text, reply_markup=get_my_appointment_keyboard(app.id, int(page)))
+
+
+# Подтверждение отмены: my_cancel_ok_<id>. Регистрируется раньше my_cancel_<id>_<page> — у них общий префикс
+@router.callback_query(F.data.startswith("my_cancel_ok_"))
+async def client_cancel_own_appointment(callback: types.CallbackQuery, db: Database, bot: Bot,
+                                        scheduler: AsyncIOScheduler, tenant: Tenant):
+    app_id = callback.data[len("my_cancel_ok_"):]
+    app = await _get_own_appointment(callback, db, app_id)
+    if not app:
+        return
+
+    # Условное обновление: только активная запись и только этого клиента
+    cancelled = await db.update_appointment_status(app_id, 'cancelled', expected_status='active',
+                                                   client_telegram_id=callback.from_user.id)
+    if not cancelled:
+        await callback.answer("Запись не найдена или уже не активна.", show_alert=True)
+        return
+
+    # Время сразу свободно: слоты считаются только по активным записям, кэши сброшены
+    agenda_cache.invalidate(db)
+    client_appointments_cache.invalidate(db, callback.from_user.id)
+    cancel_appointment_reminders(scheduler, app_id, tenant.name)
+    logger.info("User %s cancelled appointment %s.", callback.from_user.id, app_id)
+
+    await callback.message.edit_text(
+        f"❌ Запись на {app.appointment_time.strftime('%d.%m.%Y в %H:%M')} отменена.",
+        reply_markup=get_client_main_keyboard())
+    await notify_admin_on_client_cancellation(bot, app, admin_id=tenant.admin_id)
+
+
+# my_cancel_<id>_<page>: спрашиваем подтверждение
+@router.callback_query(F.data.startswith("my_cancel_"))
+async def client_confirm_cancel_own_appointment(callback: types.CallbackQuery, db: Database):
+    app_id, page = callback.data[len("my_cancel_"):].rsplit("_", 1)
+    app = await _get_own_appointment(callback, db, app_id)
+    if not app:
+        return
+
+    await callback.message.edit_text(
+        f"Отменить запись на {app.appointment_time.strftime('%d.%m.%Y в %H:%M')} "
+        f"({app.service_title or 'услуга не указана'})?",
+        reply_markup=get_my_appointment_keyboard(app.id, int(page), confirm=True))
+
+
+@router.callback_query(F.data == "client_menu")
+async def client_menu(callback: types.CallbackQuery, state: FSMContext):
+    await state.clear()
+    await callback.message.edit_text("Главное меню:", reply_markup=get_client_main_keyboard())
+
+
+# --- Лист ожидания (utils/waitlist.py) ---
+@router.callback_query(ClientStates.waiting_for_time, F.data == "waitlist_join")
+async def client_waitlist_join(callback: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    await callback.message.edit_text(
+        f"🔔 <b>Лист ожидания на {data.get('date', '')}</b>\n\n"
+        f"Если в выбранное время кто-то отменит запись, бот сразу предложит его вам.\n"
+        f"Когда вам удобно прийти?",
+        reply_markup=get_waitlist_window_keyboard({key: window.label for key, window in WAITLIST_WINDOWS.items()}))
+
+
+def _waitlist_entry_from_state(data: dict, user: types.User, window_key: str,
+                               phone_number: Optional[str] = None) -> Optional[WaitlistEntry]:
+    window = WAITLIST_WINDOWS.get(window_key)
+    if not window or not data.get('service_id') or not data.get('date'):
+        return None
+    return WaitlistEntry(
+        client_telegram_id=user.id,
+        client_name=data.get('client_name') or user.full_name,
+        client_phone=phone_number,
+        service_id=data['service_id'],
+        day=datetime.strptime(data['date'], '%Y-%m-%d').date(),
+        window_start=window.start,
+        window_end=window.end,
+    )
+
+
+@router.callback_query(ClientStates.waiting_for_time, F.data.startswith("wl_window_"))
+async def client_waitlist_pick_window(callback: types.CallbackQuery, state: FSMContext):
+    window_key = callback.data[len("wl_window_"):]
+    data = await state.get_data()
+    entry = _waitlist_entry_from_state(data, callback.from_user, window_key)
+    if not entry:
+        await callback.answer("Не удалось определить услугу или дату. Пожалуйста, начните заново.", show_alert=True)
+        await state.clear()
+        return
+    if not entry_slot_starts(entry, data.get('service_duration') or working_hours.default_duration_minutes):
+        await callback.answer("В это время приема нет. Выберите другое окно.", show_alert=True)
+        return
+
+    # Номер нужен сразу: предложенное время бронируется одним нажатием, без повторных вопросов
+    await state.update_data(waitlist_window=window_key)
+    await callback.message.edit_text("Отправьте ваш номер телефона, чтобы мы могли связаться с вами.")
+    await state.set_state(ClientStates.waiting_for_waitlist_phone)
+
+
+@router.message(ClientStates.waiting_for_waitlist_phone)
+async def client_waitlist_provide_phone(message: types.Message, state: FSMContext, waitlist: Waitlist,
+                                        tenant: Tenant):
+    phone_number = (message.text or '').strip()
+    if not phone_number:
+        await message.answer("Пожалуйста, отправьте номер телефона текстом.")
+        return
+
+    data = await state.get_data()
+    entry = _waitlist_entry_from_state(data, message.from_user, data.get('waitlist_window', ''), phone_number)
+    if not entry:
+        await message.answer("Не удалось определить услугу или дату. Пожалуйста, начните заново.",
+                             reply_markup=get_client_main_keyboard())
+        await state.clear()
+        return
+
+    saved = await waitlist.join(tenant.name, entry)
+    if not saved:
+        await message.answer("Не удалось записать вас в лист ожидания. Попробуйте позже.",
+                             reply_markup=get_client_main_keyboard())
+        await state.clear()
+        return
+
+    window = WAITLIST_WINDOWS[data['waitlist_window']]
+    await state.clear()
+    await message.answer(
+        f"✅ Вы в листе ожидания на {entry.day.strftime('%d.%m.%Y')} ({window.label.lower()}).\n\n"
+        f"Если время освободится, бот пришлет предложение — на подтверждение будет "
+        f"{config.waitlist_claim_minutes} мин.",
+        reply_markup=get_client_main_keyboard())
+
+
+@router.callback_query(F.data.startswith("wl_claim_"))
+async def client_waitlist_claim(callback: types.CallbackQuery, waitlist: Waitlist, tenant: Tenant, db: Database):
+    entry_id = callback.data[len("wl_claim_"):]
+    status = await waitlist.claim(tenant.name, entry_id, callback.from_user.id)
+    if status == 'ok':
+        # Заявка хранит предложенное время и после записи
+        entry = await db.get_waitlist_entry(entry_id)
+        reminders = describe_reminders(entry.offered_slot if entry else None)
+        await callback.message.edit_text("✅ Вы успешно записаны!\n\n"
+                                         f"{reminders + ' ' if reminders else ''}Ждем вас!")
+    elif status == 'error':
+        # Предложение в силе: повтор с тем же ключом не создаст вторую запись
+        await callback.answer("❌ Произошла ошибка при записи. Нажмите «Записаться» еще раз.", show_alert=True)
+    elif status == 'slot_taken':
+        await callback.message.edit_text("😔 Это время уже заняли. Вы остаетесь в листе ожидания.")
+    else:
+        await callback.message.edit_text("⌛️ Предложение уже недействительно.")
+
+
+@router.callback_query(F.data.startswith("wl_decline_"))
+async def client_waitlist_decline(callback: types.CallbackQuery, waitlist: Waitlist, tenant: Tenant):
+    if await waitlist.decline(tenant.name, callback.data[len("wl_decline_"):], callback.from_user.id):
+        await callback.message.edit_text("Хорошо, предложим время следующему. Вы остаетесь в листе ожидания.")
+    else:
+        await callback.message.edit_text("⌛️ Предложение уже недействительно.")
\ No newline at end of file
@@ -1,17 +1,17 @@
 from aiogram import Router, types
 from aiogram.filters import CommandStart
 from aiogram.fsm.context import FSMContext
-from config_reader import config
 from keyboards.admin_keyboards import get_admin_main_keyboard
 from keyboards.client_keyboards import get_client_main_keyboard
+from utils.tenants import Tenant
 from aiogram import types
 
 router = Router()
 
 @router.message(CommandStart())
-async def start_command(message: types.Message, state: FSMContext):
+async def start_command(message: types.Message, state: FSMContext, tenant: Tenant):
     await state.clear()
-    if message.from_user.id == config.admin_id:
+    if message.from_user.id == tenant.admin_id:
         await message.answer("Добро пожаловать, Администратор!", reply_markup=get_admin_main_keyboard())
     else:
         await message.answer(f"Здравствуйте, {message.from_user.full_name}!\nДобро пожаловать в наш салон.", reply_markup=get_client_main_keyboard())
\ No newline at end of file
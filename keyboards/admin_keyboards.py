@@ -3,6 +3,9 @@
 from aiogram.types import InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram import types
+from datetime import date
+from typing import List
+from database.models import Appointment
 
 def get_admin_main_keyboard():
     builder = InlineKeyboardBuilder()
@@ -20,4 +23,66 @@ def get_admin_appointment_actions_keyboard(app_id: str):
     builder.add(InlineKeyboardButton(text="🗑 Удалить", callback_data=f"admin_delete_{app_id}"))
     builder.add(InlineKeyboardButton(text="🔙 Назад к списку", callback_data="admin_today"))
     builder.adjust(2)
+    return builder.as_markup()
+
+
+def get_admin_back_to_list_keyboard():
+    builder = InlineKeyboardBuilder()
+    builder.add(InlineKeyboardButton(text="🔙 Назад к списку", callback_data="admin_today"))
+    return builder.as_markup()
+
+
+# Значок статуса записи в результатах поиска
+STATUS_ICONS = {'active': '🟢', 'completed': '✅', 'cancelled': '❌'}
+
+
+def get_search_results_keyboard(appointments: List[Appointment], token: str, page: int, has_next: bool):
+    """Результаты поиска /find: записи страницы (от новых к старым) и листание."""
+    builder = InlineKeyboardBuilder()
+    for app in appointments:
+        builder.row(InlineKeyboardButton(
+            text=f"{STATUS_ICONS.get(app.status, '▪️')} {app.appointment_time.strftime('%d.%m.%y %H:%M')} - "
+                 f"{app.client_name or 'Имя не указано'}",
+            callback_data=f"admin_app_{app.id}"))
+
+    page_buttons = []
+    if page > 0:
+        page_buttons.append(InlineKeyboardButton(text="⬆️ Пред. стр.", callback_data=f"find_{token}_{page - 1}"))
+    if has_next:
+        page_buttons.append(InlineKeyboardButton(text="⬇️ След. стр.", callback_data=f"find_{token}_{page + 1}"))
+    if page_buttons:
+        builder.row(*page_buttons)
+    builder.row(InlineKeyboardButton(text="🏠 Меню", callback_data="admin_menu"))
+    return builder.as_markup()
+
+
+def get_agenda_keyboard(appointments: List[Appointment], view: str, anchor: date, page: int, has_next: bool):
+    """Клавиатура расписания: записи текущей страницы, листание страниц и периодов, переключение день/неделя."""
+    builder = InlineKeyboardBuilder()
+    anchor_str = anchor.strftime('%Y-%m-%d')
+
+    for app in appointments:
+        app_time = app.appointment_time.strftime('%d.%m %H:%M' if view == 'week' else '%H:%M')
+        builder.row(InlineKeyboardButton(text=f"{app_time} - {app.client_name or 'Имя не указано'}",
+                                         callback_data=f"admin_app_{app.id}"))
+
+    page_buttons = []
+    if page > 0:
+        page_buttons.append(InlineKeyboardButton(text="⬆️ Пред. стр.",
+                                                 callback_data=f"agenda_{view}_{anchor_str}_{page - 1}"))
+    if has_next:
+        page_buttons.append(InlineKeyboardButton(text="⬇️ След. стр.",
+                                                 callback_data=f"agenda_{view}_{anchor_str}_{page + 1}"))
+    if page_buttons:
+        builder.row(*page_buttons)
+
+    period_name = "неделя" if view == 'week' else "день"
+    builder.row(
+        InlineKeyboardButton(text=f"◀️ Пред. {period_name}", callback_data=f"agenda_{view}_{anchor_str}_prev"),
+        InlineKeyboardButton(text=f"След. {period_name} ▶️", callback_data=f"agenda_{view}_{anchor_str}_next"),
+    )
+    other_view = 'day' if view == 'week' else 'week'
+    builder.row(InlineKeyboardButton(text="📆 По дням" if other_view == 'day' else "🗓 Неделя",
+                                     callback_data=f"agenda_{other_view}_{anchor_str}_0"),
+                InlineKeyboardButton(text="🏠 Меню", callback_data="admin_menu"))
     return builder.as_markup()
\ No newline at end of file
@@ -1,10 +1,15 @@
 from aiogram.types import InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from config_reader import config
 from database.db_supabase import Database
+from database.models import Appointment
+from database.resilience import DatabaseUnavailable
+from utils.working_hours import working_hours
 from datetime import datetime, timedelta, date
 from aiogram import types
 import asyncio
 import logging
+from typing import Dict, List, Optional
 
 logger = logging.getLogger(__name__)
 
@@ -12,6 +17,38 @@ def get_client_main_keyboard():
     # Эта функция не обращается к БД, остается синхронной
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(text="📅 Записаться на услугу", callback_data="client_book"))
+    builder.row(InlineKeyboardButton(text="🗂 Мои записи", callback_data="my_appointments"))
+    return builder.as_markup()
+
+
+def get_my_appointments_keyboard(appointments: List[Appointment], page: int, has_next: bool):
+    """«Мои записи»: кнопка на каждую запись страницы и листание страниц."""
+    builder = InlineKeyboardBuilder()
+    for app in appointments:
+        builder.row(InlineKeyboardButton(
+            text=f"{app.appointment_time.strftime('%d.%m %H:%M')} - {app.service_title or 'Услуга'}",
+            callback_data=f"my_app_{app.id}_{page}"))
+
+    page_buttons = []
+    if page > 0:
+        page_buttons.append(InlineKeyboardButton(text="⬆️ Пред. стр.", callback_data=f"my_page_{page - 1}"))
+    if has_next:
+        page_buttons.append(InlineKeyboardButton(text="⬇️ След. стр.", callback_data=f"my_page_{page + 1}"))
+    if page_buttons:
+        builder.row(*page_buttons)
+    builder.row(InlineKeyboardButton(text="🏠 Меню", callback_data="client_menu"))
+    return builder.as_markup()
+
+
+def get_my_appointment_keyboard(appointment_id: str, page: int, confirm: bool = False):
+    """Действия клиента с записью; confirm=True — второй шаг отмены."""
+    builder = InlineKeyboardBuilder()
+    if confirm:
+        builder.row(InlineKeyboardButton(text="✅ Да, отменить", callback_data=f"my_cancel_ok_{appointment_id}"))
+        builder.row(InlineKeyboardButton(text="🔙 Не отменять", callback_data=f"my_app_{appointment_id}_{page}"))
+    else:
+        builder.row(InlineKeyboardButton(text="❌ Отменить запись", callback_data=f"my_cancel_{appointment_id}_{page}"))
+        builder.row(InlineKeyboardButton(text="🔙 К моим записям", callback_data=f"my_page_{page}"))
     return builder.as_markup()
 
 
@@ -66,7 +103,7 @@ async def get_date_keyboard(db: Database):
     current_check_date = today + timedelta(days=1)
 
     while not first_available_date and current_check_date < today + timedelta(days=14):
-        is_available = True
+        is_available = working_hours.is_working_day(current_check_date)
         for period in vacation_periods:
             if period['start_date'] <= current_check_date <= period['end_date']:
                 is_available = False
@@ -90,7 +127,8 @@ async def get_date_keyboard(db: Database):
         current_date = first_available_date + timedelta(days=i)
         date_str = current_date.strftime('%Y-%m-%d')
         
-        is_available = True
+        # Выходные дни по графику не показываем
+        is_available = working_hours.is_working_day(current_date)
         for period in vacation_periods:
             if period['start_date'] <= current_date <= period['end_date']:
                 is_available = False
@@ -102,7 +140,7 @@ async def get_date_keyboard(db: Database):
                 callback_data=f"date_{date_str}"
             ))
         else:
-            logger.info(f"Date {current_date} is in vacation period. Skipping.")
+            logger.info("Date %s is in vacation period. Skipping.", current_date)
             
     builder.add(types.InlineKeyboardButton(
         text="🔙 Назад к услугам",
@@ -115,41 +153,64 @@ async def get_date_keyboard(db: Database):
 
 # --- Функция get_time_slots_keyboard ---
 # Она уже должна быть async, так как использует db.get_appointments_for_day
-async def get_time_slots_keyboard(target_date: datetime, db: Database):
+async def get_time_slots_keyboard(target_date: datetime, db: Database, duration_minutes: Optional[int] = None,
+                                  waitlist: bool = False):
+    """
+    Свободные начала приема на день по графику работы (utils/working_hours.py).
+    Время считается свободным, если вся услуга длительностью duration_minutes
+    не пересекается с другими записями, перерывами и временем, предложенным из листа ожидания
+    (при нескольких ресурсах — хотя бы у одного ресурса).
+    waitlist=True добавляет кнопку листа ожидания (для клиента).
+    """
     builder = InlineKeyboardBuilder()
 
     try:
         # --- ВАЖНО: db.get_appointments_for_day - ASYNC МЕТОД ---
         appointments_on_day = await db.get_appointments_for_day(target_date)
-        booked_times = {app.appointment_time.strftime('%H:%M') for app in appointments_on_day if app.appointment_time}
+        # Предложенное из листа ожидания время закреплено за клиентом до конца срока (RPC его не отдаст)
+        appointments_on_day = appointments_on_day + await db.get_waitlist_holds(target_date.date())
+    except DatabaseUnavailable:
+        raise  # Сообщение пользователю — в обработчике ошибок (main.py)
     except Exception as e:
         logger.error(f"Error fetching appointments for time slot check on {target_date.date()}: {e}")
-        booked_times = set()
-
-    start_hour = 9
-    end_hour = 18
-    slot_interval_minutes = 60
-
-    current_time = target_date.replace(hour=start_hour, minute=0, second=0, microsecond=0)
-
-    while current_time.hour < end_hour:
-        slot_time_str = current_time.strftime('%H:%M')
+        appointments_on_day = []
 
-        if slot_time_str not in booked_times:
-            builder.add(types.InlineKeyboardButton(
-                text=slot_time_str,
-                callback_data=f"time_{slot_time_str}"
-            ))
-        else:
-            pass  # Не добавляем занятые слоты
+    appointments_on_day = [app for app in appointments_on_day if app.appointment_time]
+    duration_minutes = duration_minutes or working_hours.default_duration_minutes
+    free_times = working_hours.free_start_times_for(target_date.date(), appointments_on_day, duration_minutes,
+                                                    config.booking_resources)
 
-        current_time += timedelta(minutes=slot_interval_minutes)
+    for slot_time in free_times:
+        slot_time_str = slot_time.strftime('%H:%M')
+        builder.add(types.InlineKeyboardButton(
+            text=slot_time_str,
+            callback_data=f"time_{slot_time_str}"
+        ))
+    builder.adjust(3)
 
-    builder.add(types.InlineKeyboardButton(
+    if waitlist:
+        builder.row(types.InlineKeyboardButton(text="🔔 Лист ожидания", callback_data="waitlist_join"))
+    builder.row(types.InlineKeyboardButton(
         text="🔙 Назад к выбору дня",
         callback_data="back_to_date_choice"
     ))
-    builder.adjust(3)
+    return builder.as_markup()
+
+
+def get_waitlist_window_keyboard(windows: Dict[str, str]):
+    """Выбор окна времени для листа ожидания: ключ окна -> подпись (utils.waitlist.WAITLIST_WINDOWS)."""
+    builder = InlineKeyboardBuilder()
+    for key, label in windows.items():
+        builder.row(InlineKeyboardButton(text=label, callback_data=f"wl_window_{key}"))
+    builder.row(InlineKeyboardButton(text="🔙 Назад к выбору дня", callback_data="back_to_date_choice"))
+    return builder.as_markup()
+
+
+def get_waitlist_offer_keyboard(entry_id: str):
+    """Предложение освободившегося времени из листа ожидания."""
+    builder = InlineKeyboardBuilder()
+    builder.row(InlineKeyboardButton(text="✅ Записаться", callback_data=f"wl_claim_{entry_id}"))
+    builder.row(InlineKeyboardButton(text="🙅 Не подходит", callback_data=f"wl_decline_{entry_id}"))
     return builder.as_markup()
 
 
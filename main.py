@@ -1,41 +1,79 @@
 # main.py
 import asyncio
 import logging
+from typing import Optional
 
-from aiogram import Bot, Dispatcher, types, Router
+from aiogram import Dispatcher, types, Router
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.exceptions import TelegramAPIError
+from aiogram.filters import ExceptionTypeFilter
 from aiogram.fsm.storage.memory import MemoryStorage
 
 # Импортируем наш keep_alive
 import keep_alive
 
 from config_reader import config
-from database.db_supabase import Database
+from database.resilience import DatabaseUnavailable
 from handlers import common_handlers, admin_handlers, client_handlers
-from utils.scheduler import setup_scheduler  # <-- Раскомментируем планировщик
-
-# Настройка логирования
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(name)s - %(message)s")
+from middlewares.throttling import ThrottlingMiddleware
+from middlewares.outbound import OutboundScheduler, Priority, send_priority
+from middlewares.tracing import TracingMiddleware, TracingRequestMiddleware
+from middlewares.tenant import TenantMiddleware
+from utils.scheduler import setup_scheduler, backfill_reminders  # <-- Раскомментируем планировщик
+from utils.error_digest import ErrorDigest
+from utils.notifications import flush_booking_digests
+from utils.logging_setup import setup_logging
+from utils.tracing import tracer
+from utils.leader import LeaderElector
+from utils.tenants import Tenant, TenantRegistry, load_tenants
+from utils.waitlist import Waitlist
+
+# Настройка логирования: запись в stderr идет из отдельного потока, а не из event loop
+log_listener = setup_logging(logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Глобальный обработчик ошибок
 error_router = Router()
+# Повторы одной и той же ошибки отправляются админу сводкой, а не по одной
+error_digest = ErrorDigest(window_seconds=config.error_digest_window_seconds)
+
+
+@error_router.errors(ExceptionTypeFilter(DatabaseUnavailable))
+async def database_unavailable_handler(exception_update: types.ErrorEvent):
+    # Supabase недоступна: вместо «свободных» слотов или молчания просим повторить позже.
+    # Админ узнает о сбое из лога предохранителя, а не из сообщения на каждый апдейт
+    update = exception_update.update
+    logger.warning(f"Апдейт {update.update_id} не обработан: {exception_update.exception}")
+    text = "⏳ Сервис записи временно недоступен. Пожалуйста, попробуйте через минуту."
+    try:
+        if update.callback_query:
+            await update.callback_query.answer(text, show_alert=True)
+        elif update.message:
+            await update.message.answer(text)
+    except TelegramAPIError as e:
+        logger.error(f"Не удалось сообщить пользователю о недоступности БД: {e}")
+    return True
 
 
 @error_router.errors()
-async def error_handler(exception_update: types.ErrorEvent):
+async def error_handler(exception_update: types.ErrorEvent, tenant: Optional[Tenant] = None):
     update = exception_update.update
     exception = exception_update.exception
     logger.error(f"Критическая ошибка при обработке апдейта {update.update_id}")
     logger.exception(exception)
+    if not error_digest.record(exception, update.update_id):
+        # Такая ошибка уже была в текущем окне — попадет в сводку
+        return True
     try:
         # Убедитесь, что bot определен в этой области видимости
-        await exception_update.update.bot.send_message(
-            config.admin_id,
-            f"<b>❗️ Произошла ошибка в боте!</b>\n"
-            f"<b>Тип:</b> {type(exception).__name__}\n<b>Ошибка:</b> {exception}"
-        )
+        with send_priority(Priority.NOTIFICATION):
+            # Сообщаем админу того арендатора, чей бот получил апдейт
+            await exception_update.update.bot.send_message(
+                tenant.admin_id if tenant else config.admin_id,
+                f"<b>❗️ Произошла ошибка в боте!</b>\n"
+                f"<b>Тип:</b> {type(exception).__name__}\n<b>Ошибка:</b> {exception}"
+            )
     except Exception as e:
         logger.error(f"Не удалось отправить сообщение об ошибке админу: {e}")
     return True
@@ -45,12 +83,31 @@ async def main():
     logger.info("Starting bot in polling mode...")
 
     # Инициализация
-    db = Database(url=config.supabase_url, key=config.supabase_key)
     storage = MemoryStorage()
     default_properties = DefaultBotProperties(parse_mode="HTML")
-    bot = Bot(token=config.bot_token, default=default_properties)
+    # Одна HTTP-сессия (пул соединений) на всех ботов-арендаторов.
+    # Все исходящие запросы идут через общую очередь с лимитами и приоритетами
+    session = AiohttpSession()
+    outbound = OutboundScheduler()
+    session.middleware(TracingRequestMiddleware())
+    session.middleware(outbound)
+    tenants = TenantRegistry(load_tenants(), session, default_properties)
+    bot = tenants.default.bot
+
+    # Трассировка апдейтов
+    tracer.configure(slow_ms=config.trace_slow_ms, sample_rate=config.trace_sample_rate,
+                     file_path=config.trace_file)
     dp = Dispatcher(storage=storage)
 
+    dp.update.outer_middleware(TracingMiddleware())
+    # Арендатор (tenant) и его db определяются по боту, получившему апдейт
+    dp.update.outer_middleware(TenantMiddleware(tenants))
+
+    # Анти-флуд: ограничение частоты и склейка повторных нажатий
+    throttling = ThrottlingMiddleware()
+    dp.message.outer_middleware(throttling)
+    dp.callback_query.outer_middleware(throttling)
+
     # Регистрируем роутеры (обработчик ошибок первым)
     dp.include_router(error_router)
     dp.include_router(common_handlers.router)
@@ -58,20 +115,51 @@ async def main():
     dp.include_router(client_handlers.router)
 
     # Настраиваем и запускаем планировщик
-    scheduler = setup_scheduler(bot, db)
-    scheduler.start()
-
-    # Удаляем старый вебхук, если он был
-    await bot.delete_webhook(drop_pending_updates=True)
+    # Аренда лидера хранится в БД основного арендатора; планировщик один на всех арендаторов
+    elector = LeaderElector(tenants.default.db, ttl_seconds=config.leader_lease_ttl_seconds) \
+        if config.leader_election_enabled else None
+    scheduler = setup_scheduler(tenants, elector)
+    if elector:
+        # Задачи выполняет только лидер: планировщик стартует на паузе и включается при избрании
+        scheduler.start(paused=True)
+        elector.on_elected = scheduler.resume
+        elector.on_demoted = scheduler.pause
+        await elector.start()
+    else:
+        scheduler.start()
+    # Локальные копии для чтения синхронизируются до начала обработки апдейтов
+    for mirror in tenants.mirrors:
+        await mirror.start_sync()
+    for runtime in tenants:
+        await backfill_reminders(scheduler, runtime.db, runtime.tenant.name)
+    # Лист ожидания подписывается на отмены записей всех арендаторов
+    waitlist = Waitlist(tenants, scheduler)
+    await waitlist.load()
+    # Сводка ошибок процесса уходит админу основного арендатора
+    error_digest.start(bot, config.admin_id)
+
+    # Удаляем старые вебхуки, если они были
+    for tenant_bot in tenants.bots:
+        await tenant_bot.delete_webhook(drop_pending_updates=True)
 
     try:
-        # Запускаем long polling
-        await dp.start_polling(bot, db=db, scheduler=scheduler)
+        # Запускаем long polling сразу для всех ботов в одном event loop
+        await dp.start_polling(*tenants.bots, scheduler=scheduler, waitlist=waitlist)
     finally:
         logger.info("Bot stopped.")
+        logger.info(f"Throttling stats: {dict(throttling.stats)}")
+        if elector:
+            await elector.stop()
         if scheduler.running:
             scheduler.shutdown()
-        await bot.session.close()
+        await flush_booking_digests()
+        await error_digest.stop(bot, config.admin_id)
+        await outbound.close()
+        for mirror in tenants.mirrors:
+            await mirror.stop_sync()
+        for runtime in tenants:
+            logger.info(f"Supabase call stats ({runtime.tenant.name}): {dict(runtime.db.resilience.stats)}")
+        await session.close()
 
 
 if __name__ == "__main__":
@@ -83,4 +171,7 @@ if __name__ == "__main__":
     try:
         asyncio.run(main())
     except (KeyboardInterrupt, SystemExit):
-        logger.info("Bot execution stopped by user.")
\ No newline at end of file
+        logger.info("Bot execution stopped by user.")
+    finally:
+        # Дописываем оставшиеся в очереди записи
+        log_listener.stop()
\ No newline at end of file
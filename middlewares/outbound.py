@@ -0,0 +1,250 @@
+# middlewares/outbound.py
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Dict, List, Optional, Tuple, Union
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: ~30 сообщений в секунду на бота и ~1 в секунду в один чат (с небольшим всплеском)
+GLOBAL_RATE_PER_SECOND = 25.0
+PER_CHAT_RATE_PER_SECOND = 1.0
+PER_CHAT_BURST = 3
+MAX_RETRIES = 3
+# Ограничиваем только методы, которые создают новые сообщения
+RATE_LIMITED_METHOD_PREFIXES = ('Send', 'Copy', 'Forward')
+# Когда корзин чатов становится больше, удаляем давно неактивные
+MAX_CHAT_BUCKETS = 10000
+
+ChatId = Union[int, str]
+ChatKey = Tuple[int, ChatId]
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0   # ответы пользователю в хэндлерах
+    NOTIFICATION = 1  # уведомления админу
+    BULK = 2          # рассылки (напоминания)
+
+
+_current_priority: ContextVar[Priority] = ContextVar('outbound_priority', default=Priority.INTERACTIVE)
+
+
+@contextmanager
+def send_priority(priority: Priority):
+    """Все вызовы Bot API внутри блока ставятся в очередь с указанным приоритетом."""
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, burst: float):
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate_per_second)
+        self.updated_at = now
+
+    def ready_at(self, now: float) -> float:
+        """Момент, когда можно будет взять токен (now, если уже можно)."""
+        self._refill(now)
+        ready = now if self.tokens >= 1 else now + (1 - self.tokens) / self.rate_per_second
+        return max(ready, self.blocked_until)
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block_until(self, moment: float):
+        self.blocked_until = max(self.blocked_until, moment)
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """
+    Единая очередь исходящих запросов к Bot API (подключается к bot.session).
+    Если сессия общая для нескольких ботов (арендаторов), лимиты считаются для каждого бота отдельно.
+    Отправка сообщений проходит через token bucket бота и bucket чата;
+    среди готовых к отправке запросов всегда выбирается самый приоритетный,
+    поэтому ответы пользователям не ждут, пока уйдет рассылка напоминаний.
+    На TelegramRetryAfter чат и бот блокируются на указанное время и запрос встает в очередь снова.
+
+    Ожидающие хранятся по чатам (куча по приоритету и порядку прихода). Чат, у которого есть
+    ожидающие, лежит либо в куче таймеров (его bucket еще не готов), либо в куче готовых чатов
+    своего бота, упорядоченной по первому ожидающему. Выдача токена — O(log n) и не перебирает
+    очередь; записи куч, устаревшие после перепланирования чата, и отмененные ожидающие
+    пропускаются при извлечении.
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE_PER_SECOND, per_chat_rate: float = PER_CHAT_RATE_PER_SECOND,
+                 per_chat_burst: int = PER_CHAT_BURST, max_retries: int = MAX_RETRIES):
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.max_retries = max_retries
+        self.global_rate = global_rate
+        # Ключи — id бота и (id бота, чат)
+        self._globals: Dict[int, TokenBucket] = {}
+        self._chats: Dict[ChatKey, TokenBucket] = {}
+        self._prune_chats_at = MAX_CHAT_BUCKETS
+        # Чат -> куча (приоритет, порядковый номер, future)
+        self._pending: Dict[ChatKey, List[Tuple[Priority, int, asyncio.Future]]] = {}
+        # Версия расписания чата: записи куч с другой версией устарели
+        self._versions: Dict[ChatKey, int] = {}
+        self._timers: List[Tuple[float, int, ChatKey]] = []  # (когда готов bucket чата, версия, чат)
+        self._ready: Dict[int, List[Tuple[Priority, int, int, ChatKey]]] = {}  # бот -> (приоритет, номер, версия, чат)
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._grant_task: Optional[asyncio.Task] = None
+        self.stats = Counter()
+
+    def _global_bucket(self, bot_id: int) -> TokenBucket:
+        bucket = self._globals.get(bot_id)
+        if bucket is None:
+            bucket = self._globals[bot_id] = TokenBucket(self.global_rate, self.global_rate)
+        return bucket
+
+    def _chat_bucket(self, bot_id: int, chat_id: ChatId) -> TokenBucket:
+        key = (bot_id, chat_id)
+        bucket = self._chats.get(key)
+        if bucket is None:
+            if len(self._chats) >= self._prune_chats_at:
+                now = time.monotonic()
+                self._chats = {cid: b for cid, b in self._chats.items() if b.ready_at(now) > now or
+                               b.tokens < b.burst or cid in self._pending}
+                # Если активных чатов больше лимита, следующая чистка — когда их станет вдвое больше,
+                # иначе каждый новый чат проходил бы по всем корзинам
+                self._prune_chats_at = max(MAX_CHAT_BUCKETS, 2 * len(self._chats))
+            bucket = self._chats[key] = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+        return bucket
+
+    async def _acquire(self, bot_id: int, chat_id: ChatId, priority: Priority):
+        future = asyncio.get_running_loop().create_future()
+        key = (bot_id, chat_id)
+        waiters = self._pending.setdefault(key, [])
+        waiter = (priority, next(self._seq), future)
+        heapq.heappush(waiters, waiter)
+        # Перепланируем чат, только если новый ожидающий стал первым в нем
+        if waiters[0] is waiter:
+            self._schedule(key, time.monotonic())
+        if self._grant_task is None or self._grant_task.done():
+            self._grant_task = asyncio.create_task(self._grant_loop())
+        self._wakeup.set()
+        await future
+
+    def _schedule(self, key: ChatKey, now: float):
+        """Кладет чат в кучу таймеров или готовых по его первому ожидающему (прежние записи устаревают)."""
+        waiters = self._pending.get(key)
+        while waiters and waiters[0][2].done():
+            heapq.heappop(waiters)  # Отмененные ожидающие
+        if not waiters:
+            self._pending.pop(key, None)
+            self._versions.pop(key, None)
+            return
+        version = self._versions[key] = self._versions.get(key, 0) + 1
+        ready = self._chat_bucket(*key).ready_at(now)
+        if ready > now:
+            heapq.heappush(self._timers, (ready, version, key))
+        else:
+            priority, seq, _ = waiters[0]
+            heapq.heappush(self._ready.setdefault(key[0], []), (priority, seq, version, key))
+
+    def _grant_ready(self, now: float) -> Optional[float]:
+        """Выдает токены готовым ожидающим. Возвращает, когда проверить снова (None — ждать нечего)."""
+        while self._timers and self._timers[0][0] <= now:
+            _, version, key = heapq.heappop(self._timers)
+            if self._versions.get(key) == version:
+                self._schedule(key, now)
+
+        next_check = self._timers[0][0] if self._timers else None
+        for bot_id, ready in self._ready.items():
+            global_bucket = self._global_bucket(bot_id)
+            while ready:
+                # Корзину бота проверяем один раз на выдачу, а не для каждого ожидающего
+                global_ready = global_bucket.ready_at(now)
+                if global_ready > now:
+                    next_check = global_ready if next_check is None else min(next_check, global_ready)
+                    break
+                priority, _, version, key = heapq.heappop(ready)
+                if self._versions.get(key) != version:
+                    continue
+                bucket = self._chat_bucket(*key)
+                if bucket.ready_at(now) > now:
+                    # Чат заблокирован после постановки в очередь (TelegramRetryAfter)
+                    self._schedule(key, now)
+                    continue
+                waiters = self._pending[key]
+                future = heapq.heappop(waiters)[2]
+                if not future.done():
+                    bucket.take(now)
+                    global_bucket.take(now)
+                    future.set_result(None)
+                    self.stats[f'sent_{priority.name.lower()}'] += 1
+                self._schedule(key, now)
+            if self._timers:
+                next_check = self._timers[0][0] if next_check is None else min(next_check, self._timers[0][0])
+        return next_check
+
+    async def _grant_loop(self):
+        while True:
+            self._wakeup.clear()
+            next_check = self._grant_ready(time.monotonic())
+            timeout = max(0.0, next_check - time.monotonic()) if next_check is not None else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                       method: TelegramMethod[TelegramType]):
+        chat_id = getattr(method, 'chat_id', None)
+        limited = chat_id is not None and type(method).__name__.startswith(RATE_LIMITED_METHOD_PREFIXES)
+        priority = _current_priority.get()
+
+        attempt = 0
+        while True:
+            if limited:
+                await self._acquire(bot.id, chat_id, priority)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                self.stats['retry_after'] += 1
+                if attempt > self.max_retries:
+                    raise
+                logger.warning("Telegram flood control for chat %s: retry in %ss (attempt %s/%s).",
+                               chat_id, e.retry_after, attempt, self.max_retries)
+                if limited:
+                    # Flood control у Telegram обычно общий для бота: блокируем и чат, и всю отправку бота.
+                    # Следующий _acquire дождется окончания блокировки
+                    blocked_until = time.monotonic() + e.retry_after
+                    self._chat_bucket(bot.id, chat_id).block_until(blocked_until)
+                    self._global_bucket(bot.id).block_until(blocked_until)
+                else:
+                    await asyncio.sleep(e.retry_after)
+
+    async def close(self):
+        if self._grant_task:
+            self._grant_task.cancel()
+            try:
+                await self._grant_task
+            except asyncio.CancelledError:
+                pass
+        logger.info(f"Outbound scheduler stats: {dict(self.stats)}")
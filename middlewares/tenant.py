@@ -0,0 +1,35 @@
+# middlewares/tenant.py
+
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from utils.tenants import TenantRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class TenantMiddleware(BaseMiddleware):
+    """
+    Определяет арендатора по боту, получившему апдейт, и передает в хэндлеры
+    его настройки (tenant) и клиент БД (db). Подключается как outer middleware к dp.update.
+    """
+
+    def __init__(self, registry: TenantRegistry):
+        self.registry = registry
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        runtime = self.registry.for_bot(data['bot'])
+        if runtime is None:
+            logger.error("Update %s came from an unknown bot %s.", getattr(event, 'update_id', None), data['bot'].id)
+            return None
+        data['tenant'] = runtime.tenant
+        data['db'] = runtime.db
+        return await handler(event, data)
@@ -0,0 +1,100 @@
+# middlewares/throttling.py
+
+import logging
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Set, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+logger = logging.getLogger(__name__)
+
+# Сколько апдейтов в секунду пропускаем от одного пользователя и какой допускаем всплеск
+DEFAULT_RATE_PER_SECOND = 2.0
+DEFAULT_BURST = 5
+# Корзины пользователей, которые молчат дольше этого времени, удаляются
+IDLE_BUCKET_SECONDS = 600
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Защита от частых нажатий:
+    - token bucket на каждого пользователя: лишние апдейты отбрасываются;
+    - одинаковый callback (то же сообщение и те же данные), пока предыдущий еще обрабатывается,
+      не запускает хэндлер второй раз;
+    - ошибка "message is not modified" от повторного edit_text глушится.
+    Счетчики сэкономленной работы лежат в self.stats.
+    """
+
+    def __init__(self, rate_per_second: float = DEFAULT_RATE_PER_SECOND, burst: int = DEFAULT_BURST):
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        # (id бота, user_id) -> (доступные токены, время последнего пополнения); у каждого арендатора свои лимиты
+        self._buckets: Dict[Tuple[int, int], Tuple[float, float]] = {}
+        self._in_flight: Set[Tuple[int, int, int, str]] = set()
+        self._last_cleanup = time.monotonic()
+        self.stats = Counter()
+
+    def _take_token(self, key: Tuple[int, int]) -> bool:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate_per_second)
+        allowed = tokens >= 1
+        self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+
+        if now - self._last_cleanup > IDLE_BUCKET_SECONDS:
+            self._buckets = {uid: bucket for uid, bucket in self._buckets.items()
+                             if now - bucket[1] <= IDLE_BUCKET_SECONDS}
+            self._last_cleanup = now
+        return allowed
+
+    @staticmethod
+    async def _silently_answer(event: TelegramObject):
+        # Убираем "часики" на кнопке, иначе Telegram будет показывать загрузку
+        if isinstance(event, CallbackQuery):
+            try:
+                await event.answer()
+            except TelegramBadRequest:
+                pass
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        user = getattr(event, 'from_user', None)
+        if not user:
+            return await handler(event, data)
+
+        bot_id = data['bot'].id
+        if not self._take_token((bot_id, user.id)):
+            self.stats['throttled'] += 1
+            logger.debug("Throttled update from user %s.", user.id)
+            await self._silently_answer(event)
+            return None
+
+        in_flight_key = None
+        if isinstance(event, CallbackQuery) and isinstance(event.message, Message):
+            in_flight_key = (bot_id, event.message.chat.id, event.message.message_id, event.data or '')
+            if in_flight_key in self._in_flight:
+                self.stats['coalesced'] += 1
+                logger.debug("Duplicate callback '%s' from user %s dropped while in flight.", event.data, user.id)
+                await self._silently_answer(event)
+                return None
+            self._in_flight.add(in_flight_key)
+
+        try:
+            self.stats['passed'] += 1
+            return await handler(event, data)
+        except TelegramBadRequest as e:
+            if 'message is not modified' in str(e):
+                self.stats['not_modified'] += 1
+                logger.debug("Skipped no-op edit for user %s.", user.id)
+                return None
+            raise
+        finally:
+            if in_flight_key:
+                self._in_flight.discard(in_flight_key)
@@ -0,0 +1,39 @@
+# middlewares/tracing.py
+
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject, Update
+
+from utils.tracing import tracer
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Открывает корневой спан на каждый апдейт (подключается как outer middleware к dp.update)."""
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        attributes = {}
+        if isinstance(event, Update):
+            attributes = {'update_id': event.update_id, 'event_type': event.event_type}
+            callback_query = event.callback_query
+            if callback_query:
+                attributes['callback_data'] = callback_query.data
+        with tracer.span("update", root=True, **attributes):
+            return await handler(event, data)
+
+
+class TracingRequestMiddleware(BaseRequestMiddleware):
+    """Спан на каждый запрос к Bot API (подключается к bot.session)."""
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                       method: TelegramMethod[TelegramType]):
+        with tracer.span(f"bot.{type(method).__name__}"):
+            return await make_request(bot, method)
@@ -20,6 +20,7 @@ class ClientStates(StatesGroup):
     waiting_for_time = State()
     waiting_for_phone = State()
     waiting_for_confirmation = State()
+    waiting_for_waitlist_phone = State()  # Лист ожидания: окно выбрано, ждем номер телефона
 
     # Новое состояние для клиента, если мы его введем
     # client_state_new = State() # Пока не нужно, но можно оставить в виду
\ No newline at end of file
@@ -0,0 +1,15 @@
+# tests/conftest.py
+
+import os
+import sys
+
+# Тесты импортируют модули бота из корня репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Обязательные настройки (config_reader.Settings) для запуска без .env; к сети тесты не обращаются
+os.environ.setdefault('BOT_TOKEN', '123456:test')
+os.environ.setdefault('ADMIN_ID', '1')
+os.environ.setdefault('SUPABASE_URL', 'http://localhost')
+os.environ.setdefault('SUPABASE_KEY', 'test')
+os.environ.setdefault('WEB_SERVER_URL', 'http://localhost')
+os.environ.setdefault('WEBHOOK_PATH', '/webhook')
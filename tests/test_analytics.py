@@ -0,0 +1,94 @@
+# tests/test_analytics.py
+
+import math
+from datetime import date, datetime, time
+
+import numpy as np
+import pytest
+
+from database.models import Appointment, Service, ServiceCategory
+from utils.analytics import AppointmentColumns, compute_report, parse_price
+from utils.working_hours import WorkingDay, WorkingHours
+
+# Неделя с понедельника по воскресенье: каждый день недели встречается ровно один раз
+WEEK_START, WEEK_END = date(2030, 5, 6), date(2030, 5, 12)
+# Работаем только по понедельникам 09:00-13:00 с перерывом 11:00-11:30
+HOURS = WorkingHours({0: WorkingDay(start=time(9), end=time(13), breaks=((time(11), time(11, 30)),))})
+
+CATEGORIES = {
+    'c1': ServiceCategory(id='c1', title='Массаж', created_at=datetime(2030, 1, 1)),
+    'c2': ServiceCategory(id='c2', title='Уход', created_at=datetime(2030, 1, 1)),
+}
+SERVICES = {
+    's1': Service(id='s1', title='Классический массаж', description='', price='1 500 ₽', icon='', category_id='c1'),
+    's2': Service(id='s2', title='Маска', description='', price='от 800', icon='', category_id='c2'),
+}
+
+
+def _columns() -> AppointmentColumns:
+    columns = AppointmentColumns()
+    for hour, minute, duration, service_id, status in (
+            (9, 0, 60, 's1', 'completed'),
+            (10, 30, 60, 's1', 'completed'),  # Через два часа: по 30 минут в 10:00 и 11:00
+            (9, 0, 60, 's2', 'cancelled'),  # Время не занимает и выручки не дает
+            (12, 0, 30, 's2', 'active'),
+            (12, 30, 30, 's-gone', 'completed'),  # Удаленная услуга: название и цена из записи
+    ):
+        app = Appointment(client_name='Анна', appointment_time=datetime(2030, 5, 6, hour, minute),
+                          service_id=service_id, status=status)
+        if service_id == 's-gone':
+            app.service_title, app.service_price = 'Старая услуга', '700'
+        columns.add(app, duration)
+    return columns
+
+
+def test_parse_price():
+    assert parse_price('1 500 ₽') == 1500.0
+    assert parse_price('от 800') == 800.0
+    assert parse_price('1,5') == 1.5
+    assert math.isnan(parse_price('по договоренности'))
+    assert math.isnan(parse_price(None))
+
+
+def test_occupancy_matrix():
+    report = compute_report(_columns(), SERVICES, CATEGORIES, WEEK_START, WEEK_END, hours=HOURS)
+
+    assert report.occupancy.shape == (7, 24)
+    assert report.occupancy[0, 9:13].tolist() == [1.0, 0.5, 1.0, 1.0]
+    # Нерабочее время — nan, а не ноль
+    assert np.isnan(report.occupancy[0, 8]) and np.isnan(report.occupancy[0, 13])
+    assert np.isnan(report.occupancy[1:]).all()
+    assert report.booked_hours == pytest.approx(3.0)
+    assert report.capacity_hours == pytest.approx(3.5)
+
+
+def test_occupancy_accounts_for_resources_and_days_off():
+    report = compute_report(_columns(), SERVICES, CATEGORIES, WEEK_START, WEEK_END, hours=HOURS, resources=2)
+    assert report.occupancy[0, 9:13].tolist() == [0.5, 0.25, 0.5, 0.5]
+    assert report.capacity_hours == pytest.approx(7.0)
+
+    on_vacation = compute_report(_columns(), SERVICES, CATEGORIES, WEEK_START, WEEK_END,
+                                 days_off=[(WEEK_START, WEEK_START)], hours=HOURS)
+    assert np.isnan(on_vacation.occupancy).all()
+    assert on_vacation.capacity_hours == 0
+
+
+def test_revenue_totals_and_statuses():
+    report = compute_report(_columns(), SERVICES, CATEGORIES, WEEK_START, WEEK_END, hours=HOURS)
+
+    assert report.total == 5
+    assert report.status_counts == {'active': 1, 'completed': 3, 'cancelled': 1, 'other': 0}
+    assert report.rate('cancelled') == pytest.approx(0.2)
+    assert report.total_revenue == pytest.approx(3700.0)
+    assert report.revenue_by_service == [('Классический массаж', 3000.0, 2), ('Старая услуга', 700.0, 1)]
+    assert report.revenue_by_category == [('Массаж', 3000.0), ('Без категории', 700.0)]
+
+
+def test_empty_period():
+    report = compute_report(AppointmentColumns(), SERVICES, CATEGORIES, WEEK_START, WEEK_END, hours=HOURS)
+
+    assert report.total == 0
+    assert report.rate('cancelled') == 0.0
+    assert report.total_revenue == 0
+    assert report.revenue_by_service == [] and report.revenue_by_category == []
+    assert report.occupancy[0, 9:13].tolist() == [0.0, 0.0, 0.0, 0.0]
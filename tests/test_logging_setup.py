@@ -0,0 +1,38 @@
+# tests/test_logging_setup.py
+
+import logging
+
+from utils import logging_setup
+from utils.logging_setup import RateLimitFilter
+
+
+def _record(msg: str, level: int = logging.INFO, *args) -> logging.LogRecord:
+    return logging.LogRecord('test', level, __file__, 1, msg, args, None)
+
+
+def test_burst_then_suppressed_count_is_reported(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(logging_setup.time, 'monotonic', lambda: now[0])
+    rate_filter = RateLimitFilter(rate_per_second=1.0, burst=2)
+
+    assert [rate_filter.filter(_record("User %s booked", logging.INFO, i)) for i in range(4)] == [True, True, False, False]
+    assert rate_filter.filter(_record("Failed", logging.WARNING))
+
+    now[0] += 1.0
+    record = _record("User %s booked", logging.INFO, 5)
+    assert rate_filter.filter(record)
+    assert record.msg == "User %s booked [+2 similar suppressed]"
+
+
+def test_idle_buckets_are_evicted(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(logging_setup.time, 'monotonic', lambda: now[0])
+    rate_filter = RateLimitFilter(rate_per_second=1.0, burst=2)
+
+    for i in range(50):
+        rate_filter.filter(_record(f"one-off message {i}"))
+    assert len(rate_filter._buckets) == 50
+
+    now[0] += 3.0
+    rate_filter.filter(_record("fresh message"))
+    assert list(rate_filter._buckets) == [('test', "fresh message")]
@@ -0,0 +1,145 @@
+# tests/test_memory_db.py
+
+import asyncio
+from datetime import date, datetime, time
+
+import pytest
+
+from config_reader import config
+from database.memory_db import InMemoryDatabase
+from database.models import Appointment, Service, WaitlistEntry
+
+
+def _service(service_id: str = 's1', duration_minutes=None) -> Service:
+    return Service(id=service_id, title='Массаж', description='', price='2000', icon='',
+                   category_id='c1', duration_minutes=duration_minutes)
+
+
+def _appointment(hour: int, minute: int = 0, service_id: str = 's1', **kwargs) -> Appointment:
+    return Appointment(client_name='Анна', appointment_time=datetime(2030, 5, 6, hour, minute),
+                       service_id=service_id, **kwargs)
+
+
+@pytest.fixture
+def single_resource(monkeypatch):
+    monkeypatch.setattr(config, 'booking_resources', [])
+    monkeypatch.setattr(config, 'default_service_duration_minutes', 60)
+
+
+@pytest.fixture
+def two_resources(monkeypatch):
+    monkeypatch.setattr(config, 'booking_resources', ['Кресло 1', 'Кресло 2'])
+    monkeypatch.setattr(config, 'default_service_duration_minutes', 60)
+
+
+def test_overlapping_booking_is_rejected(single_resource):
+    db = InMemoryDatabase([_service(duration_minutes=90)])
+
+    first = asyncio.run(db.book_appointment(_appointment(10)))
+    # 11:00 попадает внутрь 90-минутной записи 10:00-11:30
+    overlapping = asyncio.run(db.book_appointment(_appointment(11)))
+    # Стык концов — не пересечение
+    adjacent = asyncio.run(db.book_appointment(_appointment(11, 30)))
+
+    assert first.ok and first.service_title == 'Массаж'
+    assert overlapping.status == 'slot_taken'
+    assert adjacent.ok
+    assert len(db.appointments) == 2
+
+
+def test_cancelled_appointment_frees_slot(single_resource):
+    db = InMemoryDatabase([_service()])
+    first = asyncio.run(db.book_appointment(_appointment(10)))
+    asyncio.run(db.update_appointment_status(first.appointment_id, 'cancelled'))
+
+    assert asyncio.run(db.book_appointment(_appointment(10))).ok
+
+
+def test_unknown_service(single_resource):
+    db = InMemoryDatabase([_service()])
+    assert asyncio.run(db.book_appointment(_appointment(10, service_id='missing'))).status == 'service_not_found'
+
+
+def test_replay_with_same_idempotency_key_returns_existing_appointment(single_resource):
+    db = InMemoryDatabase([_service()])
+
+    first = asyncio.run(db.book_appointment(_appointment(10, idempotency_key='key-1')))
+    replay = asyncio.run(db.book_appointment(_appointment(10, idempotency_key='key-1')))
+    other_key = asyncio.run(db.book_appointment(_appointment(10, idempotency_key='key-2')))
+
+    assert first.ok and not first.replayed
+    assert replay.ok and replay.replayed
+    assert replay.appointment_id == first.appointment_id
+    assert other_key.status == 'slot_taken'
+    assert len(db.appointments) == 1
+
+
+def test_concurrent_replays_create_one_appointment(single_resource):
+    db = InMemoryDatabase([_service()])
+
+    async def book_twice():
+        return await asyncio.gather(*(db.book_appointment(_appointment(10, idempotency_key='key-1'))
+                                      for _ in range(2)))
+
+    results = asyncio.run(book_twice())
+    assert all(result.ok for result in results)
+    assert sorted(result.replayed for result in results) == [False, True]
+    assert len(db.appointments) == 1
+
+
+def _offer(db: InMemoryDatabase, hour: int, offered_until: datetime) -> WaitlistEntry:
+    entry = asyncio.run(db.add_waitlist_entry(WaitlistEntry(
+        client_telegram_id=7, client_name='Ольга', client_phone='+79990000000', service_id='s1',
+        day=date(2030, 5, 6), window_start=time(9), window_end=time(18))))
+    return asyncio.run(db.update_waitlist_status(entry.id, 'offered', offered_slot=datetime(2030, 5, 6, hour),
+                                                 offered_until=offered_until))
+
+
+def test_waitlist_offer_holds_slot_until_it_expires(single_resource):
+    db = InMemoryDatabase([_service()])
+    offer = _offer(db, 10, offered_until=datetime(2030, 5, 6, 9))
+
+    # Другой клиент не может занять предложенное время, сама заявка — может
+    assert asyncio.run(db.book_appointment(_appointment(10, 30))).status == 'slot_taken'
+    assert [hold.appointment_time for hold in asyncio.run(db.get_waitlist_holds(date(2030, 5, 6)))] == \
+        [datetime(2030, 5, 6, 10)]
+    assert asyncio.run(db.book_appointment(_appointment(10), waitlist_entry_id=offer.id)).ok
+
+
+def test_expired_waitlist_offer_does_not_hold_slot(single_resource):
+    db = InMemoryDatabase([_service()])
+    _offer(db, 10, offered_until=datetime(2020, 1, 1))
+
+    assert asyncio.run(db.get_waitlist_holds(date(2030, 5, 6))) == []
+    assert asyncio.run(db.book_appointment(_appointment(10))).ok
+
+
+def test_capacity_fills_resources_in_order(two_resources):
+    db = InMemoryDatabase([_service()])
+
+    results = [asyncio.run(db.book_appointment(_appointment(10))) for _ in range(3)]
+
+    assert [result.resource for result in results[:2]] == ['Кресло 1', 'Кресло 2']
+    assert results[2].status == 'slot_taken'
+
+
+def test_capacity_respects_requested_resource(two_resources):
+    db = InMemoryDatabase([_service()])
+
+    first = asyncio.run(db.book_appointment(_appointment(10, resource='Кресло 2')))
+    same_resource = asyncio.run(db.book_appointment(_appointment(10, 30, resource='Кресло 2')))
+    any_resource = asyncio.run(db.book_appointment(_appointment(10, 30)))
+
+    assert first.resource == 'Кресло 2'
+    assert same_resource.status == 'slot_taken'
+    assert any_resource.resource == 'Кресло 1'
+
+
+def test_appointments_without_resource_occupy_first_resource(two_resources):
+    db = InMemoryDatabase([_service()])
+    # Запись, созданная до появления ресурсов
+    asyncio.run(db.add_appointment(_appointment(10)))
+
+    result = asyncio.run(db.book_appointment(_appointment(10)))
+
+    assert result.resource == 'Кресло 2'
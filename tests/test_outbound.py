@@ -0,0 +1,100 @@
+# tests/test_outbound.py
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from middlewares.outbound import OutboundScheduler, Priority
+
+
+async def _exhaust(outbound: OutboundScheduler, bot_id: int = 1):
+    # Забираем весь всплеск корзины бота, чтобы следующие запросы встали в очередь
+    for chat_id in range(int(outbound.global_rate)):
+        await outbound._acquire(bot_id, f"warmup-{chat_id}", Priority.INTERACTIVE)
+
+
+def test_ready_waiters_are_granted_by_priority():
+    async def scenario():
+        outbound = OutboundScheduler(global_rate=20)
+        await _exhaust(outbound)
+        order = []
+
+        async def send(name, chat_id, priority):
+            await outbound._acquire(1, chat_id, priority)
+            order.append(name)
+
+        tasks = [asyncio.create_task(send(f"bulk-{i}", 100 + i, Priority.BULK)) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(send("reply", 200, Priority.INTERACTIVE)))
+        await asyncio.gather(*tasks)
+        await outbound.close()
+        return order
+
+    assert asyncio.run(scenario()) == ["reply", "bulk-0", "bulk-1", "bulk-2"]
+
+
+def test_one_chat_is_paced_by_its_bucket():
+    async def scenario():
+        outbound = OutboundScheduler(global_rate=100, per_chat_rate=20, per_chat_burst=1)
+        granted = []
+
+        async def send():
+            await outbound._acquire(1, 42, Priority.BULK)
+            granted.append(time.monotonic())
+
+        await asyncio.gather(*(send() for _ in range(3)))
+        await outbound.close()
+        return granted
+
+    granted = asyncio.run(scenario())
+    assert granted[1] - granted[0] >= 0.04
+    assert granted[2] - granted[1] >= 0.04
+
+
+def test_cancelled_waiter_is_skipped():
+    async def scenario():
+        outbound = OutboundScheduler(global_rate=20)
+        await _exhaust(outbound)
+        cancelled = asyncio.create_task(outbound._acquire(1, 7, Priority.INTERACTIVE))
+        waiting = asyncio.create_task(outbound._acquire(1, 8, Priority.BULK))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await waiting
+        await outbound.close()
+        return outbound
+
+    outbound = asyncio.run(scenario())
+    assert outbound.stats['sent_bulk'] == 1
+    assert not outbound._pending
+
+
+def test_retry_after_blocks_the_whole_bot():
+    async def scenario():
+        outbound = OutboundScheduler()
+        bot = SimpleNamespace(id=1)
+        method = SendMessage(chat_id=10, text="Напоминание")
+        calls = []
+
+        async def make_request(bot, method):
+            calls.append(time.monotonic())
+            if len(calls) == 1:
+                raise TelegramRetryAfter(method=method, message="Flood control", retry_after=1)
+            return True
+
+        started = time.monotonic()
+        first = asyncio.create_task(outbound(make_request, bot, method))
+        await asyncio.sleep(0.1)
+        # Другой чат того же бота тоже ждет окончания блокировки
+        await outbound._acquire(1, 11, Priority.INTERACTIVE)
+        other_chat_granted = time.monotonic()
+        assert await first is True
+        await outbound.close()
+        return started, other_chat_granted, calls
+
+    started, other_chat_granted, calls = asyncio.run(scenario())
+    assert len(calls) == 2
+    assert calls[1] - started >= 0.9
+    assert other_chat_granted - started >= 0.9
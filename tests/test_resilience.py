@@ -0,0 +1,68 @@
+# tests/test_resilience.py
+
+import asyncio
+
+import pytest
+
+from database.resilience import CallPolicy, CircuitBreaker, DatabaseUnavailable, Resilience, breaker_for
+
+
+def _resilience(breaker: CircuitBreaker) -> Resilience:
+    policy = CallPolicy(timeout=1.0, deadline=1.0)
+    return Resilience(policy, policy, breaker=breaker)
+
+
+def _half_open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.0)
+    breaker.record_failure()
+    assert breaker.state == 'half_open'
+    return breaker
+
+
+def test_cancelled_probe_releases_half_open_slot():
+    async def scenario():
+        breaker = _half_open_breaker()
+        resilience = _resilience(breaker)
+        started = asyncio.Event()
+
+        async def hanging():
+            started.set()
+            await asyncio.sleep(10)
+
+        probe = asyncio.create_task(resilience.call('fetch_page', hanging))
+        await started.wait()
+        # Пока пробный вызов идет, остальные получают отказ
+        with pytest.raises(DatabaseUnavailable):
+            await resilience.call('fetch_page', lambda: asyncio.sleep(0))
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        async def ok():
+            return 'rows'
+        return await resilience.call('fetch_page', ok), breaker.state
+
+    assert asyncio.run(scenario()) == ('rows', 'closed')
+
+
+def test_cancelled_regular_call_does_not_release_foreign_probe():
+    async def scenario():
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.0)
+        resilience = _resilience(breaker)
+        regular = asyncio.create_task(resilience.call('fetch_page', lambda: asyncio.sleep(10)))
+        await asyncio.sleep(0)
+
+        breaker.record_failure()
+        probe_owner = object()
+        assert breaker.allow(probe_owner)
+        regular.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await regular
+        return breaker.allow(object())
+
+    assert asyncio.run(scenario()) is False
+
+
+def test_breaker_is_shared_per_supabase_url():
+    assert breaker_for('https://a.supabase.co') is breaker_for('https://a.supabase.co')
+    assert breaker_for('https://a.supabase.co') is not breaker_for('https://b.supabase.co')
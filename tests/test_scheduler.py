@@ -0,0 +1,81 @@
+# tests/test_scheduler.py
+
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from config_reader import config
+from utils import scheduler
+from utils.scheduler import describe_reminders, send_appointment_reminder, setup_scheduler
+
+
+def test_describe_reminders_follows_configured_offsets(monkeypatch):
+    monkeypatch.setattr(config, 'reminder_offsets_hours', [2, 24])
+    assert describe_reminders() == "Вам придут напоминания за день и за 2 ч. до визита."
+
+    monkeypatch.setattr(config, 'reminder_offsets_hours', [48])
+    assert describe_reminders() == "Вам придет напоминание за 2 дн. до визита."
+
+    monkeypatch.setattr(config, 'reminder_offsets_hours', [])
+    assert describe_reminders() == ""
+
+
+def test_describe_reminders_skips_offsets_already_passed(monkeypatch):
+    monkeypatch.setattr(config, 'reminder_offsets_hours', [24, 2])
+    monkeypatch.setattr(scheduler, '_now', lambda: datetime(2030, 5, 6, 9, 0))
+
+    assert describe_reminders(datetime(2030, 5, 6, 15, 0)) == "Вам придет напоминание за 2 ч. до визита."
+    assert describe_reminders(datetime(2030, 5, 6, 10, 0)) == ""
+
+
+def test_leader_election_requires_shared_jobstore(monkeypatch):
+    monkeypatch.setattr(config, 'scheduler_jobstore_url', None)
+    monkeypatch.setattr(scheduler, '_runtime', {})
+    with pytest.raises(ValueError):
+        setup_scheduler(tenants=None, elector=object())
+
+
+def test_leader_polls_shared_jobstore(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, 'scheduler_jobstore_url', f"sqlite:///{tmp_path / 'jobs.sqlite'}")
+    monkeypatch.setattr(scheduler, '_runtime', {})
+
+    async def scenario():
+        leader_scheduler = setup_scheduler(tenants=None, elector=object())
+        leader_scheduler.start(paused=True)
+        try:
+            return leader_scheduler.get_job('poll_shared_jobstore')
+        finally:
+            leader_scheduler.shutdown(wait=False)
+
+    job = asyncio.run(scenario())
+    assert job is not None
+    assert job.trigger.interval.total_seconds() == scheduler.JOBSTORE_POLL_SECONDS
+
+
+def test_reminder_is_rescheduled_when_leadership_is_not_confirmed(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, 'scheduler_jobstore_url', f"sqlite:///{tmp_path / 'jobs.sqlite'}")
+    monkeypatch.setattr(scheduler, '_runtime', {})
+
+    class LapsedElector:
+        async def verify(self):
+            return False
+
+    class Tenants:
+        def get(self, tenant_name):
+            return SimpleNamespace(bot=None, db=None)
+
+    async def scenario():
+        follower_scheduler = setup_scheduler(Tenants(), LapsedElector())
+        follower_scheduler.start(paused=True)
+        try:
+            # Задача уже удалена из хранилища планировщиком: выполняем ее тело напрямую
+            await send_appointment_reminder('a1', 24)
+            return follower_scheduler.get_job('reminder:a1:24h')
+        finally:
+            follower_scheduler.shutdown(wait=False)
+
+    job = asyncio.run(scenario())
+    assert job is not None
+    assert job.args == ('a1', 24, 'default')
@@ -0,0 +1,133 @@
+# tests/test_single_flight.py
+
+import asyncio
+
+import pytest
+
+from database.single_flight import SingleFlight
+
+
+def test_concurrent_identical_reads_share_one_call():
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return ['09:00', '10:00']
+
+    async def scenario():
+        single_flight = SingleFlight()
+        results = await asyncio.gather(*(single_flight.do(('day', '2030-05-06'), fetch) for _ in range(20)))
+        return single_flight, results
+
+    single_flight, results = asyncio.run(scenario())
+    assert calls == 1
+    assert results == [['09:00', '10:00']] * 20
+    assert single_flight.stats['executed'] == 1
+    assert single_flight.stats['shared'] == 19
+
+
+def test_different_keys_are_not_merged():
+    calls = []
+
+    def fetch_for(key):
+        async def fetch():
+            calls.append(key)
+            await asyncio.sleep(0)
+            return key
+        return fetch
+
+    async def scenario():
+        single_flight = SingleFlight()
+        return await asyncio.gather(single_flight.do('a', fetch_for('a')), single_flight.do('b', fetch_for('b')))
+
+    assert asyncio.run(scenario()) == ['a', 'b']
+    assert sorted(calls) == ['a', 'b']
+
+
+def test_finished_call_is_not_cached():
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        return calls
+
+    async def scenario():
+        single_flight = SingleFlight()
+        first = await single_flight.do('key', fetch)
+        second = await single_flight.do('key', fetch)
+        return first, second
+
+    assert asyncio.run(scenario()) == (1, 2)
+
+
+def test_exception_is_delivered_to_every_waiter():
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise ConnectionError("network down")
+
+    async def scenario():
+        single_flight = SingleFlight()
+        return await asyncio.gather(*(single_flight.do('key', fetch) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert len(results) == 3
+    assert all(isinstance(result, ConnectionError) for result in results)
+
+
+def test_cancelling_one_waiter_keeps_shared_call_running():
+    calls = 0
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return 'slots'
+
+        single_flight = SingleFlight()
+        first = asyncio.create_task(single_flight.do('key', fetch))
+        second = asyncio.create_task(single_flight.do('key', fetch))
+        await asyncio.sleep(0)
+        shared = single_flight._calls['key']
+
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert not shared.cancelled()
+
+        release.set()
+        return await second, shared
+
+    result, shared = asyncio.run(scenario())
+    assert result == 'slots'
+    assert calls == 1
+    assert shared.done() and not shared.cancelled()
+
+
+def test_call_is_forgotten_after_all_waiters_cancelled():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def fetch():
+            await release.wait()
+            return 'slots'
+
+        single_flight = SingleFlight()
+        waiter = asyncio.create_task(single_flight.do('key', fetch))
+        await asyncio.sleep(0)
+        shared = single_flight._calls['key']
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+        release.set()
+        assert await shared == 'slots'
+        await asyncio.sleep(0)
+        return single_flight
+
+    assert 'key' not in asyncio.run(scenario())._calls
@@ -0,0 +1,226 @@
+# utils/agenda.py
+
+import hashlib
+import logging
+import time as time_module
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from database.db_supabase import Database
+from database.models import Appointment
+
+logger = logging.getLogger(__name__)
+
+AGENDA_VIEWS = ('day', 'week')
+
+# Сколько записей на одной странице (и кнопок в клавиатуре)
+AGENDA_PAGE_SIZE = 10
+# Сколько секунд страница живет в кэше между перелистываниями
+AGENDA_CACHE_TTL_SECONDS = 60
+
+# «Мои записи» клиента: записей на странице и время жизни кэша
+CLIENT_PAGE_SIZE = 5
+CLIENT_CACHE_TTL_SECONDS = 30
+
+# Поиск записей админом (/find): записей на странице и время жизни результатов
+SEARCH_PAGE_SIZE = 10
+SEARCH_CACHE_TTL_SECONDS = 120
+
+
+@dataclass
+class AgendaPage:
+    appointments: List[Appointment]
+    next_cursor: Optional[Tuple[str, str]]
+    fetched_at: float
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+
+def view_range(view: str, anchor: date) -> Tuple[date, date]:
+    """Диапазон дат для представления: сам день или неделя (пн-вс), в которую он попадает."""
+    if view == 'week':
+        start = anchor - timedelta(days=anchor.weekday())
+        return start, start + timedelta(days=6)
+    return anchor, anchor
+
+
+def shift_anchor(view: str, anchor: date, direction: int) -> date:
+    """Сдвигает опорную дату на день или неделю вперед (direction=1) или назад (-1)."""
+    return anchor + timedelta(days=direction * (7 if view == 'week' else 1))
+
+
+class AgendaCache:
+    """
+    Кэш страниц расписания для админа.
+    Страница N запрашивается по курсору из страницы N-1, поэтому каждая страница —
+    один ограниченный запрос, а повторное перелистывание назад обходится без запросов.
+    """
+
+    def __init__(self, ttl_seconds: float = AGENDA_CACHE_TTL_SECONDS, page_size: int = AGENDA_PAGE_SIZE):
+        self.ttl_seconds = ttl_seconds
+        self.page_size = page_size
+        # Ключ включает клиент БД: у каждого арендатора свои записи
+        self._pages: Dict[Tuple[Database, str, date, int], AgendaPage] = {}
+
+    def _prune(self, now: float):
+        expired = [key for key, page in self._pages.items() if now - page.fetched_at > self.ttl_seconds]
+        for key in expired:
+            del self._pages[key]
+
+    async def get_page(self, db: Database, view: str, anchor: date, page: int) -> AgendaPage:
+        start, end = view_range(view, anchor)
+        key = (db, view, start, page)
+        now = time_module.monotonic()
+
+        cached = self._pages.get(key)
+        if cached and now - cached.fetched_at <= self.ttl_seconds:
+            return cached
+
+        cursor = None
+        if page > 0:
+            # Курсор берем из предыдущей страницы (обычно она уже в кэше)
+            previous = await self.get_page(db, view, anchor, page - 1)
+            if not previous.has_next:
+                return AgendaPage(appointments=[], next_cursor=None, fetched_at=now)
+            cursor = previous.next_cursor
+
+        appointments, next_cursor = await db.get_appointments_page(
+            start=datetime.combine(start, time.min),
+            end=datetime.combine(end, time.max),
+            cursor=cursor,
+            page_size=self.page_size,
+        )
+        self._prune(now)
+        result = AgendaPage(appointments=appointments, next_cursor=next_cursor, fetched_at=now)
+        self._pages[key] = result
+        return result
+
+    def invalidate(self, db: Optional[Database] = None):
+        """Сбрасывает кэш после изменения записей (только для арендатора с клиентом db, если он указан)."""
+        if db is None:
+            self._pages.clear()
+            return
+        for key in [key for key in self._pages if key[0] is db]:
+            del self._pages[key]
+
+
+class ClientAppointmentsCache:
+    """
+    Кэш экрана «Мои записи»: страницы предстоящих активных записей одного клиента
+    (запрос по индексу client_telegram_id, database/sql/client_appointments.sql).
+    Живет недолго и сбрасывается для клиента при любом изменении его записей.
+    """
+
+    def __init__(self, ttl_seconds: float = CLIENT_CACHE_TTL_SECONDS, page_size: int = CLIENT_PAGE_SIZE):
+        self.ttl_seconds = ttl_seconds
+        self.page_size = page_size
+        self._pages: Dict[Tuple[Database, int, int], AgendaPage] = {}
+
+    def _prune(self, now: float):
+        expired = [key for key, page in self._pages.items() if now - page.fetched_at > self.ttl_seconds]
+        for key in expired:
+            del self._pages[key]
+
+    async def get_page(self, db: Database, client_telegram_id: int, page: int) -> AgendaPage:
+        key = (db, client_telegram_id, page)
+        now = time_module.monotonic()
+
+        cached = self._pages.get(key)
+        if cached and now - cached.fetched_at <= self.ttl_seconds:
+            return cached
+
+        cursor = None
+        if page > 0:
+            previous = await self.get_page(db, client_telegram_id, page - 1)
+            if not previous.has_next:
+                return AgendaPage(appointments=[], next_cursor=None, fetched_at=now)
+            cursor = previous.next_cursor
+
+        appointments, next_cursor = await db.get_appointments_page(
+            start=datetime.now(),
+            status='active',
+            cursor=cursor,
+            page_size=self.page_size,
+            client_telegram_id=client_telegram_id,
+        )
+        self._prune(now)
+        result = AgendaPage(appointments=appointments, next_cursor=next_cursor, fetched_at=now)
+        self._pages[key] = result
+        return result
+
+    def invalidate(self, db: Database, client_telegram_id: Optional[int]):
+        """Сбрасывает страницы клиента после изменения его записей (записи без клиента пропускаются)."""
+        if client_telegram_id is None:
+            return
+        for key in [key for key in self._pages if key[0] is db and key[1] == client_telegram_id]:
+            del self._pages[key]
+
+
+class AppointmentSearchCache:
+    """
+    Страницы результатов поиска /find (Database.search_appointments, от новых записей к старым).
+    Сам запрос в callback_data не помещается (лимит 64 байта), поэтому у поиска короткий токен,
+    а запрос и курсоры страниц хранятся здесь, пока не истечет ttl_seconds.
+    """
+
+    def __init__(self, ttl_seconds: float = SEARCH_CACHE_TTL_SECONDS, page_size: int = SEARCH_PAGE_SIZE):
+        self.ttl_seconds = ttl_seconds
+        self.page_size = page_size
+        self._queries: Dict[str, Tuple[str, float]] = {}  # токен -> (запрос, время последнего обращения)
+        self._pages: Dict[Tuple[Database, str, int], AgendaPage] = {}
+
+    def _prune(self, now: float):
+        for token in [token for token, (_, used_at) in self._queries.items() if now - used_at > self.ttl_seconds]:
+            del self._queries[token]
+        expired = [key for key, page in self._pages.items() if now - page.fetched_at > self.ttl_seconds]
+        for key in expired:
+            del self._pages[key]
+
+    def start(self, db: Database, query: str) -> str:
+        """Начинает поиск заново (без старых страниц) и возвращает его токен."""
+        query = query.strip()
+        token = hashlib.sha1(query.lower().encode('utf-8')).hexdigest()[:10]
+        now = time_module.monotonic()
+        self._prune(now)
+        self._queries[token] = (query, now)
+        for key in [key for key in self._pages if key[0] is db and key[1] == token]:
+            del self._pages[key]
+        return token
+
+    def query(self, token: str) -> Optional[str]:
+        entry = self._queries.get(token)
+        return entry[0] if entry else None
+
+    async def get_page(self, db: Database, token: str, page: int) -> Optional[AgendaPage]:
+        """Страница результатов или None, если поиск с этим токеном устарел."""
+        now = time_module.monotonic()
+        entry = self._queries.get(token)
+        if entry is None or now - entry[1] > self.ttl_seconds:
+            return None
+        self._queries[token] = (entry[0], now)
+
+        key = (db, token, page)
+        cached = self._pages.get(key)
+        if cached and now - cached.fetched_at <= self.ttl_seconds:
+            return cached
+
+        cursor = None
+        if page > 0:
+            previous = await self.get_page(db, token, page - 1)
+            if not previous or not previous.has_next:
+                return AgendaPage(appointments=[], next_cursor=None, fetched_at=now)
+            cursor = previous.next_cursor
+
+        appointments, next_cursor = await db.search_appointments(entry[0], cursor=cursor, page_size=self.page_size)
+        self._prune(now)
+        result = AgendaPage(appointments=appointments, next_cursor=next_cursor, fetched_at=now)
+        self._pages[key] = result
+        return result
+
+
+agenda_cache = AgendaCache()
+client_appointments_cache = ClientAppointmentsCache()
+search_cache = AppointmentSearchCache()
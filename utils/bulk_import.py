@@ -0,0 +1,317 @@
+# utils/bulk_import.py
+
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import uuid
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from itertools import islice
+from typing import Iterator, List, Optional, Tuple
+
+from database.db_supabase import Database, parse_datetime
+import utils.google_calendar
+from utils.working_hours import working_hours
+
+logger = logging.getLogger(__name__)
+
+IMPORT_KINDS = ('services', 'appointments')
+CALENDAR_MODES = ('skip', 'defer')
+
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_PARALLELISM = 4
+# Сколько примеров ошибок храним в отчете
+MAX_ERROR_SAMPLES = 50
+
+
+@dataclass
+class ImportProgress:
+    """Состояние импорта. Сохраняется в JSON после каждой группы пачек, чтобы импорт можно было продолжить."""
+    source: str
+    kind: str
+    rows_done: int = 0
+    inserted: int = 0
+    invalid: int = 0
+    failed: int = 0
+    errors: List[str] = field(default_factory=list)
+    # Пачки, не вставленные из-за ошибки запроса: [первая строка, число строк]. Повторяются при продолжении
+    failed_ranges: List[List[int]] = field(default_factory=list)
+    # ID записей, для которых событие в Google Calendar еще не создано (режим defer)
+    pending_calendar: List[str] = field(default_factory=list)
+
+    def add_error(self, message: str):
+        if len(self.errors) < MAX_ERROR_SAMPLES:
+            self.errors.append(message)
+
+    def save(self, path: str):
+        # Пишем через временный файл, чтобы прерванный процесс не оставил битый JSON
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(asdict(self), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load_or_create(cls, path: Optional[str], source: str, kind: str) -> 'ImportProgress':
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                progress = cls(**json.load(f))
+            if progress.source != source or progress.kind != kind:
+                raise ValueError(f"Файл прогресса {path} относится к другому импорту ({progress.kind}: {progress.source}).")
+            return progress
+        return cls(source=source, kind=kind)
+
+
+def _validate_service(row: dict) -> Tuple[Optional[dict], Optional[str]]:
+    title = (row.get('title') or '').strip()
+    category_id = (row.get('category_id') or '').strip()
+    price = (row.get('price') or '').strip()
+    if not title or not category_id or not price:
+        return None, "нужны поля title, category_id и price"
+    return {
+        'title': title,
+        'description': (row.get('description') or '').strip(),
+        'price': price,
+        'icon': (row.get('icon') or '').strip(),
+        'category_id': category_id,
+    }, None
+
+
+def _validate_appointment(row: dict) -> Tuple[Optional[dict], Optional[str]]:
+    client_name = (row.get('client_name') or '').strip()
+    service_id = (row.get('service_id') or '').strip()
+    if not client_name or not service_id:
+        return None, "нужны поля client_name и service_id"
+
+    raw_time = (row.get('appointment_time') or '').strip()
+    try:
+        appointment_time = datetime.strptime(raw_time, '%Y-%m-%d %H:%M')
+    except ValueError:
+        appointment_time = parse_datetime(raw_time)
+    if not appointment_time:
+        return None, f"не удалось разобрать appointment_time '{raw_time}'"
+
+    telegram_id = (row.get('client_telegram_id') or '').strip()
+    if telegram_id and not telegram_id.lstrip('-').isdigit():
+        return None, f"некорректный client_telegram_id '{telegram_id}'"
+
+    return {
+        'client_name': client_name,
+        'service_id': service_id,
+        'appointment_time': appointment_time.isoformat(),
+        'client_phone': (row.get('client_phone') or '').strip() or None,
+        'client_telegram_id': int(telegram_id) if telegram_id else None,
+        'status': (row.get('status') or '').strip() or 'completed',
+        # Исторические записи не должны попасть в рассылку напоминаний
+        'reminded': True,
+    }, None
+
+
+class BulkImporter:
+    """
+    Импорт услуг или записей из CSV пачками.
+    Строки валидируются пачкой, вставляются многострочными запросами,
+    одновременно выполняется не больше `parallelism` запросов.
+    """
+
+    def __init__(self, db: Database, kind: str, batch_size: int = DEFAULT_BATCH_SIZE,
+                 parallelism: int = DEFAULT_PARALLELISM, calendar_mode: str = 'skip'):
+        if kind not in IMPORT_KINDS:
+            raise ValueError(f"Неизвестный тип импорта: {kind}")
+        if calendar_mode not in CALENDAR_MODES:
+            raise ValueError(f"Неизвестный режим календаря: {calendar_mode}")
+        self.db = db
+        self.kind = kind
+        self.batch_size = batch_size
+        self.parallelism = parallelism
+        self.calendar_mode = calendar_mode
+
+    async def _validate_batch(self, start_line: int, rows: List[dict],
+                              source: str) -> Tuple[List[dict], List[str]]:
+        """Возвращает валидные строки и ошибки пачки. Прогресс здесь не меняется: пачка может еще упасть."""
+        validator = _validate_service if self.kind == 'services' else _validate_appointment
+        valid_rows = []
+        errors = []
+        for offset, row in enumerate(rows):
+            clean_row, error = validator(row)
+            if error:
+                errors.append(f"строка {start_line + offset}: {error}")
+                continue
+            # Ключ из файла и номера строки: повтор пачки, которая на самом деле уже вставлена
+            # (сбой после коммита или таймаут), не создаст дублей
+            row_key = uuid.uuid5(uuid.NAMESPACE_URL, f"{source}:{start_line + offset}")
+            if self.kind == 'appointments':
+                clean_row['idempotency_key'] = row_key.hex
+            else:
+                clean_row['id'] = str(row_key)
+            valid_rows.append(clean_row)
+
+        if self.kind == 'appointments' and valid_rows:
+            # Проверяем существование услуг одним запросом на всю пачку
+            known_ids = await self.db.get_existing_service_ids({row['service_id'] for row in valid_rows})
+            for row in valid_rows:
+                if row['service_id'] not in known_ids:
+                    errors.append(f"{row['client_name']} {row['appointment_time']}: "
+                                  f"услуга '{row['service_id']}' не найдена")
+            valid_rows = [row for row in valid_rows if row['service_id'] in known_ids]
+        return valid_rows, errors
+
+    async def _process_batch(self, start_line: int, rows: List[dict], progress: ImportProgress):
+        try:
+            valid_rows, errors = await self._validate_batch(start_line, rows, progress.source)
+            inserted = await self.db.bulk_insert(
+                self.kind, valid_rows, on_conflict='idempotency_key' if self.kind == 'appointments' else 'id')
+            pending_calendar = []
+            if self.kind == 'appointments' and self.calendar_mode == 'defer':
+                pending_calendar = [row['id'] for row in inserted if row.get('id')]
+                pending_calendar += await self._skipped_without_event(valid_rows, inserted, progress)
+        except Exception as e:
+            # Строки пачки запоминаем: при продолжении импорта они будут отправлены еще раз
+            progress.failed += len(rows)
+            progress.failed_ranges.append([start_line, len(rows)])
+            progress.add_error(f"строки {start_line}-{start_line + len(rows) - 1}: {e}")
+            logger.error("Ошибка импорта пачки со строки %s: %s", start_line, e)
+            return
+
+        progress.invalid += len(errors)
+        for error in errors:
+            progress.add_error(error)
+        progress.inserted += len(inserted)
+        progress.pending_calendar.extend(pending_calendar)
+
+    async def _skipped_without_event(self, valid_rows: List[dict], inserted: List[dict],
+                                     progress: ImportProgress) -> List[str]:
+        """
+        Строки, пропущенные как уже существующие, могли быть вставлены прерванным запуском,
+        который не успел сохранить их ID в pending_calendar. Такие записи без события тоже ставим в очередь.
+        """
+        inserted_keys = {row.get('idempotency_key') for row in inserted}
+        skipped_keys = [row['idempotency_key'] for row in valid_rows if row['idempotency_key'] not in inserted_keys]
+        if not skipped_keys:
+            return []
+        queued = set(progress.pending_calendar)
+        existing = await self.db.get_appointments_by_idempotency_keys(skipped_keys)
+        return [row['id'] for row in existing if not row.get('google_event_id') and row['id'] not in queued]
+
+    def _iter_batches(self, reader: Iterator[dict], first_line: int) -> Iterator[Tuple[int, List[dict]]]:
+        line = first_line
+        while True:
+            batch = list(islice(reader, self.batch_size))
+            if not batch:
+                return
+            yield line, batch
+            line += len(batch)
+
+    async def _retry_failed(self, csv_path: str, progress: ImportProgress, progress_path: Optional[str]):
+        """Повторяет пачки, упавшие в прошлых запусках; снова упавшие остаются в failed_ranges."""
+        ranges = progress.failed_ranges
+        progress.failed_ranges = []
+        progress.failed -= sum(count for _, count in ranges)
+        logger.info("Повторяем %s ранее не вставленных пачек.", len(ranges))
+
+        wanted = {start: count for start, count in ranges}
+        batches = []
+        with open(csv_path, newline='', encoding='utf-8-sig') as f:
+            reader = csv.DictReader(f)
+            line = 2
+            end = max(start + count for start, count in ranges)
+            while line < end:
+                if line in wanted:
+                    batches.append((line, list(islice(reader, wanted[line]))))
+                    line += wanted[line]
+                elif next(reader, None) is None:
+                    break
+                else:
+                    line += 1
+
+        for index in range(0, len(batches), self.parallelism):
+            group = batches[index:index + self.parallelism]
+            await asyncio.gather(*(self._process_batch(line, rows, progress) for line, rows in group))
+            if progress_path:
+                progress.save(progress_path)
+
+    async def run(self, csv_path: str, progress_path: Optional[str] = None) -> ImportProgress:
+        progress = ImportProgress.load_or_create(progress_path, os.path.abspath(csv_path), self.kind)
+        if progress.failed_ranges:
+            await self._retry_failed(csv_path, progress, progress_path)
+        if progress.rows_done:
+            logger.info("Продолжаем импорт %s со строки %s.", csv_path, progress.rows_done + 1)
+
+        with open(csv_path, newline='', encoding='utf-8-sig') as f:
+            reader = csv.DictReader(f)
+            # Пропускаем уже обработанные строки (заголовок - строка 1, данные начинаются со 2-й)
+            for _ in islice(reader, progress.rows_done):
+                pass
+            batches = self._iter_batches(reader, progress.rows_done + 2)
+
+            while True:
+                group = list(islice(batches, self.parallelism))
+                if not group:
+                    break
+                await asyncio.gather(*(self._process_batch(line, rows, progress) for line, rows in group))
+                # Прогресс фиксируем только после завершения всей группы, поэтому rows_done всегда
+                # указывает на непрерывный обработанный префикс файла
+                progress.rows_done += sum(len(rows) for _, rows in group)
+                if progress_path:
+                    progress.save(progress_path)
+                logger.info("Импорт %s: обработано %s строк, вставлено %s, отклонено %s, ошибок %s.",
+                            self.kind, progress.rows_done, progress.inserted, progress.invalid, progress.failed)
+
+        if progress.pending_calendar:
+            await self.create_deferred_calendar_events(progress, progress_path)
+        return progress
+
+    async def create_deferred_calendar_events(self, progress: ImportProgress, progress_path: Optional[str] = None):
+        """Создает события Google Calendar для записей, вставленных в режиме defer."""
+        semaphore = asyncio.Semaphore(self.parallelism)
+
+        async def create_one(appointment_id: str) -> bool:
+            async with semaphore:
+                app = await self.db.get_appointment_by_id(appointment_id)
+                if not app:
+                    return True  # Записи уже нет, создавать нечего
+                google_event_id = await utils.google_calendar.create_google_calendar_event(
+                    appointment_time_str=app.appointment_time.strftime('%Y-%m-%d %H:%M'),
+                    service_title=app.service_title,
+                    client_name=app.client_name,
+                    client_phone=app.client_phone,
+                    service_duration_minutes=app.service_duration_minutes or working_hours.default_duration_minutes,
+                    calendar_id=self.db.calendar_id,
+                )
+                if not google_event_id:
+                    return False
+                return await self.db.update_appointment_google_id(appointment_id, google_event_id)
+
+        results = await asyncio.gather(*(create_one(app_id) for app_id in progress.pending_calendar))
+        progress.pending_calendar = [app_id for app_id, ok in zip(progress.pending_calendar, results) if not ok]
+        if progress_path:
+            progress.save(progress_path)
+        logger.info(f"Отложенное создание событий Google Calendar завершено, "
+                    f"осталось {len(progress.pending_calendar)}.")
+
+
+async def _run_cli(args: argparse.Namespace):
+    from config_reader import config
+
+    db = Database(url=config.supabase_url, key=config.supabase_key)
+    importer = BulkImporter(db, args.kind, batch_size=args.batch_size,
+                            parallelism=args.parallel, calendar_mode=args.calendar)
+    progress_path = args.progress or f"{args.csv_path}.progress.json"
+    progress = await importer.run(args.csv_path, progress_path)
+    print(json.dumps(asdict(progress), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    # Пример: python -m utils.bulk_import appointments old_records.csv --calendar defer
+    parser = argparse.ArgumentParser(description="Массовый импорт услуг или записей из CSV.")
+    parser.add_argument("kind", choices=IMPORT_KINDS)
+    parser.add_argument("csv_path")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--parallel", type=int, default=DEFAULT_PARALLELISM)
+    parser.add_argument("--calendar", choices=CALENDAR_MODES, default='skip',
+                        help="skip — не создавать события, defer — создать после вставки всех строк")
+    parser.add_argument("--progress", help="Файл прогресса (по умолчанию <csv_path>.progress.json)")
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_run_cli(parser.parse_args()))
@@ -0,0 +1,108 @@
+# utils/error_digest.py
+
+import asyncio
+import html
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+
+from middlewares.outbound import Priority, send_priority
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW_SECONDS = 300
+MAX_EXAMPLE_UPDATES = 5
+
+
+@dataclass
+class ErrorBucket:
+    exception_type: str
+    location: str
+    message: str
+    repeats: int = 0  # сколько раз ошибка повторилась после первой в текущем окне
+    update_ids: List[int] = field(default_factory=list)
+
+
+def fingerprint(exception: BaseException) -> Tuple[str, str]:
+    """Отпечаток ошибки: тип исключения и место, где оно было брошено (файл:строка)."""
+    tb = exception.__traceback__
+    location = "unknown"
+    if tb is not None:
+        while tb.tb_next is not None:
+            tb = tb.tb_next
+        location = f"{tb.tb_frame.f_code.co_filename.rsplit('/', 1)[-1]}:{tb.tb_lineno}"
+    return type(exception).__name__, location
+
+
+class ErrorDigest:
+    """
+    Сводка ошибок для админа вместо сообщения на каждое исключение.
+    Первая ошибка с данным отпечатком в окне отправляется сразу, повторы только считаются
+    и раз в окно уходят одной сводкой с количеством и примерами update_id.
+    """
+
+    def __init__(self, window_seconds: int = DEFAULT_WINDOW_SECONDS):
+        self.window_seconds = window_seconds
+        self._buckets: Dict[Tuple[str, str], ErrorBucket] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, exception: BaseException, update_id: Optional[int]) -> bool:
+        """Учитывает ошибку. Возвращает True, если о ней нужно сообщить сразу (первая в окне)."""
+        key = fingerprint(exception)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            self._buckets[key] = ErrorBucket(exception_type=key[0], location=key[1], message=str(exception))
+            return True
+        bucket.repeats += 1
+        if update_id is not None and len(bucket.update_ids) < MAX_EXAMPLE_UPDATES:
+            bucket.update_ids.append(update_id)
+        return False
+
+    def build_digest(self) -> Optional[str]:
+        """Забирает накопленное за окно и формирует текст сводки (None, если повторов не было)."""
+        buckets, self._buckets = self._buckets, {}
+        repeated = sorted((b for b in buckets.values() if b.repeats), key=lambda b: b.repeats, reverse=True)
+        if not repeated:
+            return None
+
+        lines = [f"<b>📊 Сводка ошибок за {self.window_seconds // 60} мин.</b>\n"]
+        for bucket in repeated:
+            examples = ", ".join(str(update_id) for update_id in bucket.update_ids) or "—"
+            lines.append(
+                f"\n<b>{html.escape(bucket.exception_type)}</b> в <code>{html.escape(bucket.location)}</code>: "
+                f"еще {bucket.repeats} раз\n"
+                f"<i>{html.escape(bucket.message[:200])}</i>\n"
+                f"Апдейты: {examples}"
+            )
+        return "\n".join(lines)
+
+    async def flush(self, bot: Bot, admin_id: int):
+        text = self.build_digest()
+        if not text:
+            return
+        try:
+            with send_priority(Priority.NOTIFICATION):
+                await bot.send_message(admin_id, text)
+        except TelegramAPIError as e:
+            logger.error(f"Не удалось отправить сводку ошибок админу: {e}")
+
+    async def _run(self, bot: Bot, admin_id: int):
+        while True:
+            await asyncio.sleep(self.window_seconds)
+            await self.flush(bot, admin_id)
+
+    def start(self, bot: Bot, admin_id: int):
+        self._task = asyncio.create_task(self._run(bot, admin_id))
+
+    async def stop(self, bot: Bot, admin_id: int):
+        """Останавливает периодическую отправку и отправляет то, что успело накопиться."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.flush(bot, admin_id)
@@ -0,0 +1,135 @@
+# utils/export.py
+
+import argparse
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import tempfile
+import zlib
+from datetime import datetime, date, time
+from typing import AsyncIterator, BinaryIO, Optional
+
+from database.db_supabase import Database
+from database.models import Appointment
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+# Поля выгрузки в том порядке, в котором они идут в CSV
+EXPORT_FIELDS = [
+    'id', 'appointment_time', 'client_name', 'client_phone', 'client_telegram_id',
+    'service_id', 'service_title', 'service_price', 'status', 'created_at',
+]
+
+# Сколько строк сериализуем за раз перед сжатием
+ROWS_PER_CHUNK = 200
+
+
+def _appointment_to_row(app: Appointment) -> dict:
+    return {
+        'id': app.id,
+        'appointment_time': app.appointment_time.isoformat() if app.appointment_time else None,
+        'client_name': app.client_name,
+        'client_phone': app.client_phone,
+        'client_telegram_id': app.client_telegram_id,
+        'service_id': app.service_id,
+        'service_title': app.service_title,
+        'service_price': app.service_price,
+        'status': app.status,
+        'created_at': app.created_at.isoformat() if app.created_at else None,
+    }
+
+
+async def iter_export_chunks(db: Database, start: date, end: date, fmt: str = 'csv') -> AsyncIterator[bytes]:
+    """
+    Отдает выгрузку записей за период [start, end] кусками gzip-потока.
+    В памяти держится только текущая пачка строк и страница из базы.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+
+    # wbits=31 — формат gzip, чтобы файл открывался обычными архиваторами
+    compressor = zlib.compressobj(wbits=31)
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS) if fmt == 'csv' else None
+    if writer:
+        writer.writeheader()
+
+    rows_in_buffer = 0
+    async for app in db.iter_appointments(start=datetime.combine(start, time.min),
+                                          end=datetime.combine(end, time.max)):
+        row = _appointment_to_row(app)
+        if writer:
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(row, ensure_ascii=False) + '\n')
+        rows_in_buffer += 1
+
+        if rows_in_buffer >= ROWS_PER_CHUNK:
+            chunk = compressor.compress(buffer.getvalue().encode('utf-8'))
+            buffer.seek(0)
+            buffer.truncate()
+            rows_in_buffer = 0
+            if chunk:
+                yield chunk
+
+    chunk = compressor.compress(buffer.getvalue().encode('utf-8')) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+async def write_export(db: Database, start: date, end: date, fmt: str, output: BinaryIO) -> int:
+    """Пишет сжатую выгрузку в файловый объект. Возвращает число записанных байт."""
+    written = 0
+    async for chunk in iter_export_chunks(db, start, end, fmt):
+        output.write(chunk)
+        written += len(chunk)
+    return written
+
+
+def export_filename(start: date, end: date, fmt: str) -> str:
+    return f"appointments_{start.isoformat()}_{end.isoformat()}.{fmt}.gz"
+
+
+async def export_to_tempfile(db: Database, start: date, end: date, fmt: str = 'csv') -> Optional[str]:
+    """
+    Пишет выгрузку во временный файл на диске и возвращает путь к нему.
+    Удалить файл после отправки должен вызывающий код.
+    """
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}.gz", prefix="appointments_")
+    try:
+        with os.fdopen(fd, 'wb') as output:
+            written = await write_export(db, start, end, fmt, output)
+        logger.info("Выгрузка записей за %s - %s (%s) готова: %s байт.", start, end, fmt, written)
+        return path
+    except Exception as e:
+        logger.error(f"Ошибка при выгрузке записей за {start} - {end}: {e}", exc_info=True)
+        os.remove(path)
+        return None
+
+
+async def _run_cli(args: argparse.Namespace):
+    from config_reader import config
+
+    db = Database(url=config.supabase_url, key=config.supabase_key)
+    start = date.fromisoformat(args.start)
+    end = date.fromisoformat(args.end)
+    output_path = args.output or export_filename(start, end, args.format)
+    with open(output_path, 'wb') as output:
+        written = await write_export(db, start, end, args.format, output)
+    print(f"Saved {written} bytes to {output_path}")
+
+
+if __name__ == "__main__":
+    # Пример: python -m utils.export 2024-05-01 2024-05-31 --format jsonl
+    parser = argparse.ArgumentParser(description="Выгрузка записей за период в сжатый CSV/JSONL.")
+    parser.add_argument("start", help="Дата начала, YYYY-MM-DD")
+    parser.add_argument("end", help="Дата окончания (включительно), YYYY-MM-DD")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default='csv')
+    parser.add_argument("--output", "-o", help="Путь к файлу (по умолчанию appointments_<start>_<end>.<format>.gz)")
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_run_cli(parser.parse_args()))
@@ -5,6 +5,8 @@ import google.generativeai as genai
 import logging
 from typing import Optional, List
 
+from utils.tracing import traced
+
 # Получаем API ключ из переменных окружения
 API_KEY = os.getenv('GOOGLE_API_KEY')
 
@@ -31,6 +33,7 @@ def get_gemini_model(model_name: str = "gemini-2.0-flash-thinking-exp-01-21"):
         return None
 
 
+@traced("gemini.generate_text")
 async def generate_text(prompt: str, model_name: str = "gemini-2.0-flash-thinking-exp-01-21", max_chars_per_message: int = 4000) -> Optional[
     List[str]]:
     """
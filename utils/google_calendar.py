@@ -1,5 +1,6 @@
 # utils/google_calendar.py
 
+import asyncio
 import logging
 from datetime import datetime, timedelta
 from typing import Optional, List# <-- ДОБАВЛЕНО
@@ -9,6 +10,8 @@ from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 import os
 
+from utils.tracing import traced
+
 # Имя файла ключа сервисного аккаунта.
 # Убедись, что этот файл находится в корневой папке вашего проекта.
 # Если он называется иначе (например, credentials.json), измените это имя.
@@ -20,11 +23,11 @@ CALENDAR_ID = os.environ.get('GOOGLE_CALENDAR_ID')
 
 logger = logging.getLogger(__name__)
 
-def get_google_calendar_service():
+def get_google_calendar_service(calendar_id: Optional[str] = None):
     """
     Создает и возвращает объект сервиса Google Calendar, используя сервисный аккаунт.
     """
-    if not CALENDAR_ID:
+    if not (calendar_id or CALENDAR_ID):
         logger.error("GOOGLE_CALENDAR_ID не установлен в переменных окружения.")
         return None
 
@@ -49,10 +52,15 @@ def get_google_calendar_service():
         return None
 
 
+@traced("calendar.create_google_calendar_event")
 async def create_google_calendar_event(appointment_time_str: str, service_title: str, client_name: str,
-                                 client_phone: Optional[str] = None, service_duration_minutes: int = 60) -> Optional[
-    str]:
-    service = get_google_calendar_service()
+                                 client_phone: Optional[str] = None, service_duration_minutes: int = 60,
+                                 calendar_id: Optional[str] = None, event_id: Optional[str] = None) -> Optional[str]:
+    # calendar_id задается для арендатора со своим календарем; по умолчанию — GOOGLE_CALENDAR_ID.
+    # event_id — заранее выбранный ID события (ключ идемпотентности записи): повторный вызов с тем же
+    # ID не создаст второе событие, а вернет ID уже существующего
+    calendar_id = calendar_id or CALENDAR_ID
+    service = get_google_calendar_service(calendar_id)
     if not service:
         return None
 
@@ -75,30 +83,38 @@ async def create_google_calendar_event(appointment_time_str: str, service_title:
             'end': {'dateTime': end_time_dt.isoformat(), 'timeZone': 'Europe/Moscow'},  # <-- Укажите ваш часовой пояс!
             'reminders': {'useDefault': False, 'overrides': [{'method': 'popup', 'minutes': 1440}]},
         }
+        if event_id:
+            event['id'] = event_id
 
         # --- ИСПРАВЛЕНИЕ СИНТАКСИСА ---
         # Передаем ВЫЗОВ execute() в asyncio.to_thread, и сам вызов asyncio.to_thread await-им.
         # Это означает, что execute() будет вызван в другом потоке,
         # а основной поток будет ждать результат.
         created_event = await asyncio.to_thread(
-            service.events().insert(calendarId=CALENDAR_ID, body=event).execute
+            service.events().insert(calendarId=calendar_id, body=event).execute
         )
         # --- КОНЕЦ ИСПРАВЛЕНИЯ ---
 
         event_id = created_event.get('id')
-        logger.info(f"Событие Google Calendar создано: {created_event.get('htmlLink')}")
+        logger.info("Событие Google Calendar создано: %s", created_event.get('htmlLink'))
         return event_id
 
     except HttpError as error:
+        if event_id and error.resp.status == 409:
+            # Событие с этим ID уже создано предыдущей попыткой
+            logger.info(f"Событие Google Calendar {event_id} уже существует, повторно не создается.")
+            return event_id
         logger.error(f'Произошла ошибка Google API при создании события: {error}')
         if error.resp.status == 404:
-            logger.error(f"Календарь с ID '{CALENDAR_ID}' не найден. Проверьте правильность GOOGLE_CALENDAR_ID.")
+            logger.error(f"Календарь с ID '{calendar_id}' не найден. Проверьте правильность GOOGLE_CALENDAR_ID.")
         return None
     except Exception as e:
         logger.error(f'Произошла непредвиденная ошибка при создании события Google Calendar: {e}')
         return None
 
-def update_google_calendar_event(event_id: str, appointment_time_str: str, service_title: str, client_name: str, client_phone: Optional[str] = None, service_duration_minutes: int = 60):
+@traced("calendar.update_google_calendar_event")
+def update_google_calendar_event(event_id: str, appointment_time_str: str, service_title: str, client_name: str, client_phone: Optional[str] = None, service_duration_minutes: int = 60,
+                                 calendar_id: Optional[str] = None):
     """
     Обновляет существующее событие в Google Calendar.
 
@@ -109,11 +125,13 @@ def update_google_calendar_event(event_id: str, appointment_time_str: str, servi
         client_name (str): Новое имя клиента.
         client_phone (Optional[str]): Новый номер телефона клиента.
         service_duration_minutes (int): Новая продолжительность услуги (по умолчанию 60).
+        calendar_id (Optional[str]): Календарь арендатора (по умолчанию GOOGLE_CALENDAR_ID).
 
     Returns:
         bool: True, если событие успешно обновлено, False в противном случае.
     """
-    service = get_google_calendar_service()
+    calendar_id = calendar_id or CALENDAR_ID
+    service = get_google_calendar_service(calendar_id)
     if not service:
         return False
     if not event_id:
@@ -139,31 +157,34 @@ def update_google_calendar_event(event_id: str, appointment_time_str: str, servi
             'reminders': {'useDefault': False, 'overrides': [{'method': 'popup', 'minutes': 1440}]},
         }
 
-        updated_event = service.events().update(calendarId=CALENDAR_ID, eventId=event_id, body=event).execute()
+        updated_event = service.events().update(calendarId=calendar_id, eventId=event_id, body=event).execute()
         logger.info(f"Событие Google Calendar с ID '{event_id}' обновлено: {updated_event.get('htmlLink')}")
         return True
 
     except HttpError as error:
         logger.error(f'Произошла ошибка Google API при обновлении события: {error}')
         if error.resp.status == 404:
-            logger.error(f"Событие с ID '{event_id}' не найдено в календаре '{CALENDAR_ID}'. Возможно, оно было удалено вручную.")
+            logger.error(f"Событие с ID '{event_id}' не найдено в календаре '{calendar_id}'. Возможно, оно было удалено вручную.")
         return False
     except Exception as e:
         logger.error(f'Произошла непредвиденная ошибка при обновлении события Google Calendar: {e}')
         return False
 
 
-def delete_google_calendar_event(event_id: str):
+@traced("calendar.delete_google_calendar_event")
+def delete_google_calendar_event(event_id: str, calendar_id: Optional[str] = None):
     """
     Удаляет событие из Google Calendar.
 
     Args:
         event_id (str): ID события Google Calendar.
+        calendar_id (Optional[str]): Календарь арендатора (по умолчанию GOOGLE_CALENDAR_ID).
 
     Returns:
         bool: True, если событие успешно удалено, False в противном случае.
     """
-    service = get_google_calendar_service()
+    calendar_id = calendar_id or CALENDAR_ID
+    service = get_google_calendar_service(calendar_id)
     if not service:
         return False
     if not event_id:
@@ -178,8 +199,8 @@ def delete_google_calendar_event(event_id: str):
         # Попробуем сначала без asyncio.to_thread.
 
         # --- Попробуем без asyncio.to_thread ---
-        service.events().delete(calendarId=CALENDAR_ID, eventId=event_id).execute()
-        logger.info(f"Событие Google Calendar с ID '{event_id}' успешно удалено.")
+        service.events().delete(calendarId=calendar_id, eventId=event_id).execute()
+        logger.info("Событие Google Calendar с ID '%s' успешно удалено.", event_id)
         return True
         # --- Если будет ошибка, то нужно будет попробовать: ---
         # await asyncio.to_thread(service.events().delete(calendarId=CALENDAR_ID, eventId=event_id).execute)
@@ -190,7 +211,7 @@ def delete_google_calendar_event(event_id: str):
         logger.error(f'Произошла ошибка Google API при удалении события: {error}')
         if error.resp.status == 404:
             logger.error(
-                f"Событие с ID '{event_id}' не найдено в календаре '{CALENDAR_ID}'. Возможно, оно было удалено вручную.")
+                f"Событие с ID '{event_id}' не найдено в календаре '{calendar_id}'. Возможно, оно было удалено вручную.")
         return False
     except Exception as e:
         logger.error(f'Произошла непредвиденная ошибка при удалении события Google Calendar: {e}')
@@ -0,0 +1,137 @@
+# utils/leader.py
+
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Callable, Optional
+
+from database.db_supabase import Database
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEASE_NAME = 'scheduler'
+DEFAULT_TTL_SECONDS = 30
+# Лидер считает себя лидером чуть меньше срока аренды, чтобы не пересечься с преемником
+SAFETY_MARGIN = 0.8
+
+
+class LeaderElector:
+    """
+    Выбор лидера через аренду в БД (Database.acquire_lease).
+    Аренда продлевается каждые ttl/3 секунд; если продлить не удалось, копия перестает быть лидером
+    раньше, чем аренда истечет: в момент окончания лидерства срабатывает таймер и вызывает on_demoted,
+    не дожидаясь следующей попытки продления. Ведомые опрашивают аренду с тем же интервалом и забирают ее,
+    как только она истекла или была освобождена при остановке.
+    Fencing token растет при каждой смене лидера: перед побочным эффектом задача вызывает verify(),
+    и устаревший лидер, потерявший аренду, ничего не сделает.
+    """
+
+    def __init__(self, db: Database, name: str = DEFAULT_LEASE_NAME, ttl_seconds: int = DEFAULT_TTL_SECONDS,
+                 on_elected: Optional[Callable[[], None]] = None, on_demoted: Optional[Callable[[], None]] = None):
+        self.db = db
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.holder_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.fencing_token: Optional[int] = None
+        self._leader_until = 0.0
+        self._expiry_timer: Optional[asyncio.TimerHandle] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self.fencing_token is not None and time.monotonic() < self._leader_until
+
+    def _become_leader(self, token: int, started: float):
+        was_leader = self.is_leader
+        previous_token = self.fencing_token
+        self.fencing_token = token
+        self._leader_until = started + self.ttl_seconds * SAFETY_MARGIN
+        self._arm_expiry_timer()
+        if not was_leader or previous_token != token:
+            logger.info(f"{self.holder_id} became leader for '{self.name}' (fencing token {token}).")
+            if self.on_elected:
+                self.on_elected()
+
+    def _arm_expiry_timer(self):
+        if self._expiry_timer:
+            self._expiry_timer.cancel()
+        delay = max(0.0, self._leader_until - time.monotonic())
+        self._expiry_timer = asyncio.get_running_loop().call_later(delay, self._on_leadership_lapsed)
+
+    def _on_leadership_lapsed(self):
+        self._expiry_timer = None
+        if self.fencing_token is None:
+            return
+        if self.is_leader:
+            # Таймер event loop может сработать чуть раньше (на разрешение часов)
+            self._arm_expiry_timer()
+        else:
+            self._step_down("lease was not renewed in time")
+
+    def _step_down(self, reason: str):
+        if self._expiry_timer:
+            self._expiry_timer.cancel()
+            self._expiry_timer = None
+        if self.fencing_token is None:
+            return
+        logger.warning(f"{self.holder_id} is no longer leader for '{self.name}': {reason}.")
+        self.fencing_token = None
+        self._leader_until = 0.0
+        if self.on_demoted:
+            self.on_demoted()
+
+    async def tick(self):
+        """Одна попытка взять или продлить аренду."""
+        if self.fencing_token is not None and not self.is_leader:
+            self._step_down("lease was not renewed in time")
+        started = time.monotonic()
+        try:
+            token = await self.db.acquire_lease(self.name, self.holder_id, self.ttl_seconds)
+        except Exception as e:
+            logger.error(f"Lease renewal for '{self.name}' failed: {e}")
+            return
+
+        if token:
+            self._become_leader(token, started)
+        else:
+            self._step_down("lease is held by another replica")
+
+    async def _run(self):
+        interval = self.ttl_seconds / 3
+        while True:
+            await self.tick()
+            await asyncio.sleep(interval)
+
+    async def verify(self) -> bool:
+        """Проверка перед побочным эффектом: мы лидер и наш токен все еще актуален в БД."""
+        if not self.is_leader:
+            return False
+        try:
+            return await self.db.check_lease(self.name, self.fencing_token)
+        except Exception as e:
+            logger.error(f"Lease check for '{self.name}' failed: {e}")
+            return False
+
+    async def start(self):
+        await self.tick()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self.fencing_token is not None:
+            # Освобождаем аренду, чтобы другая копия стала лидером без ожидания истечения срока
+            try:
+                await self.db.release_lease(self.name, self.holder_id)
+            except Exception as e:
+                logger.error(f"Lease release for '{self.name}' failed: {e}")
+            self._step_down("shutting down")
@@ -0,0 +1,98 @@
+# utils/logging_setup.py
+
+import logging
+import queue
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Tuple
+
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(name)s - %(message)s"
+
+# Для сообщений уровня INFO и ниже: сколько записей одного шаблона в секунду пропускаем
+# и какой всплеск допускаем. WARNING и выше не ограничиваются.
+SAMPLED_RATE_PER_SECOND = 5.0
+SAMPLED_BURST = 20
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Ограничивает частоту одинаковых (по логгеру и шаблону сообщения) записей уровня INFO и ниже.
+    Шаблон — это record.msg до подстановки аргументов, поэтому в горячих местах логируем
+    в ленивом стиле: logger.info("User %s ...", user_id), а не через f-строку.
+    Число отброшенных записей дописывается к следующей пропущенной.
+    Корзины, которые успели полностью пополниться, не отличаются от новых — их периодически
+    удаляем, чтобы словарь не рос от разовых сообщений.
+    """
+
+    def __init__(self, rate_per_second: float = SAMPLED_RATE_PER_SECOND, burst: int = SAMPLED_BURST):
+        super().__init__()
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        # (логгер, шаблон) -> (токены, время пополнения, отброшено)
+        self._buckets: Dict[Tuple[str, str], Tuple[float, float, int]] = {}
+        # За это время пустая корзина пополняется до burst
+        self._refill_seconds = burst / rate_per_second
+        self._next_prune_at = time.monotonic() + self._refill_seconds
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        if now >= self._next_prune_at:
+            self._prune(now)
+        tokens, updated_at, dropped = self._buckets.get(key, (self.burst, now, 0))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate_per_second)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now, dropped + 1)
+            return False
+
+        if dropped:
+            record.msg = f"{record.msg} [+{dropped} similar suppressed]"
+        self._buckets[key] = (tokens - 1, now, 0)
+        return True
+
+    def _prune(self, now: float):
+        # Отброшенные записи такой корзины уже не будут упомянуты: шаблон давно не повторялся
+        idle_since = now - self._refill_seconds
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if bucket[1] > idle_since}
+        self._next_prune_at = now + self._refill_seconds
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    QueueHandler, который не форматирует запись в вызывающем потоке:
+    подстановка аргументов и запись в поток выполняются в потоке QueueListener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Текст исключения считаем сразу: traceback-объект нельзя надежно передать на потом
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level: int = logging.INFO) -> QueueListener:
+    """
+    Настраивает корневой логгер: записи кладутся в очередь, а форматирование и вывод в stderr
+    выполняет отдельный поток. Возвращает запущенный QueueListener (остановить при выходе).
+    """
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+
+    queue_handler = LazyQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter())
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -1,21 +1,121 @@
 # utils/notifications.py
 
+import asyncio
 import logging
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, List, Optional, Tuple
 from aiogram import Bot
 from aiogram.exceptions import TelegramAPIError
 from config_reader import config
 from database.models import Appointment
+from middlewares.outbound import Priority, send_priority
 
 logger = logging.getLogger(__name__)
 
-async def notify_admin_on_new_booking(bot: Bot, appointment: Appointment, service_title: str, service_price: str):
+
+@dataclass
+class BookingEvent:
+    appointment: Appointment
+    service_title: str
+    service_price: str
+
+
+class BookingDigest:
     """
-    Отправляет уведомление администратору о новой записи.
+    Буфер уведомлений о новых записях: вместо сообщения на каждую запись админ получает
+    одну сводку раз в `window_seconds` секунд или как только накопилось `max_events` записей.
+    Своя сводка у каждого админа (арендатора).
     """
-    if not config.admin_id:
+
+    def __init__(self, bot: Bot, admin_id: int, window_seconds: int, max_events: int):
+        self.bot = bot
+        self.admin_id = admin_id
+        self.window_seconds = window_seconds
+        self.max_events = max_events
+        self._events: List[BookingEvent] = []
+        self._timer: Optional[asyncio.Task] = None
+
+    async def add(self, event: BookingEvent):
+        self._events.append(event)
+        if len(self._events) >= self.max_events:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window_seconds)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        """Отправляет накопленную сводку. Вызывается по таймеру, по размеру и при остановке бота."""
+        if self._timer and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+        self._timer = None
+        events, self._events = self._events, []
+        if not events:
+            return
+
+        lines = [f"🔔 <b>Новые записи ({len(events)}):</b>\n"]
+        for event in sorted(events, key=lambda e: e.appointment.appointment_time):
+            lines.append(
+                f"▪️ {event.appointment.appointment_time.strftime('%d.%m.%Y %H:%M')} — "
+                f"{event.appointment.client_name}, {event.service_title} ({event.service_price} ₽)"
+            )
+        await _send_to_admin(self.bot, self.admin_id, "\n".join(lines))
+
+
+# Сводка включается настройкой BOOKING_DIGEST_ENABLED; (id бота, id админа) -> сводка
+_booking_digests: Dict[Tuple[int, int], BookingDigest] = {}
+
+
+def get_booking_digest(bot: Bot, admin_id: int) -> BookingDigest:
+    key = (bot.id, admin_id)
+    digest = _booking_digests.get(key)
+    if digest is None:
+        digest = _booking_digests[key] = BookingDigest(bot, admin_id,
+                                                       window_seconds=config.booking_digest_seconds,
+                                                       max_events=config.booking_digest_max_events)
+    return digest
+
+
+async def flush_booking_digests():
+    """Отправляет все накопленные сводки (при остановке бота)."""
+    for digest in list(_booking_digests.values()):
+        await digest.flush()
+
+
+async def _send_to_admin(bot: Bot, admin_id: int, text: str):
+    try:
+        with send_priority(Priority.NOTIFICATION):
+            await bot.send_message(
+                chat_id=admin_id,
+                text=text,
+                # Можно добавить инлайн-кнопку для быстрого перехода к записям на день
+                # reply_markup=...
+            )
+        logger.info("Уведомление о новой записи отправлено администратору %s", admin_id)
+    except TelegramAPIError as e:
+        logger.error(f"Не удалось отправить уведомление администратору {admin_id}: {e}")
+
+
+async def notify_admin_on_new_booking(bot: Bot, appointment: Appointment, service_title: str, service_price: str,
+                                      admin_id: Optional[int] = None):
+    """
+    Отправляет уведомление администратору о новой записи (admin_id арендатора, по умолчанию ADMIN_ID).
+    В режиме сводки запись попадает в буфер; записи на сегодня отправляются сразу.
+    """
+    admin_id = admin_id or config.admin_id
+    if not admin_id:
         logger.warning("ADMIN_ID не установлен. Невозможно отправить уведомление.")
         return
 
+    is_urgent = appointment.appointment_time.date() <= date.today()
+    if config.booking_digest_enabled and not is_urgent:
+        await get_booking_digest(bot, admin_id).add(BookingEvent(appointment, service_title, service_price))
+        return
+
     # Форматируем дату и время для красивого вывода
     appointment_time_str = appointment.appointment_time.strftime('%d.%m.%Y в %H:%M')
 
@@ -27,14 +127,21 @@ async def notify_admin_on_new_booking(bot: Bot, appointment: Appointment, servic
         f"🗓️ <b>Дата и время:</b> {appointment_time_str}\n\n"
         f"<i>Telegram ID клиента:</i> <code>{appointment.client_telegram_id}</code>"
     )
+    await _send_to_admin(bot, admin_id, text)
 
-    try:
-        await bot.send_message(
-            chat_id=config.admin_id,
-            text=text,
-            # Можно добавить инлайн-кнопку для быстрого перехода к записям на день
-            # reply_markup=...
-        )
-        logger.info(f"Уведомление о новой записи отправлено администратору {config.admin_id}")
-    except TelegramAPIError as e:
-        logger.error(f"Не удалось отправить уведомление администратору {config.admin_id}: {e}")
\ No newline at end of file
+
+async def notify_admin_on_client_cancellation(bot: Bot, appointment: Appointment, admin_id: Optional[int] = None):
+    """Сообщает администратору, что клиент сам отменил запись и время снова свободно."""
+    admin_id = admin_id or config.admin_id
+    if not admin_id:
+        logger.warning("ADMIN_ID не установлен. Невозможно отправить уведомление.")
+        return
+
+    text = (
+        f"🚫 <b>Клиент отменил запись</b>\n\n"
+        f"👤 <b>Клиент:</b> {appointment.client_name}\n"
+        f"✍️ <b>Услуга:</b> {appointment.service_title or 'Не указана'}\n"
+        f"🗓️ <b>Дата и время:</b> {appointment.appointment_time.strftime('%d.%m.%Y в %H:%M')}\n\n"
+        f"Время снова доступно для записи."
+    )
+    await _send_to_admin(bot, admin_id, text)
\ No newline at end of file
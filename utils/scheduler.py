@@ -1,64 +1,259 @@
 # utils/scheduler.py
 
 import logging
+from datetime import datetime, timedelta
+from typing import Optional
+from zoneinfo import ZoneInfo
 from aiogram import Bot
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
+from config_reader import config
 from database.db_supabase import Database
+from database.models import Appointment
+from middlewares.outbound import Priority, send_priority
+from utils.leader import LeaderElector
+from utils.tenants import DEFAULT_TENANT, TenantRegistry
+from utils.tracing import tracer
 
 logger = logging.getLogger(__name__)
 
+TIMEZONE = "Europe/Moscow"
+# Как часто лидер перечитывает общее хранилище задач: задачи, добавленные ведомыми, он иначе не заметит
+JOBSTORE_POLL_SECONDS = 60
+# Через сколько секунд повторить задачу, которую копия не выполнила, не подтвердив лидерство
+LEADER_RETRY_SECONDS = 15
 
-async def send_reminders(bot: Bot, db: Database):
+# Задачи хранятся в SQLite и переживают перезапуск, поэтому в них нельзя передать bot и db —
+# в задаче лежит только имя арендатора, а его bot и db берутся отсюда (заполняется в setup_scheduler)
+_runtime: dict = {}
+
+
+def _reminder_job_id(appointment_id: str, hours_before: int, tenant_name: str = DEFAULT_TENANT) -> str:
+    job_id = f"reminder:{appointment_id}:{hours_before}h"
+    # У основного арендатора id задач прежние, чтобы подхватить задачи, созданные до мультиарендности
+    return job_id if tenant_name == DEFAULT_TENANT else f"{tenant_name}:{job_id}"
+
+
+def _waitlist_job_id(entry_id: str, tenant_name: str = DEFAULT_TENANT) -> str:
+    return f"{tenant_name}:waitlist:{entry_id}"
+
+
+def _now() -> datetime:
+    # Время записей хранится без таймзоны, по Москве
+    return datetime.now(ZoneInfo(TIMEZONE)).replace(tzinfo=None)
+
+
+def _format_offset(hours_before: int) -> str:
+    if hours_before % 24 == 0:
+        days = hours_before // 24
+        return "завтра" if days == 1 else f"через {days} дн."
+    return f"через {hours_before} ч."
+
+
+def _format_lead_time(hours_before: int) -> str:
+    if hours_before % 24 == 0:
+        days = hours_before // 24
+        return "за день" if days == 1 else f"за {days} дн."
+    return f"за {hours_before} ч."
+
+
+def describe_reminders(appointment_time: Optional[datetime] = None) -> str:
     """
-    Асинхронная задача для отправки напоминаний о записях на завтра.
+    Текст для клиента о том, когда придут напоминания, по config.reminder_offsets_hours.
+    Если указано время визита, не упоминает напоминания, время которых уже прошло
+    (schedule_appointment_reminders их не ставит). Пустая строка — напоминаний не будет.
     """
-    logger.info("Scheduler job: Checking for reminders...")
+    offsets = sorted(set(config.reminder_offsets_hours), reverse=True)
+    if appointment_time is not None:
+        now = _now()
+        offsets = [h for h in offsets if appointment_time - timedelta(hours=h) > now]
+    if not offsets:
+        return ""
+    lead_times = [_format_lead_time(h) for h in offsets]
+    if len(lead_times) == 1:
+        return f"Вам придет напоминание {lead_times[0]} до визита."
+    return f"Вам придут напоминания {', '.join(lead_times[:-1])} и {lead_times[-1]} до визита."
 
-    # Используем await, так как метод DB теперь асинхронный
-    appointments_to_remind = await db.get_upcoming_appointments_to_remind()
 
-    if not appointments_to_remind:
-        logger.info("No appointments for tomorrow to remind about.")
+def _retry_as_leader(func, args: tuple, job_id: str):
+    """
+    APScheduler удаляет наступившую задачу из хранилища до ее запуска. Если копия не подтвердила
+    лидерство (аренда истекла, а планировщик еще не на паузе, или check_lease упал из-за сбоя сети),
+    задачу ставим снова — иначе она потеряется. Ее выполнит тот, кто будет лидером через несколько секунд.
+    """
+    scheduler: Optional[AsyncIOScheduler] = _runtime.get('scheduler')
+    if scheduler is None:
         return
+    scheduler.add_job(func, 'date', run_date=_now() + timedelta(seconds=LEADER_RETRY_SECONDS), args=args,
+                      id=job_id, replace_existing=True, misfire_grace_time=3600)
+
 
-    sent_count = 0
-    for app in appointments_to_remind:
-        if app.client_telegram_id:
-            try:
-                # Формируем текст сообщения
-                text = (
-                    f"🔔 <b>Напоминание о записи</b>\n\n"
-                    f"Здравствуйте, {app.client_name}! Напоминаем, что вы записаны к нам завтра.\n\n"
-                    f"<b>Услуга:</b> {app.service_title}\n"
-                    f"<b>Время:</b> {app.appointment_time.strftime('%d.%m.%Y в %H:%M')}\n\n"
-                    f"Ждем вас!"
-                )
-
-                # Отправляем сообщение
+async def send_appointment_reminder(appointment_id: str, hours_before: int, tenant_name: str = DEFAULT_TENANT):
+    """
+    Задача планировщика: напоминание по одной записи.
+    Перед отправкой перечитывает запись — если ее отменили или удалили, ничего не отправляет.
+    """
+    runtime = _runtime['tenants'].get(tenant_name)
+    if runtime is None:
+        logger.warning("Reminder for appointment %s skipped: unknown tenant '%s'.", appointment_id, tenant_name)
+        return
+    bot: Bot = runtime.bot
+    db: Database = runtime.db
+
+    with tracer.span("job.send_appointment_reminder", root=True, appointment_id=appointment_id, tenant=tenant_name):
+        # Fencing: если копий несколько, напоминание отправляет только действующий лидер
+        elector: Optional[LeaderElector] = _runtime.get('elector')
+        if elector and not await elector.verify():
+            logger.warning("Reminder for appointment %s deferred: this replica is not the leader.", appointment_id)
+            _retry_as_leader(send_appointment_reminder, (appointment_id, hours_before, tenant_name),
+                             _reminder_job_id(appointment_id, hours_before, tenant_name))
+            return
+
+        app = await db.get_appointment_by_id(appointment_id)
+        if not app or app.status != 'active' or not app.client_telegram_id:
+            logger.info("Reminder for appointment %s skipped: not active or no Telegram ID.", appointment_id)
+            return
+        if app.appointment_time <= _now():
+            # Задачу откладывали так долго, что визит уже начался
+            logger.info("Reminder for appointment %s skipped: the appointment has already started.", appointment_id)
+            return
+
+        text = (
+            f"🔔 <b>Напоминание о записи</b>\n\n"
+            f"Здравствуйте, {app.client_name}! Напоминаем, что вы записаны к нам {_format_offset(hours_before)}\n\n"
+            f"<b>Услуга:</b> {app.service_title}\n"
+            f"<b>Время:</b> {app.appointment_time.strftime('%d.%m.%Y в %H:%M')}\n\n"
+            f"Ждем вас!"
+        )
+        try:
+            # Низкий приоритет: не мешаем ответам пользователям
+            with send_priority(Priority.BULK):
                 await bot.send_message(app.client_telegram_id, text)
+            await db.mark_as_reminded(app.id)
+            logger.info("Sent reminder for appointment ID %s to user %s", app.id, app.client_telegram_id)
+        except Exception as e:
+            logger.error(f"Failed to send reminder for appointment ID {app.id}: {e}")
 
-                # Помечаем, что напоминание отправлено (тоже асинхронно)
-                await db.mark_as_reminded(app.id)
 
-                sent_count += 1
-                logger.info(f"Sent reminder for appointment ID {app.id} to user {app.client_telegram_id}")
-            except Exception as e:
-                logger.error(f"Failed to send reminder for appointment ID {app.id}: {e}")
+def schedule_appointment_reminders(scheduler: AsyncIOScheduler, appointment: Appointment,
+                                   tenant_name: str = DEFAULT_TENANT):
+    """
+    Ставит напоминания по записи за config.reminder_offsets_hours часов до визита.
+    Повторный вызов перепланирует задачи (например, при переносе записи).
+    """
+    if not appointment.id or not appointment.client_telegram_id:
+        return
+
+    now = _now()
+    for hours_before in config.reminder_offsets_hours:
+        run_at = appointment.appointment_time - timedelta(hours=hours_before)
+        job_id = _reminder_job_id(appointment.id, hours_before, tenant_name)
+        if run_at <= now:
+            # Время напоминания уже прошло (запись сделана впритык) — старую задачу, если была, убираем
+            _remove_job(scheduler, job_id)
+            continue
+        scheduler.add_job(send_appointment_reminder, 'date', run_date=run_at,
+                          args=(appointment.id, hours_before, tenant_name), id=job_id, replace_existing=True,
+                          misfire_grace_time=3600)
+    logger.info("Reminders scheduled for appointment %s.", appointment.id)
+
+
+def cancel_appointment_reminders(scheduler: AsyncIOScheduler, appointment_id: str,
+                                 tenant_name: str = DEFAULT_TENANT):
+    """Снимает все напоминания по записи (при отмене, завершении или удалении)."""
+    for hours_before in config.reminder_offsets_hours:
+        _remove_job(scheduler, _reminder_job_id(appointment_id, hours_before, tenant_name))
+
+
+async def expire_waitlist_offer(entry_id: str, tenant_name: str = DEFAULT_TENANT):
+    """Задача планировщика: срок предложения из листа ожидания истек — время переходит следующему."""
+    waitlist = _runtime.get('waitlist')
+    if waitlist is None:
+        logger.warning("Waitlist offer %s not expired: waitlist is not running.", entry_id)
+        return
+
+    with tracer.span("job.expire_waitlist_offer", root=True, entry_id=entry_id, tenant=tenant_name):
+        elector: Optional[LeaderElector] = _runtime.get('elector')
+        if elector and not await elector.verify():
+            logger.warning("Waitlist offer %s expiry deferred: this replica is not the leader.", entry_id)
+            _retry_as_leader(expire_waitlist_offer, (entry_id, tenant_name), _waitlist_job_id(entry_id, tenant_name))
+            return
+        await waitlist.expire(tenant_name, entry_id)
+
+
+def schedule_waitlist_expiry(scheduler: AsyncIOScheduler, entry_id: str, run_at: datetime,
+                             tenant_name: str = DEFAULT_TENANT):
+    scheduler.add_job(expire_waitlist_offer, 'date', run_date=run_at, args=(entry_id, tenant_name),
+                      id=_waitlist_job_id(entry_id, tenant_name), replace_existing=True, misfire_grace_time=3600)
+
 
-    logger.info(f"Reminder job finished. Sent {sent_count} reminders.")
+def cancel_waitlist_expiry(scheduler: AsyncIOScheduler, entry_id: str, tenant_name: str = DEFAULT_TENANT):
+    _remove_job(scheduler, _waitlist_job_id(entry_id, tenant_name))
 
 
-def setup_scheduler(bot: Bot, db: Database) -> AsyncIOScheduler:
+def register_waitlist(waitlist):
+    """Лист ожидания процесса (utils/waitlist.py) для задач expire_waitlist_offer."""
+    _runtime['waitlist'] = waitlist
+
+
+def _remove_job(scheduler: AsyncIOScheduler, job_id: str):
+    try:
+        scheduler.remove_job(job_id)
+    except JobLookupError:
+        pass
+
+
+async def backfill_reminders(scheduler: AsyncIOScheduler, db: Database, tenant_name: str = DEFAULT_TENANT):
     """
-    Настраивает и возвращает экземпляр планировщика.
+    Ставит напоминания для будущих активных записей, у которых их еще нет
+    (например, созданных до перехода на постоянное хранилище задач). Выполняется один раз при старте.
     """
-    # Указываем часовой пояс, чтобы задача выполнялась в правильное время
-    scheduler = AsyncIOScheduler(timezone="Europe/Moscow")
+    scheduled = 0
+    async for app in db.iter_appointments(start=_now(), status='active'):
+        if not app.client_telegram_id:
+            continue
+        missing = [h for h in config.reminder_offsets_hours
+                   if scheduler.get_job(_reminder_job_id(app.id, h, tenant_name)) is None]
+        if missing:
+            schedule_appointment_reminders(scheduler, app, tenant_name)
+            scheduled += 1
+    logger.info(f"Reminder backfill for tenant '{tenant_name}' finished: {scheduled} appointments scheduled.")
+
+
+async def _poll_shared_jobstore():
+    """Пустая задача: планировщик лидера просыпается по ней и забирает из хранилища наступившие задачи."""
+
+
+def setup_scheduler(tenants: TenantRegistry, elector: Optional[LeaderElector] = None) -> AsyncIOScheduler:
+    """
+    Настраивает и возвращает экземпляр планировщика с постоянным хранилищем задач.
+    Планировщик один на процесс и общий для всех арендаторов.
+    По умолчанию это локальный SQLite; при нескольких копиях бота задайте общий
+    SCHEDULER_JOBSTORE_URL и передайте elector — задачи будет выполнять только лидер.
+    Ведомые копии тоже ставят задачи (напоминания о записях, которые они приняли), но только
+    в общее хранилище: с локальным SQLite эти задачи никто бы не выполнил, поэтому elector
+    без SCHEDULER_JOBSTORE_URL — ошибка конфигурации.
+    """
+    if elector and not config.scheduler_jobstore_url:
+        raise ValueError("LEADER_ELECTION_ENABLED requires a shared SCHEDULER_JOBSTORE_URL: "
+                         "reminders scheduled by followers in a local job store would never run.")
+
+    _runtime['tenants'] = tenants
+    _runtime['elector'] = elector
 
-    # Добавляем задачу, которая будет выполняться каждый день в 19:00
-    scheduler.add_job(send_reminders, 'cron', hour=19, minute=0, args=(bot, db))
+    jobstore_url = config.scheduler_jobstore_url or f"sqlite:///{config.scheduler_db_path}"
+    # Указываем часовой пояс, чтобы задачи выполнялись в правильное время
+    scheduler = AsyncIOScheduler(jobstores={'default': SQLAlchemyJobStore(url=jobstore_url)}, timezone=TIMEZONE)
+    _runtime['scheduler'] = scheduler
+    if elector:
+        # APScheduler не узнает о задачах, добавленных в хранилище другим процессом, и спит до своей
+        # ближайшей задачи. Периодическая задача ограничивает задержку таких напоминаний
+        scheduler.add_job(_poll_shared_jobstore, 'interval', seconds=JOBSTORE_POLL_SECONDS,
+                          id='poll_shared_jobstore', replace_existing=True, coalesce=True)
 
-    logger.info("Scheduler configured. Job 'send_reminders' will run daily at 19:00 (Europe/Moscow).")
+    logger.info(f"Scheduler configured with job store {jobstore_url}. "
+                f"Reminders are sent {config.reminder_offsets_hours} hours before each appointment.")
 
     return scheduler
\ No newline at end of file
@@ -0,0 +1,125 @@
+# utils/tenants.py
+
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.base import BaseSession
+
+from config_reader import Settings, config
+from database.db_supabase import Database
+from database.mirror import MirroredDatabase
+
+logger = logging.getLogger(__name__)
+
+# Арендатор из основных настроек (.env) — так работает и обычный запуск с одним ботом
+DEFAULT_TENANT = 'default'
+
+
+@dataclass(frozen=True)
+class Tenant:
+    """Настройки одного салона (специалиста): свой бот, свой админ и свой проект Supabase."""
+    name: str
+    bot_token: str
+    admin_id: int
+    supabase_url: str
+    supabase_key: str
+    google_calendar_id: Optional[str] = None
+
+
+@dataclass
+class TenantRuntime:
+    """Все, что нужно арендатору во время работы. Сессия HTTP, event loop и планировщик — общие."""
+    tenant: Tenant
+    bot: Bot
+    db: Database
+
+
+def load_tenants(settings: Settings = config) -> List[Tenant]:
+    """
+    Основной арендатор берется из .env, дополнительные — из JSON-файла TENANTS_FILE:
+    [{"name": "...", "bot_token": "...", "admin_id": 123, "supabase_url": "...",
+      "supabase_key": "...", "google_calendar_id": "..."}]
+    """
+    tenants = [Tenant(name=DEFAULT_TENANT, bot_token=settings.bot_token, admin_id=settings.admin_id,
+                      supabase_url=settings.supabase_url, supabase_key=settings.supabase_key)]
+    if settings.tenants_file:
+        with open(settings.tenants_file, encoding='utf-8') as f:
+            for item in json.load(f):
+                tenants.append(Tenant(
+                    name=item['name'],
+                    bot_token=item['bot_token'],
+                    admin_id=int(item['admin_id']),
+                    supabase_url=item['supabase_url'],
+                    supabase_key=item['supabase_key'],
+                    google_calendar_id=item.get('google_calendar_id'),
+                ))
+
+    # Данные арендатора отделены тем, что у каждого свой проект Supabase,
+    # поэтому совпадение токена, имени или проекта — ошибка конфигурации
+    for field_name in ('name', 'bot_token', 'supabase_url'):
+        values = [getattr(tenant, field_name) for tenant in tenants]
+        if len(values) != len(set(values)):
+            raise ValueError(f"Tenants must have unique '{field_name}' values.")
+    return tenants
+
+
+class TenantRegistry:
+    """
+    Арендаторы одного процесса. Все боты работают через одну HTTP-сессию (общий пул соединений
+    и общая очередь исходящих запросов), поэтому арендатор — это только Bot, Database и его настройки.
+    """
+
+    def __init__(self, tenants: List[Tenant], session: BaseSession, default: DefaultBotProperties):
+        self._by_name: Dict[str, TenantRuntime] = {}
+        self._by_bot_id: Dict[int, TenantRuntime] = {}
+        for tenant in tenants:
+            runtime = TenantRuntime(
+                tenant=tenant,
+                bot=Bot(token=tenant.bot_token, session=session, default=default),
+                db=self._create_database(tenant),
+            )
+            self._by_name[tenant.name] = runtime
+            self._by_bot_id[runtime.bot.id] = runtime
+        logger.info(f"Tenant registry: {', '.join(self._by_name)}.")
+
+    @staticmethod
+    def _create_database(tenant: Tenant) -> Database:
+        if not config.read_mirror_enabled:
+            return Database(url=tenant.supabase_url, key=tenant.supabase_key, calendar_id=tenant.google_calendar_id)
+        # У каждого арендатора свой файл копии: mirror.sqlite, mirror.<имя>.sqlite
+        path = config.read_mirror_path
+        if tenant.name != DEFAULT_TENANT:
+            root, ext = os.path.splitext(path)
+            path = f"{root}.{tenant.name}{ext}"
+        return MirroredDatabase(url=tenant.supabase_url, key=tenant.supabase_key,
+                                calendar_id=tenant.google_calendar_id, path=path,
+                                sync_seconds=config.read_mirror_sync_seconds)
+
+    @property
+    def mirrors(self) -> List[MirroredDatabase]:
+        return [runtime.db for runtime in self if isinstance(runtime.db, MirroredDatabase)]
+
+    def __iter__(self) -> Iterator[TenantRuntime]:
+        return iter(self._by_name.values())
+
+    def __len__(self) -> int:
+        return len(self._by_name)
+
+    @property
+    def default(self) -> TenantRuntime:
+        return self._by_name[DEFAULT_TENANT]
+
+    @property
+    def bots(self) -> List[Bot]:
+        return [runtime.bot for runtime in self]
+
+    def get(self, name: str) -> Optional[TenantRuntime]:
+        return self._by_name.get(name)
+
+    def for_bot(self, bot: Bot) -> Optional[TenantRuntime]:
+        return self._by_bot_id.get(bot.id)
@@ -0,0 +1,168 @@
+# utils/tracing.py
+
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field, asdict
+from typing import Any, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SLOW_MS = 1000
+DEFAULT_RING_SIZE = 200
+# Ограничение на число спанов в одном трейсе, чтобы длинные операции не раздували память
+MAX_SPANS_PER_TRACE = 200
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start_ts: float
+    duration_ms: Optional[float] = None
+    error: Optional[str] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class Trace:
+    trace_id: str
+    root: Span
+    spans: List[Span] = field(default_factory=list)
+    dropped_spans: int = 0
+
+    def to_dict(self) -> dict:
+        return {
+            'trace_id': self.trace_id,
+            'name': self.root.name,
+            'duration_ms': self.root.duration_ms,
+            'error': self.root.error,
+            'dropped_spans': self.dropped_spans,
+            'spans': [asdict(span) for span in self.spans],
+        }
+
+
+# Текущий спан и трейс передаются через contextvars, поэтому доходят и до asyncio.to_thread
+_current_span: ContextVar[Optional[Span]] = ContextVar('current_span', default=None)
+_current_trace: ContextVar[Optional[Trace]] = ContextVar('current_trace', default=None)
+
+
+class Tracer:
+    """
+    Легковесная трассировка: корневой спан открывается на каждый апдейт (или задачу планировщика),
+    вложенные — в Database, Google Calendar, Gemini и запросах к Bot API.
+    Решение о сохранении принимается по завершении трейса (tail sampling):
+    медленные и упавшие трейсы сохраняются всегда, остальные — с вероятностью sample_rate.
+    """
+
+    def __init__(self, slow_ms: float = DEFAULT_SLOW_MS, sample_rate: float = 0.0,
+                 ring_size: int = DEFAULT_RING_SIZE, file_path: Optional[str] = None):
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.file_path = file_path
+        self.recent: Deque[dict] = deque(maxlen=ring_size)
+        self._file_lock = threading.Lock()
+
+    def configure(self, slow_ms: float, sample_rate: float, file_path: Optional[str] = None):
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.file_path = file_path
+
+    @contextmanager
+    def span(self, name: str, root: bool = False, **attributes):
+        """
+        Открывает спан. Вне трейса (и без root=True) ничего не делает,
+        так что вызовы из скриптов и тестов почти ничего не стоят.
+        """
+        parent = _current_span.get()
+        trace = _current_trace.get()
+        if trace is None and not root:
+            yield None
+            return
+
+        span = Span(
+            name=name,
+            trace_id=trace.trace_id if trace and not root else uuid.uuid4().hex,
+            span_id=uuid.uuid4().hex[:16],
+            parent_id=parent.span_id if parent and not root else None,
+            start_ts=time.time(),
+            attributes=attributes,
+        )
+        if root:
+            trace = Trace(trace_id=span.trace_id, root=span)
+        if len(trace.spans) < MAX_SPANS_PER_TRACE:
+            trace.spans.append(span)
+        else:
+            trace.dropped_spans += 1
+
+        span_token = _current_span.set(span)
+        trace_token = _current_trace.set(trace) if root else None
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.duration_ms = round((time.perf_counter() - started) * 1000, 2)
+            _current_span.reset(span_token)
+            if root:
+                _current_trace.reset(trace_token)
+                self._finish(trace)
+
+    def _finish(self, trace: Trace):
+        root = trace.root
+        keep = bool(root.error) or root.duration_ms >= self.slow_ms or random.random() < self.sample_rate
+        if not keep:
+            return
+        record = trace.to_dict()
+        self.recent.append(record)
+        if root.duration_ms >= self.slow_ms:
+            logger.warning("Slow trace %s '%s': %.0f ms", trace.trace_id, root.name, root.duration_ms)
+        if self.file_path:
+            line = json.dumps(record, ensure_ascii=False, default=str)
+            try:
+                # Запись в файл — в пуле потоков, чтобы не блокировать event loop
+                asyncio.get_running_loop().run_in_executor(None, self._write_line, line)
+            except RuntimeError:
+                self._write_line(line)
+
+    def _write_line(self, line: str):
+        with self._file_lock:
+            with open(self.file_path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+
+tracer = Tracer()
+
+
+def traced(name: Optional[str] = None):
+    """Декоратор: оборачивает вызов функции (синхронной или async) в спан."""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with tracer.span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
@@ -0,0 +1,371 @@
+# utils/waitlist.py
+
+import asyncio
+import heapq
+import logging
+import uuid
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from aiogram.exceptions import TelegramAPIError
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from config_reader import config
+from database.models import Appointment, WaitlistEntry
+from keyboards.client_keyboards import get_waitlist_offer_keyboard
+from middlewares.outbound import Priority, send_priority
+import utils.google_calendar
+from utils.agenda import agenda_cache, client_appointments_cache
+from utils.notifications import notify_admin_on_new_booking
+from utils.scheduler import (TIMEZONE, cancel_waitlist_expiry, register_waitlist, schedule_appointment_reminders,
+                             schedule_waitlist_expiry)
+from utils.tenants import TenantRegistry, TenantRuntime
+from utils.working_hours import working_hours
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class WaitlistWindow:
+    label: str
+    start: time
+    end: time
+
+
+# Окна, в которые клиент готов прийти; фактически время ограничено рабочим днем
+WAITLIST_WINDOWS: Dict[str, WaitlistWindow] = {
+    'all': WaitlistWindow("Весь день", time.min, time.max),
+    'morning': WaitlistWindow("Утро (до 12:00)", time.min, time(12)),
+    'day': WaitlistWindow("День (12:00–16:00)", time(12), time(16)),
+    'evening': WaitlistWindow("Вечер (после 16:00)", time(16), time.max),
+}
+
+
+def _now() -> datetime:
+    # Время записей хранится без таймзоны, по Москве
+    return datetime.now(ZoneInfo(TIMEZONE)).replace(tzinfo=None)
+
+
+def entry_slot_starts(entry: WaitlistEntry, duration_minutes: int) -> List[datetime]:
+    """Начала приема по сетке графика, при которых вся услуга помещается в окно заявки."""
+    window_start = datetime.combine(entry.day, entry.window_start)
+    window_end = datetime.combine(entry.day, entry.window_end)
+    duration = timedelta(minutes=duration_minutes)
+    return [start for start in working_hours.free_start_times(entry.day, [], duration_minutes)
+            if window_start <= start and start + duration <= window_end]
+
+
+class WaitlistIndex:
+    """
+    Очередь ожидания одного арендатора в памяти: начало слота -> куча (created_at, id заявки).
+    Заявка на окно лежит в куче каждого слота сетки внутри окна, поэтому освободившийся слот
+    находит первого ожидающего за O(log n): поиск по словарю и извлечение из кучи.
+    Заявки, которые больше не ждут, удаляются из куч лениво — при извлечении.
+    """
+
+    def __init__(self):
+        self._slots: Dict[datetime, List[Tuple[datetime, str]]] = {}
+        self.entries: Dict[str, WaitlistEntry] = {}
+        self.durations: Dict[str, int] = {}  # id заявки -> длительность услуги, минуты
+
+    def add(self, entry: WaitlistEntry, duration_minutes: int):
+        self.entries[entry.id] = entry
+        self.durations[entry.id] = duration_minutes
+        for start in entry_slot_starts(entry, duration_minutes):
+            self.push(start, entry)
+
+    def push(self, slot: datetime, entry: WaitlistEntry):
+        heapq.heappush(self._slots.setdefault(slot, []), (entry.created_at or datetime.min, entry.id))
+
+    def pop_waiting(self, slot: datetime) -> Optional[WaitlistEntry]:
+        """Первая по очереди ожидающая заявка на слот. Заявки с активным предложением остаются в куче."""
+        heap = self._slots.get(slot)
+        offered = []
+        entry = None
+        while heap:
+            item = heapq.heappop(heap)
+            candidate = self.entries.get(item[1])
+            if candidate is None:
+                continue  # Заявка закрыта — выбрасываем
+            if candidate.status == 'offered':
+                offered.append(item)  # Клиенту уже предложили другое время; если он откажется, снова в очереди
+                continue
+            entry = candidate
+            break
+        for item in offered:
+            heapq.heappush(heap, item)
+        if heap is not None and not heap:
+            del self._slots[slot]
+        return entry
+
+    def discard(self, entry_id: str):
+        self.entries.pop(entry_id, None)
+        self.durations.pop(entry_id, None)
+
+    def offered_on(self, day: date) -> List[WaitlistEntry]:
+        return [entry for entry in self.entries.values()
+                if entry.status == 'offered' and entry.offered_slot and entry.offered_slot.date() == day]
+
+    def prune(self, today: date):
+        """Убирает слоты и заявки прошедших дней."""
+        for slot in [slot for slot in self._slots if slot.date() < today]:
+            del self._slots[slot]
+        for entry_id in [entry.id for entry in self.entries.values() if entry.day < today]:
+            self.discard(entry_id)
+
+
+class Waitlist:
+    """
+    Лист ожидания всех арендаторов процесса. Отмена или удаление активной записи
+    (Database.slot_freed_listeners) предлагает освободившееся время первому подходящему клиенту
+    из очереди; у него есть config.waitlist_claim_minutes минут, затем время переходит следующему
+    (задача expire_waitlist_offer в utils/scheduler.py).
+    Очередь хранится в таблице waitlist, индекс в памяти строится из нее при старте (load).
+    При нескольких копиях бота каждая видит только заявки, поставленные через нее после старта.
+    """
+
+    def __init__(self, tenants: TenantRegistry, scheduler: AsyncIOScheduler):
+        self.tenants = tenants
+        self.scheduler = scheduler
+        self._indexes: Dict[str, WaitlistIndex] = {}
+        # Предложения и их истечение по арендатору выполняются по очереди
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._pruned_on: Optional[date] = None
+        for runtime in tenants:
+            self._indexes[runtime.tenant.name] = WaitlistIndex()
+            self._locks[runtime.tenant.name] = asyncio.Lock()
+            runtime.db.slot_freed_listeners.append(partial(self.on_slot_freed, runtime.tenant.name))
+        register_waitlist(self)
+
+    async def _duration_for(self, runtime: TenantRuntime, service_id: str) -> int:
+        return working_hours.duration_for(await runtime.db.get_service_by_id(service_id))
+
+    async def load(self):
+        """Заполняет индексы ожидающими заявками на сегодня и позже. Выполняется один раз при старте."""
+        today = _now().date()
+        for runtime in self.tenants:
+            index = self._indexes[runtime.tenant.name]
+            durations: Dict[str, int] = {}
+            async for entry in runtime.db.iter_waitlist_entries(today):
+                if entry.service_id not in durations:
+                    durations[entry.service_id] = await self._duration_for(runtime, entry.service_id)
+                index.add(entry, durations[entry.service_id])
+            logger.info("Waitlist for tenant '%s' loaded: %s entries.", runtime.tenant.name, len(index.entries))
+        self._pruned_on = today
+
+    async def join(self, tenant_name: str, entry: WaitlistEntry) -> Optional[WaitlistEntry]:
+        """Ставит заявку в очередь. Возвращает сохраненную заявку или None при ошибке."""
+        runtime = self.tenants.get(tenant_name)
+        duration = await self._duration_for(runtime, entry.service_id)
+        saved = await runtime.db.add_waitlist_entry(entry)
+        if saved and saved.status == 'waiting' and saved.id not in self._indexes[tenant_name].entries:
+            self._indexes[tenant_name].add(saved, duration)
+            logger.info("Client %s joined the waitlist for %s.", saved.client_telegram_id, saved.day)
+        return saved
+
+    async def on_slot_freed(self, tenant_name: str, appointment: Appointment):
+        """Подписчик Database: запись отменена или удалена, ее время предлагается ожидающим."""
+        try:
+            now = _now()
+            if appointment.appointment_time <= now:
+                return
+            if self._pruned_on != now.date():
+                for index in self._indexes.values():
+                    index.prune(now.date())
+                self._pruned_on = now.date()
+
+            start, end = working_hours.appointment_interval(appointment)
+            step = timedelta(minutes=working_hours.slot_minutes)
+            slots = []
+            slot = start
+            while slot < end:
+                slots.append(slot)
+                slot += step
+            async with self._locks[tenant_name]:
+                await self._offer_slots(self.tenants.get(tenant_name), slots, freed_id=appointment.id)
+        except Exception as e:
+            logger.error("Waitlist: failed to handle freed slot of appointment %s: %s", appointment.id, e, exc_info=True)
+
+    async def _offer_slots(self, runtime: TenantRuntime, slots: List[datetime], freed_id: Optional[str] = None):
+        """
+        Предлагает каждый слот первому ожидающему, чья услуга помещается в свободное время.
+        Время под уже отправленными предложениями считается занятым. Вызывается под блокировкой арендатора.
+        freed_id — освободившая время запись: локальная копия (database/mirror.py) могла еще не узнать об отмене.
+        """
+        if not slots:
+            return
+        index = self._indexes[runtime.tenant.name]
+        day = slots[0].date()
+        busy = [app for app in await runtime.db.get_appointments_for_day(slots[0])
+                if app.appointment_time and app.id != freed_id]
+        busy.extend(Appointment(client_name=entry.client_name, appointment_time=entry.offered_slot,
+                                service_id=entry.service_id, service_duration_minutes=index.durations.get(entry.id))
+                    for entry in index.offered_on(day))
+
+        for slot in slots:
+            if slot <= _now():
+                continue
+            skipped = []
+            while True:
+                entry = index.pop_waiting(slot)
+                if entry is None:
+                    break
+                duration = index.durations[entry.id]
+                if slot not in working_hours.free_start_times_for(day, busy, duration, config.booking_resources):
+                    skipped.append(entry)  # Услуга длиннее освободившегося времени — ждет дальше
+                    continue
+                if await self._offer(runtime, entry, slot):
+                    busy.append(Appointment(client_name=entry.client_name, appointment_time=slot,
+                                            service_id=entry.service_id, service_duration_minutes=duration))
+                    break
+            for entry in skipped:
+                index.push(slot, entry)
+
+    async def _offer(self, runtime: TenantRuntime, entry: WaitlistEntry, slot: datetime) -> bool:
+        index = self._indexes[runtime.tenant.name]
+        offered_until = _now() + timedelta(minutes=config.waitlist_claim_minutes)
+        offered = await runtime.db.update_waitlist_status(entry.id, 'offered', expected_status='waiting',
+                                                          offered_slot=slot, offered_until=offered_until)
+        if not offered:
+            # Заявку сняли или с ней уже работает другая копия бота
+            index.discard(entry.id)
+            return False
+        index.entries[entry.id] = offered
+
+        service = await runtime.db.get_service_by_id(entry.service_id)
+        text = (
+            f"🔔 <b>Освободилось время!</b>\n\n"
+            f"<b>Услуга:</b> {service.title if service else 'Не указана'}\n"
+            f"<b>Время:</b> {slot.strftime('%d.%m.%Y в %H:%M')}\n\n"
+            f"Время закреплено за вами до {offered_until.strftime('%H:%M')}. "
+            f"Потом оно будет предложено следующему в очереди."
+        )
+        try:
+            with send_priority(Priority.NOTIFICATION):
+                await runtime.bot.send_message(entry.client_telegram_id, text,
+                                               reply_markup=get_waitlist_offer_keyboard(entry.id))
+        except TelegramAPIError as e:
+            # Клиент недоступен (например, заблокировал бота) — снимаем заявку
+            logger.warning("Waitlist offer to %s failed, entry %s cancelled: %s", entry.client_telegram_id, entry.id, e)
+            await runtime.db.update_waitlist_status(entry.id, 'cancelled', expected_status='offered')
+            index.discard(entry.id)
+            return False
+
+        schedule_waitlist_expiry(self.scheduler, entry.id, offered_until, runtime.tenant.name)
+        logger.info("Waitlist entry %s offered %s until %s.", entry.id, slot, offered_until)
+        return True
+
+    async def _release(self, runtime: TenantRuntime, entry_id: str) -> Optional[WaitlistEntry]:
+        """Возвращает заявку из 'offered' в очередь и предлагает ее время следующему."""
+        entry = await runtime.db.update_waitlist_status(entry_id, 'waiting', expected_status='offered')
+        if not entry:
+            return None
+        index = self._indexes[runtime.tenant.name]
+        if entry_id in index.entries:
+            # Заявка остается в кучах других слотов; из кучи предложенного слота она уже извлечена
+            index.entries[entry_id] = entry
+        await self._offer_slots(runtime, [entry.offered_slot])
+        return entry
+
+    async def expire(self, tenant_name: str, entry_id: str):
+        """Срок предложения истек (задача планировщика)."""
+        runtime = self.tenants.get(tenant_name)
+        async with self._locks[tenant_name]:
+            entry = await self._release(runtime, entry_id)
+        if not entry:
+            return  # Клиент уже ответил
+        logger.info("Waitlist offer %s expired.", entry_id)
+        try:
+            with send_priority(Priority.NOTIFICATION):
+                await runtime.bot.send_message(
+                    entry.client_telegram_id,
+                    f"⌛️ Время {entry.offered_slot.strftime('%d.%m в %H:%M')} больше не закреплено за вами. "
+                    f"Вы остаетесь в листе ожидания.")
+        except TelegramAPIError as e:
+            logger.warning("Failed to notify %s about expired waitlist offer: %s", entry.client_telegram_id, e)
+
+    async def decline(self, tenant_name: str, entry_id: str, client_telegram_id: int) -> bool:
+        """Клиент отказался от предложенного времени и остается в очереди на другие слоты."""
+        runtime = self.tenants.get(tenant_name)
+        async with self._locks[tenant_name]:
+            entry = await runtime.db.get_waitlist_entry(entry_id)
+            if not entry or entry.client_telegram_id != client_telegram_id:
+                return False
+            if not await self._release(runtime, entry_id):
+                return False
+        cancel_waitlist_expiry(self.scheduler, entry_id, tenant_name)
+        return True
+
+    async def claim(self, tenant_name: str, entry_id: str, client_telegram_id: int) -> str:
+        """
+        Клиент принимает предложение. Возвращает статус бронирования ('ok', 'slot_taken', 'error', ...)
+        или 'expired', если предложение уже недействительно.
+        Ключ идемпотентности выводится из заявки и слота, поэтому повторное нажатие не создаст дубль.
+        """
+        runtime = self.tenants.get(tenant_name)
+        db = runtime.db
+        async with self._locks[tenant_name]:
+            entry = await db.get_waitlist_entry(entry_id)
+            if not entry or entry.client_telegram_id != client_telegram_id:
+                return 'expired'
+            if entry.status == 'fulfilled':
+                return 'ok'  # Повторное нажатие: запись уже создана
+            if entry.status != 'offered' or not entry.offered_slot or \
+                    (entry.offered_until and entry.offered_until < _now()):
+                return 'expired'
+
+            idempotency_key = uuid.uuid5(uuid.NAMESPACE_URL,
+                                         f"waitlist:{entry.id}:{entry.offered_slot.isoformat()}").hex
+            service = await db.get_service_by_id(entry.service_id)
+            google_event_id = await utils.google_calendar.create_google_calendar_event(
+                appointment_time_str=entry.offered_slot.strftime('%Y-%m-%d %H:%M'),
+                service_title=service.title if service else '',
+                client_name=entry.client_name,
+                client_phone=entry.client_phone,
+                service_duration_minutes=working_hours.duration_for(service),
+                calendar_id=db.calendar_id,
+                event_id=idempotency_key
+            )
+            appointment = Appointment(
+                client_name=entry.client_name,
+                client_telegram_id=entry.client_telegram_id,
+                service_id=entry.service_id,
+                appointment_time=entry.offered_slot,
+                client_phone=entry.client_phone,
+                google_event_id=google_event_id,
+                idempotency_key=idempotency_key
+            )
+            booking = await db.book_appointment(appointment, waitlist_entry_id=entry.id)
+
+            if booking.status == 'error':
+                # Запрос мог дойти до БД — предложение и событие остаются, повтор с тем же ключом безопасен
+                return booking.status
+            if booking.ok:
+                await db.update_waitlist_status(entry.id, 'fulfilled')
+                self._indexes[tenant_name].discard(entry.id)
+            else:
+                if google_event_id:
+                    # Клиент Google Calendar синхронный: под блокировкой арендатора не держим event loop
+                    await asyncio.to_thread(utils.google_calendar.delete_google_calendar_event,
+                                            google_event_id, db.calendar_id)
+                # Время заняли в обход очереди — заявка ждет другие слоты
+                entry = await db.update_waitlist_status(entry.id, 'waiting', expected_status='offered')
+                if entry and entry.id in self._indexes[tenant_name].entries:
+                    self._indexes[tenant_name].entries[entry.id] = entry
+        cancel_waitlist_expiry(self.scheduler, entry_id, tenant_name)
+
+        if booking.ok:
+            agenda_cache.invalidate(db)
+            client_appointments_cache.invalidate(db, client_telegram_id)
+            if not booking.replayed:
+                appointment.id = booking.appointment_id
+                schedule_appointment_reminders(self.scheduler, appointment, tenant_name)
+                await notify_admin_on_new_booking(bot=runtime.bot, appointment=appointment,
+                                                  service_title=booking.service_title,
+                                                  service_price=booking.service_price,
+                                                  admin_id=runtime.tenant.admin_id)
+            logger.info("Waitlist entry %s fulfilled: appointment %s.", entry_id, booking.appointment_id)
+        return booking.status
@@ -0,0 +1,206 @@
+# utils/working_hours.py
+
+import math
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from config_reader import Settings, config
+from database.models import Appointment, Service
+
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+Interval = Tuple[datetime, datetime]
+
+# Занятость ресурсов хранится по ячейкам в 5 минут: 288 байт на ресурс в день
+OCCUPANCY_CELL_MINUTES = 5
+CELLS_PER_DAY = 24 * 60 // OCCUPANCY_CELL_MINUTES
+
+
+def _parse_range(value: str) -> Tuple[time, time]:
+    """'09:00-18:00' -> (09:00, 18:00)."""
+    start, end = value.split('-')
+    start_time, end_time = time.fromisoformat(start.strip()), time.fromisoformat(end.strip())
+    if start_time >= end_time:
+        raise ValueError(f"Invalid time range '{value}': start must be before end.")
+    return start_time, end_time
+
+
+def merge_intervals(intervals: Iterable[Interval]) -> List[Interval]:
+    """Сортирует интервалы по началу и одним проходом сливает пересекающиеся и смежные. O(n log n)."""
+    merged: List[Interval] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def overlaps(first: Interval, second: Interval) -> bool:
+    """Полуоткрытые интервалы [start, end) пересекаются (стык концов — не пересечение)."""
+    return first[0] < second[1] and second[0] < first[1]
+
+
+class DayOccupancy:
+    """
+    Занятость ресурсов (кресел, мастеров) за один день: на каждый ресурс — bytearray
+    ячеек по OCCUPANCY_CELL_MINUTES минут (1 — занято). Проверка свободного интервала —
+    поиск байта в срезе, то есть на стороне C, без цикла по записям.
+    Записи без ресурса (созданные до появления ресурсов) относятся к первому ресурсу — так же считает RPC.
+    """
+
+    def __init__(self, target_date: date, resources: Sequence[str]):
+        self.day_start = datetime.combine(target_date, time.min)
+        self.resources = list(resources)
+        self._index = {resource: index for index, resource in enumerate(self.resources)}
+        self.cells = [bytearray(CELLS_PER_DAY) for _ in self.resources]
+
+    def _cell_range(self, interval: Interval) -> Tuple[int, int]:
+        start_minutes = (interval[0] - self.day_start).total_seconds() / 60
+        end_minutes = (interval[1] - self.day_start).total_seconds() / 60
+        first = max(0, math.floor(start_minutes / OCCUPANCY_CELL_MINUTES))
+        last = min(CELLS_PER_DAY, math.ceil(end_minutes / OCCUPANCY_CELL_MINUTES))
+        return first, last
+
+    def occupy(self, resource: Optional[str], interval: Interval):
+        first, last = self._cell_range(interval)
+        if first < last:
+            self.cells[self._index.get(resource, 0)][first:last] = b'\x01' * (last - first)
+
+    def block(self, interval: Interval):
+        """Занимает интервал у всех ресурсов (перерыв)."""
+        for resource in self.resources:
+            self.occupy(resource, interval)
+
+    def free_resource(self, interval: Interval) -> Optional[str]:
+        """Первый ресурс, свободный на весь интервал, или None, если мест нет."""
+        first, last = self._cell_range(interval)
+        for resource, cells in zip(self.resources, self.cells):
+            if cells.find(1, first, last) == -1:
+                return resource
+        return None
+
+    def free_capacity(self, interval: Interval) -> int:
+        first, last = self._cell_range(interval)
+        return sum(1 for cells in self.cells if cells.find(1, first, last) == -1)
+
+
+@dataclass(frozen=True)
+class WorkingDay:
+    start: time
+    end: time
+    breaks: Tuple[Tuple[time, time], ...] = ()
+
+
+class WorkingHours:
+    """
+    Рабочее время по дням недели с перерывами, шаг сетки записи и длительности услуг.
+    Свободное время считается так: занятые записи и перерывы сортируются и сливаются в
+    непересекающиеся интервалы, затем сетка начала приема проходится одним указателем по ним.
+    """
+
+    def __init__(self, days: Dict[int, WorkingDay], slot_minutes: int = 60, default_duration_minutes: int = 60):
+        self.days = days
+        self.slot_minutes = slot_minutes
+        self.default_duration_minutes = default_duration_minutes
+
+    @classmethod
+    def from_settings(cls, settings: Settings = config) -> 'WorkingHours':
+        days = {}
+        for weekday, name in enumerate(WEEKDAYS):
+            hours = settings.working_hours.get(name)
+            if not hours:
+                continue  # Выходной
+            start, end = _parse_range(hours)
+            breaks = tuple(sorted(_parse_range(value) for value in settings.working_breaks.get(name, [])))
+            days[weekday] = WorkingDay(start=start, end=end, breaks=breaks)
+        return cls(days, slot_minutes=settings.slot_step_minutes,
+                   default_duration_minutes=settings.default_service_duration_minutes)
+
+    def day(self, target_date: date) -> Optional[WorkingDay]:
+        return self.days.get(target_date.weekday())
+
+    def is_working_day(self, target_date: date) -> bool:
+        return target_date.weekday() in self.days
+
+    def duration_for(self, service: Optional[Service]) -> int:
+        """Длительность услуги в минутах (для услуг без длительности — значение по умолчанию)."""
+        return (service.duration_minutes if service else None) or self.default_duration_minutes
+
+    def appointment_interval(self, appointment: Appointment) -> Interval:
+        duration = appointment.service_duration_minutes or self.default_duration_minutes
+        return appointment.appointment_time, appointment.appointment_time + timedelta(minutes=duration)
+
+    def free_start_times(self, target_date: date, busy: Iterable[Interval], duration_minutes: int) -> List[datetime]:
+        """
+        Возможные начала приема длительностью duration_minutes в этот день:
+        по сетке slot_minutes от начала рабочего дня, без пересечений с busy и перерывами,
+        с окончанием не позже конца рабочего дня. O(n log n) по числу занятых интервалов.
+        """
+        working_day = self.day(target_date)
+        if working_day is None:
+            return []
+
+        open_at = datetime.combine(target_date, working_day.start)
+        close_at = datetime.combine(target_date, working_day.end)
+        blocked = list(busy)
+        blocked.extend((datetime.combine(target_date, start), datetime.combine(target_date, end))
+                       for start, end in working_day.breaks)
+        merged = merge_intervals(blocked)
+
+        step = timedelta(minutes=self.slot_minutes)
+        duration = timedelta(minutes=duration_minutes)
+        free_times = []
+        index = 0
+        candidate = open_at
+        while candidate + duration <= close_at:
+            # Интервалы, закончившиеся до кандидата, больше не понадобятся: сетка идет только вперед
+            while index < len(merged) and merged[index][1] <= candidate:
+                index += 1
+            if index < len(merged) and merged[index][0] < candidate + duration:
+                # Пересечение: следующий кандидат — первый шаг сетки после конца занятого интервала
+                steps = math.ceil((merged[index][1] - open_at) / step)
+                candidate = open_at + steps * step
+                continue
+            free_times.append(candidate)
+            candidate += step
+        return free_times
+
+    def free_start_times_with_capacity(self, target_date: date, appointments: Iterable[Appointment],
+                                       duration_minutes: int, resources: Sequence[str]) -> List[datetime]:
+        """
+        То же для нескольких ресурсов: время показывается, пока хотя бы один ресурс
+        свободен на всю длительность услуги.
+        """
+        working_day = self.day(target_date)
+        if working_day is None:
+            return []
+
+        occupancy = DayOccupancy(target_date, resources)
+        for start, end in working_day.breaks:
+            occupancy.block((datetime.combine(target_date, start), datetime.combine(target_date, end)))
+        for appointment in appointments:
+            occupancy.occupy(appointment.resource, self.appointment_interval(appointment))
+
+        close_at = datetime.combine(target_date, working_day.end)
+        step = timedelta(minutes=self.slot_minutes)
+        duration = timedelta(minutes=duration_minutes)
+        free_times = []
+        candidate = datetime.combine(target_date, working_day.start)
+        while candidate + duration <= close_at:
+            if occupancy.free_resource((candidate, candidate + duration)) is not None:
+                free_times.append(candidate)
+            candidate += step
+        return free_times
+
+    def free_start_times_for(self, target_date: date, appointments: Iterable[Appointment],
+                             duration_minutes: int, resources: Sequence[str] = ()) -> List[datetime]:
+        """Свободные начала приема с учетом записей дня: при нескольких ресурсах — по вместимости."""
+        if len(resources) > 1:
+            return self.free_start_times_with_capacity(target_date, appointments, duration_minutes, resources)
+        busy = [self.appointment_interval(app) for app in appointments]
+        return self.free_start_times(target_date, busy, duration_minutes)
+
+
+working_hours = WorkingHours.from_settings()